@@ -0,0 +1,165 @@
+"""
+Offline inputs for the benchmarks: the fixture dbs scaled up with synthetic copies, and synthetic pages.
+
+scale_section(section, n) returns a FeedDB section holding the original influencers and tweets plus n - 1
+copies of them. Copy k gets new tweet ids (id + k * ID_STRIDE, so the same tweet maps to the same copy in
+every fixture file), new user ids and screen names, and its own external urls (url + /copy-k), so a scaled
+build has n times the tweets, quoted tweets and articles, not n times the votes on the same ones.
+
+synthetic_pages() answers every non local http request with a generated html page, for the page metadata
+fetcher and the link resolver.
+"""
+import io
+import contextlib
+from unittest import mock
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+ID_STRIDE = 2**56  # copy k of tweet id i is i + k * ID_STRIDE, which stays inside an int64 up to 128 copies
+MAX_SCALE = 128
+
+LOCAL_HOSTS = {"127.0.0.1", "localhost"}
+PAGE_PADDING = 16 * 1024  # bytes of body after the head, pages are only read up to </head>
+
+
+def copy_tweet_id(tweet_id, k):
+    return tweet_id if k == 0 or tweet_id is None else str(int(tweet_id) + k * ID_STRIDE)
+
+
+def copy_user_id(user_id, k):
+    return user_id if k == 0 or user_id is None else f"{user_id}{k:03d}"
+
+
+def copy_url(url, k):
+    return url if k == 0 else f"{url.rstrip('/')}/copy-{k}"
+
+
+def copy_tweet(tweet, k):
+    if k == 0:
+        return tweet
+    tweet = {**tweet, "id": copy_tweet_id(tweet["id"], k)}
+    if "author_id" in tweet:
+        tweet["author_id"] = copy_user_id(tweet["author_id"], k)
+    if tweet.get("referenced_tweets"):
+        tweet["referenced_tweets"] = [
+            {**i, "id": copy_tweet_id(i["id"], k)} for i in tweet["referenced_tweets"]
+        ]
+    if tweet.get("entities", {}).get("urls"):
+        tweet["entities"] = {
+            **tweet["entities"],
+            "urls": [
+                {**i, **{key: copy_url(i[key], k) for key in ("expanded_url", "unwound_url") if key in i}}
+                for i in tweet["entities"]["urls"]
+            ],
+        }
+    return tweet
+
+
+def copy_influencer(influencer, k):
+    if k == 0:
+        return influencer
+    account = influencer["social_account"]["social_account"]
+    copy = {
+        **influencer,
+        "id": f"{influencer.get('id')}-{k}",
+        "social_account": {
+            **influencer["social_account"],
+            "social_account": {
+                **account,
+                "id": copy_user_id(account["id"], k),
+                "screen_name": f"{account['screen_name']}_{k}",
+            },
+        },
+    }
+    if "tweets" in influencer:
+        copy["tweets"] = [copy_tweet(i, k) for i in influencer["tweets"]]
+    return copy
+
+
+def copy_bank_entry(entry, k):
+    copy = {
+        **entry,
+        "external_urls": [copy_url(i, k) for i in entry["external_urls"]],
+        "vote_tweets": [copy_tweet(i, k) for i in entry["vote_tweets"]],
+    }
+    if entry.get("ref_tweet_data"):
+        copy["ref_tweet_data"] = copy_tweet(entry["ref_tweet_data"], k)
+    return copy
+
+
+def scale_section(section, n):
+    """
+    section (dict): a FeedDB cluster section (see Feed.dict), optionally with its external url quote tweet bank
+    n (int): 1 returns the section as it is, up to MAX_SCALE
+
+    The external url feed and anything derived from the bank is dropped, a scaled db is meant to be built
+    """
+    if not 1 <= n <= MAX_SCALE:
+        raise ValueError(f"scale must be between 1 and {MAX_SCALE}")
+    copies = range(n)
+    scaled = {
+        "influencers": [copy_influencer(i, k) for k in copies for i in section["influencers"]],
+        "cluster": section.get("cluster"),
+        "all_feed_tweets": [copy_tweet(i, k) for k in copies for i in section["all_feed_tweets"]],
+    }
+    bank = section.get("external_url_quote_tweet_bank")
+    if bank:
+        scaled["external_url_quote_tweet_bank"] = {
+            copy_tweet_id(ref_tweet_id, k): copy_bank_entry(entry, k)
+            for k in copies
+            for ref_tweet_id, entry in bank.items()
+        }
+    return scaled
+
+
+def synthetic_page(url):
+    """
+    A deterministic html page for url, with the head tags PageMetadataFetcher reads and a body after them
+    """
+    path = urlsplit(url).path.strip("/") or "home"
+    head = (
+        "<!doctype html><html><head>"
+        '<meta charset="utf-8">'
+        f"<title>{path} | synthetic</title>"
+        f'<meta name="description" content="A synthetic page standing in for {url}">'
+        f'<meta property="og:image" content="{url.rstrip("/")}/cover.png">'
+        f'<link rel="canonical" href="{url}">'
+        "</head><body>"
+    )
+    body = "<p>" + "lorem ipsum dolor sit amet " * (PAGE_PADDING // 27) + "</p></body></html>"
+    return (head + body).encode()
+
+
+class SyntheticPagesAdapter(HTTPAdapter):
+    """
+    Answers every request with synthetic_page, without touching the network
+    """
+
+    def send(self, request, **kwargs):
+        res = requests.Response()
+        res.status_code = 200
+        res.url = request.url
+        res.request = request
+        res.encoding = "utf-8"
+        res.headers["Content-Type"] = "text/html; charset=utf-8"
+        res.raw = io.BytesIO(b"" if request.method == "HEAD" else synthetic_page(request.url))
+        return res
+
+
+@contextlib.contextmanager
+def synthetic_pages():
+    """
+    Route every requests session's non local requests to SyntheticPagesAdapter (the stand-in server stays reachable)
+    """
+    adapter = SyntheticPagesAdapter()
+    get_adapter = requests.Session.get_adapter
+
+    def pick_adapter(session, url):
+        if urlsplit(url).hostname in LOCAL_HOSTS:
+            return get_adapter(session, url)
+        return adapter
+
+    with mock.patch.object(requests.Session, "get_adapter", pick_adapter):
+        yield
@@ -0,0 +1,392 @@
+"""
+Benchmarks of the hot paths, on the fixture dbs with no network: `manage.py bench`.
+
+Twitter and Borg are served by the stand-in server (flask_app/standin.py, unthrottled) seeded from the scaled
+fixtures, and every page the build fetches is synthetic (see fixtures.synthetic_pages). Each benchmark runs at
+every scale (1 = db/test_db.json and db/test_db2.json as they are, 10 = ten times the influencers, tweets,
+quoted tweets and articles, ...):
+
+    db_load          JsonStore load of the scaled db/test_db.json
+    db_save          JsonStore save of it
+    pull_tweets      fetch_influencers_tweets for every influencer, over the stand-in
+    filter_tweets    filter_tweets_for_external_urls over every tweet (hydrating quoted tweets over the stand-in)
+    build_feed       FeedDB.build_external_url_feed from scratch (quote bank, page metadata, ranking snapshot)
+    user_feed        TweetDB.get_feed, every user tweet of the cluster newest first (time index built on the first run)
+    feed_snapshot    a read only TweetDB's first feed page: open the db, build its FeedSnapshot, rank a page
+    feed_pages       every page of the feed with every ranker, snapshot already built
+    render_index     GET / (index.html with feed.html) through the Flask test client
+    render_feed      feed.html alone, for one page
+
+Results are written as json:
+
+    {"meta": {...}, "results": [{"name", "scale", "repeat", "seconds": [...], "min", "median", "mean", "info", "stages"}]}
+
+where "info" holds the sizes the benchmark ran on and "stages" the pipeline stage timers (see
+flask_app/metrics.py) of its last run. compare() checks results against a baseline file.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+
+from flask import render_template
+
+from flask_app import caches, credentials, metrics
+from flask_app.build_feed import FeedDB, filter_tweets_for_external_urls
+from flask_app.credentials import ENDPOINT_LIMITS, Credential, CredentialPool
+from flask_app.feed_snapshot import FEED_SNAPSHOT_KEY
+from flask_app.ingest import default_start_time, fetch_influencers_tweets, influencer_username, run_sync
+from flask_app.quote_bank import QUOTE_BANK_STATE_KEY
+from flask_app.ranking import DEFAULT_RANKER, RANKERS
+from flask_app.standin import Fixtures, StandInServer
+from flask_app.storage import JsonStore
+from flask_app.tweet_db import TweetDB
+from flask_app.url_resolver import default_resolver
+
+from .fixtures import scale_section, synthetic_pages
+
+FIXTURES = ["db/test_db.json", "db/test_db2.json"]
+CLUSTER = "Ethereum"
+RESULTS_FPATH = "db/bench/results.json"
+DEFAULT_SCALES = [1, 10]
+PAGE_SIZE = 30
+
+# the stand-in is unthrottled, so is our side of it: we are timing our code, not twitter's rate limits
+UNLIMITED = {k: 10**9 for k in ENDPOINT_LIMITS}
+
+WEBPACK_MANIFEST = {
+    "entrypoints": {"app": {"assets": {"js": ["/static/js/app.js"], "css": ["/static/css/app.css"]}}},
+    "app.js": "/static/js/app.js",
+    "app.css": "/static/css/app.css",
+}
+
+
+class Workspace:
+    """
+    The scaled fixture dbs for one scale, in a temp directory, and the stand-in serving them.
+
+    dirpath (str): where the scaled dbs, the built db and the caches go
+    scale (int): see fixtures.scale_section
+    """
+
+    def __init__(self, dirpath, scale, fixtures=FIXTURES):
+        self.dirpath = Path(dirpath)
+        self.scale = scale
+        self.db_fpaths = []
+        for fpath in fixtures:
+            source = JsonStore(fpath)
+            scaled = JsonStore(str(self.dirpath / Path(fpath).name))
+            for cluster_name in source:
+                scaled[cluster_name] = scale_section(source[cluster_name], scale)
+            scaled.save()
+            self.db_fpaths.append(scaled.fpath)
+        self.feed_db_fpath, self.bank_db_fpath = self.db_fpaths[0], self.db_fpaths[-1]
+        # the same influencers and tweets in TweetDB's {username: user_data} layout
+        self.user_db_fpath = str(self.dirpath / "user_db.json")
+        user_db = JsonStore(self.user_db_fpath)
+        for cluster_name, section in JsonStore(self.feed_db_fpath).items():
+            user_db[cluster_name] = {
+                influencer_username(i): {"tweets": i.get("tweets") or []} for i in section["influencers"]
+            }
+        user_db.save()
+        self.built_db_fpath = str(self.dirpath / "built_db.json")
+        self.server = StandInServer(Fixtures.from_db_files(self.db_fpaths), limits={})
+        self._app = None
+
+    def __enter__(self):
+        self.server.start()
+        self._environ = {k: os.environ.get(k) for k in self.server.env()}
+        os.environ.update(self.server.env())
+        self._cache_dir = caches.CACHE_DIR
+        self._pool = credentials._default_pool
+        credentials.set_default_pool(CredentialPool([Credential("bench", "bench", limits=UNLIMITED)]))
+        self.fresh_caches()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.stop()
+        for k, v in self._environ.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+        caches.CACHE_DIR = self._cache_dir
+        default_resolver.cache_clear()
+        credentials.set_default_pool(self._pool)
+
+    def fresh_caches(self):
+        """
+        Point the persistent caches (user ids, resolved links, page metadata) at an empty directory
+        """
+        cache_dir = self.dirpath / "cache"
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        caches.CACHE_DIR = cache_dir
+        # the shared resolver holds its cache in memory, the next one reads the empty directory
+        default_resolver.cache_clear()
+
+    def section(self, fpath=None):
+        return JsonStore(fpath or self.bank_db_fpath)[CLUSTER]
+
+    def unbuilt_db(self):
+        """
+        A FeedDB holding the scaled cluster without its quote tweet bank, so a build starts from scratch
+        """
+        section = self.section()
+        for key in ("external_url_quote_tweet_bank", QUOTE_BANK_STATE_KEY, "external_url_feed", FEED_SNAPSHOT_KEY):
+            section.pop(key, None)
+        db = FeedDB(self.built_db_fpath + ".unbuilt.json")
+        db._db[CLUSTER] = section
+        return db
+
+    def built_db(self):
+        """
+        The built db path, built (untimed) if the build_feed benchmark didn't run first
+        """
+        if not os.path.isfile(self.built_db_fpath):
+            self.fresh_caches()
+            db = self.unbuilt_db()
+            with synthetic_pages():
+                db.build_external_url_feed(CLUSTER)
+            db.save(self.built_db_fpath)
+        return self.built_db_fpath
+
+    def app(self):
+        from flask_app.app import create_app
+        from flask_app.views import main
+
+        if self._app is None:
+            manifest_fpath = self.dirpath / "manifest.json"
+            with open(manifest_fpath, "w") as f:
+                json.dump(WEBPACK_MANIFEST, f)
+            self._app = create_app(
+                deploy_mode="Test",
+                settings_override={
+                    "TWEET_DB_PATH": self.built_db(),
+                    "WEBPACK_LOADER": {"MANIFEST_FILE": str(manifest_fpath)},
+                },
+            )
+            main._tweet_db = None  # the app's db is a module global, open ours on the first request
+        return self._app
+
+
+def time_runs(run, repeat, setup=None):
+    """
+    Seconds each of repeat calls of run() took, setup() (untimed) before each. Returns (seconds, last result)
+    """
+    seconds, result = [], None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        result = run()
+        seconds.append(time.perf_counter() - started)
+    return seconds, result
+
+
+def bench_db_load(ws, repeat):
+    seconds, store = time_runs(lambda: JsonStore(ws.feed_db_fpath), repeat)
+    return seconds, {"bytes": os.path.getsize(ws.feed_db_fpath), "tweets": len(store[CLUSTER]["all_feed_tweets"])}
+
+
+def bench_db_save(ws, repeat):
+    store = JsonStore(ws.feed_db_fpath)
+    fpath = str(ws.dirpath / "saved_db.json")
+    seconds, _ = time_runs(lambda: store.save(fpath), repeat)
+    return seconds, {"bytes": os.path.getsize(fpath)}
+
+
+def bench_pull_tweets(ws, repeat):
+    influencers = ws.section(ws.feed_db_fpath)["influencers"]
+    start_time = default_start_time(48)
+    seconds, results = time_runs(
+        lambda: run_sync(fetch_influencers_tweets([dict(i) for i in influencers], start_time=start_time)),
+        repeat,
+        setup=ws.fresh_caches,
+    )
+    return seconds, {"influencers": len(influencers), "tweets": sum(len(i) for i in results)}
+
+
+def bench_filter_tweets(ws, repeat):
+    tweets = ws.section()["all_feed_tweets"]
+    seconds, bank = time_runs(
+        lambda: filter_tweets_for_external_urls(tweets), repeat, setup=ws.fresh_caches
+    )
+    return seconds, {"tweets": len(tweets), "bank_entries": len(bank)}
+
+
+def bench_build_feed(ws, repeat):
+    dbs = []
+
+    def setup():
+        ws.fresh_caches()
+        dbs.append(ws.unbuilt_db())
+
+    with synthetic_pages():
+        seconds, feed = time_runs(lambda: dbs[-1].build_external_url_feed(CLUSTER), repeat, setup=setup)
+    dbs[-1].save(ws.built_db_fpath)
+    return seconds, {"tweets": len(dbs[-1]._db[CLUSTER]["all_feed_tweets"]), "feed_entries": len(feed)}
+
+
+def bench_user_feed(ws, repeat):
+    db = TweetDB(ws.user_db_fpath, read_only=True)
+    seconds, feed = time_runs(lambda: db.get_feed(CLUSTER, None), repeat)
+    return seconds, {"tweets": len(feed)}
+
+
+def bench_feed_snapshot(ws, repeat):
+    fpath = ws.built_db()
+    seconds, page = time_runs(
+        lambda: TweetDB(fpath, read_only=True).get_feed_snapshot(CLUSTER).page(0, PAGE_SIZE), repeat
+    )
+    return seconds, {"page_items": len(page)}
+
+
+def bench_feed_pages(ws, repeat):
+    snapshot = TweetDB(ws.built_db(), read_only=True).get_feed_snapshot(CLUSTER)
+    n_pages = max(1, -(-len(snapshot.items) // PAGE_SIZE))
+
+    def run():
+        for algorithm in RANKERS:
+            for page in range(n_pages):
+                snapshot.page(page, PAGE_SIZE, algorithm=algorithm)
+
+    seconds, _ = time_runs(run, repeat)
+    return seconds, {"feed_items": len(snapshot.items), "pages": n_pages, "rankers": len(RANKERS)}
+
+
+def bench_render_index(ws, repeat):
+    client = ws.app().test_client()
+    client.get("/")  # opens the db and builds the snapshot, the benchmark is the steady state
+    seconds, res = time_runs(lambda: client.get("/"), repeat)
+    if res.status_code != 200:
+        raise RuntimeError(f"GET / answered {res.status_code}")
+    return seconds, {"bytes": len(res.data)}
+
+
+def bench_render_feed(ws, repeat):
+    from flask_app.views.forms import ClusterSelectionForm
+    from flask_app.views.main import get_tweet_db
+
+    app = ws.app()
+    with app.test_request_context("/"):
+        snapshot = get_tweet_db().get_feed_snapshot(CLUSTER)
+        form = ClusterSelectionForm()
+        seconds, html = time_runs(
+            lambda: render_template(
+                "feed.html",
+                form=form,
+                feed=snapshot.page(0, PAGE_SIZE, algorithm=DEFAULT_RANKER),
+                page=0,
+                algorithm=DEFAULT_RANKER,
+                has_next_page=snapshot.has_page(1, PAGE_SIZE),
+            ),
+            repeat,
+        )
+    return seconds, {"bytes": len(html)}
+
+
+BENCHMARKS = {
+    "db_load": bench_db_load,
+    "db_save": bench_db_save,
+    "pull_tweets": bench_pull_tweets,
+    "filter_tweets": bench_filter_tweets,
+    "build_feed": bench_build_feed,
+    "user_feed": bench_user_feed,
+    "feed_snapshot": bench_feed_snapshot,
+    "feed_pages": bench_feed_pages,
+    "render_index": bench_render_index,
+    "render_feed": bench_render_feed,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(names=None, scales=DEFAULT_SCALES, repeat=3, fpath=RESULTS_FPATH):
+    """
+    names (list): benchmarks to run, defaults to all of BENCHMARKS (in its order)
+    scales (list): see fixtures.scale_section
+    repeat (int): timed runs of each benchmark per scale
+    fpath (str): where the results json goes, None to not write it
+
+    Returns the results dict
+    """
+    names = names or list(BENCHMARKS)
+    results = {
+        "meta": {
+            "started_at": time.time(),
+            "commit": git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "scales": list(scales),
+            "repeat": repeat,
+        },
+        "results": [],
+    }
+    for scale in scales:
+        with tempfile.TemporaryDirectory() as dirpath:
+            print(f"preparing the fixtures at {scale}x")
+            with Workspace(dirpath, scale) as ws:
+                for name in names:
+                    print(f"{name} at {scale}x")
+                    metrics.REGISTRY.reset()
+                    seconds, info = BENCHMARKS[name](ws, repeat)
+                    results["results"].append(
+                        {
+                            "name": name,
+                            "scale": scale,
+                            "repeat": repeat,
+                            "seconds": [round(i, 6) for i in seconds],
+                            "min": round(min(seconds), 6),
+                            "median": round(statistics.median(seconds), 6),
+                            "mean": round(statistics.mean(seconds), 6),
+                            "info": info,
+                            "stages": metrics.report()["stages"],
+                        }
+                    )
+    results["meta"]["seconds"] = round(time.time() - results["meta"]["started_at"], 2)
+    if fpath:
+        os.makedirs(Path(fpath).parent, exist_ok=True)
+        with open(fpath, "w") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Match results against a baseline results dict by (name, scale).
+
+    Returns a list of {"name", "scale", "baseline", "median", "ratio", "regressed"}, regressed when the median
+    is more than tolerance slower than the baseline's
+    """
+    baseline_medians = {(i["name"], i["scale"]): i["median"] for i in baseline["results"]}
+    rows = []
+    for i in results["results"]:
+        before = baseline_medians.get((i["name"], i["scale"]))
+        if not before:
+            continue
+        ratio = i["median"] / before
+        rows.append(
+            {
+                "name": i["name"],
+                "scale": i["scale"],
+                "baseline": before,
+                "median": i["median"],
+                "ratio": round(ratio, 3),
+                "regressed": ratio > 1 + tolerance,
+            }
+        )
+    return rows
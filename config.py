@@ -1,8 +1,19 @@
+import os
+
+
 class Config(object):
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SECRET_KEY = "my_precious"
     BCRYPT_LOG_ROUNDS = 13
     WTF_CSRF_ENABLED = True
+    # a json file, a sqlite file or a split json directory (manage.py split_db)
+    TWEET_DB_PATH = os.environ.get(
+        "TWEET_DB_PATH", "db/tweet_db_1-eth-python-bitcoin-external-quote-bank2.json"
+    )
+    # split json dbs only: evict least recently used clusters past this much json on disk
+    TWEET_DB_MAX_BYTES = int(os.environ.get("TWEET_DB_MAX_BYTES", 256 * 1024 * 1024))
+    # where the CLI builds write their metrics reports, /metrics serves them next to the app's own
+    METRICS_REPORT_DIR = os.environ.get("METRICS_REPORT_DIR", "db/metrics")
 
 
 class DevelopmentConfig(Config):
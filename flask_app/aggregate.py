@@ -0,0 +1,82 @@
+"""
+Turn a quote tweet bank into an external url feed, merging every quoted tweet that links to the same article.
+
+The quote bank is keyed by quoted tweet id, so two tweets linking to the same article (often with different
+utm_* params or a trailing slash) used to become two feed entries with half the votes each. Here entries are
+grouped by canonical url: the page's own <link rel=canonical> when we fetched one, else the canonicalized link.
+"""
+from .urls import canonicalize_url
+
+
+def article_url(url, page):
+    """
+    The canonical url of the article a link points to
+    """
+    if page and page.get("canonical"):
+        return canonicalize_url(page["canonical"])
+    return canonicalize_url(url)
+
+
+def vote_view(tweet):
+    """
+    How FeedDB stores a vote tweet in a feed entry, the fields the templates show.
+    The tweet must have been through ingest.label_authors
+    """
+    return {
+        "id": tweet["id"],
+        "tweet_link": tweet["tweet_link"],
+        "tweet_text": tweet["text"],
+        "author_username": tweet["author_username"],
+        "author_id": tweet.get("author_id"),
+        "created_at": tweet.get("created_at"),
+        "public_metrics": tweet.get("public_metrics"),
+    }
+
+
+def build_url_feed(url_tweet_bank, pages, vote_view=None):
+    """
+    url_tweet_bank (dict): from filter_tweets_for_external_urls, {ref_tweet_id: {external_urls, ref_tweet_data, vote_tweets}}
+    pages (dict): {url: page metadata} from PageMetadataFetcher.fetch_all
+    vote_view (callable): how a vote tweet is stored in the feed entry, defaults to the tweet itself
+
+    Returns a list of feed entries, one per article, each with every vote tweet that shared it (deduped by id).
+    "ref_tweet" is the quoted tweet with the most votes, "ref_tweet_ids" lists every quoted tweet merged in.
+    """
+    vote_view = vote_view or (lambda tweet: tweet)
+    groups = {}  # canonical url -> ref tweet ids, in bank order
+    for ref_tweet_id, i_tweet_data in url_tweet_bank.items():
+        url = i_tweet_data["external_urls"][0]
+        groups.setdefault(article_url(url, pages.get(url)), []).append(ref_tweet_id)
+
+    feed = []
+    for canonical_url, ref_tweet_ids in groups.items():
+        ref_tweet_ids = sorted(
+            ref_tweet_ids,
+            key=lambda i: len(url_tweet_bank[i]["vote_tweets"]),
+            reverse=True,
+        )
+        top = url_tweet_bank[ref_tweet_ids[0]]
+        page = pages.get(top["external_urls"][0]) or {}
+
+        external_urls, vote_tweets = [], {}
+        for ref_tweet_id in ref_tweet_ids:
+            for url in url_tweet_bank[ref_tweet_id]["external_urls"]:
+                if url not in external_urls:
+                    external_urls.append(url)
+            for i_tweet in url_tweet_bank[ref_tweet_id]["vote_tweets"]:
+                vote_tweets.setdefault(i_tweet["id"], i_tweet)
+
+        feed.append(
+            {
+                "title": page.get("title"),
+                "description": page.get("description"),
+                "og": page.get("og", {}),
+                "canonical_url": canonical_url,
+                "ref_tweet": top.get("ref_tweet_data"),
+                "ref_tweet_ids": ref_tweet_ids,
+                "external_urls": external_urls,
+                "tweets": [vote_view(i) for i in vote_tweets.values()],
+            }
+        )
+    return feed
+
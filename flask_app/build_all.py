@@ -0,0 +1,290 @@
+"""
+Build every cluster at once: `manage.py build-all`.
+
+The build is split into work items on a persistent WorkQueue and drained by a pool of worker processes,
+one stage after the other:
+
+    influencer_page  (cluster, page of Borg influencers) -> the page's influencers, queues an "influencer" item each
+    influencer       (twitter user) -> their tweets over the window, queues a "link" item per quoted tweet
+    link             (quoted tweet) -> the quoted tweet and the external urls it links to
+
+Influencer and link items are keyed by username / tweet id, so a user in several clusters (or a tweet quoted
+in several clusters) is fetched once. Each worker process gets its own share of the credential pool, so the
+workers together run at the quota we own instead of one cluster after another. The main process then
+assembles every cluster's section and external url feed from the results and saves the FeedDB.
+
+The queue is kept until the db is saved, so running build-all again after a crash (or a worker process dying,
+which takes the whole pool down) picks up where it stopped.
+Each batch hands the metrics its worker recorded back to the main process (see metrics.py), so the build's
+report covers every process.
+"""
+import time
+import contextlib
+import multiprocessing
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+
+from tqdm import tqdm
+
+from . import metrics
+from .credentials import (
+    CredentialPool,
+    credential_share,
+    load_credentials,
+    set_default_pool,
+)
+from .build_feed import get_cluster_influencers
+from .ingest import (
+    default_start_time,
+    fetch_influencers_tweets,
+    influencer_username,
+    quoted_tweet_id,
+    run_sync,
+)
+from .quote_bank import hydrate_quoted_tweets
+from .work_queue import FAILED, WorkQueue
+
+QUEUE_FPATH = "db/queue/build_all.sqlite"
+
+# stage name, items a worker claims at once (100 is the batch size of the user / tweet lookups)
+STAGES = [
+    ("influencer_page", 1),
+    ("influencer", 100),
+    ("link", 100),
+]
+
+META_STAGE = "meta"
+
+
+def init_worker(counter, n_workers):
+    """
+    ProcessPoolExecutor initializer, hands each worker process its own share of the credentials
+    """
+    with counter.get_lock():
+        worker_index = counter.value
+        counter.value += 1
+    credentials = load_credentials()
+    if credentials:
+        set_default_pool(
+            CredentialPool(credential_share(credentials, worker_index, n_workers))
+        )
+
+
+def run_influencer_pages(queue, items, start_time):
+    for item_id, key, payload in items:
+        influencers = get_cluster_influencers(payload["cluster"], pages=[payload["page"]])
+        queue.put_many(
+            "influencer", ((influencer_username(i), i) for i in influencers)
+        )
+        queue.done(item_id, influencers)
+
+
+def run_influencers(queue, items, start_time):
+    pulled = {}
+    run_sync(
+        fetch_influencers_tweets(
+            [payload for _, _, payload in items],
+            start_time=start_time,
+            on_result=lambda i: pulled.setdefault(influencer_username(i), i),
+        )
+    )
+    for item_id, key, payload in items:
+        if key not in pulled:
+            queue.fail(item_id, "pull failed")
+            continue
+        ref_tweet_ids = {quoted_tweet_id(t) for t in pulled[key].get("tweets") or []}
+        queue.put_many("link", ((i, None) for i in ref_tweet_ids if i))
+        queue.done(
+            item_id,
+            {
+                "tweets": pulled[key].get("tweets") or [],
+                "last_tweet_pull": pulled[key].get("last_tweet_pull"),
+            },
+        )
+
+
+def run_links(queue, items, start_time):
+    hydrated = hydrate_quoted_tweets([key for _, key, _ in items])
+    for item_id, key, _ in items:
+        if key not in hydrated:
+            queue.fail(item_id, "lookup failed")
+            continue
+        ref_tweet_data, urls = hydrated[key]
+        queue.done(item_id, {"ref_tweet_data": ref_tweet_data, "urls": urls})
+
+
+RUNNERS = {
+    "influencer_page": run_influencer_pages,
+    "influencer": run_influencers,
+    "link": run_links,
+}
+
+
+def work(queue_fpath, stage, batch_size, start_time):
+    """
+    Claim one batch of a stage and run it, in a worker process.
+    Returns (how many items it handled, the metrics the worker recorded since its last batch)
+    """
+    queue = WorkQueue(queue_fpath)
+    try:
+        items = queue.claim(stage, batch_size)
+        if items:
+            try:
+                RUNNERS[stage](queue, items, start_time)
+            except Exception as err:
+                for item_id, _, _ in items:
+                    queue.fail(item_id, repr(err))
+                raise
+        return len(items), metrics.REGISTRY.drain()
+    finally:
+        queue.close()
+
+
+def broken_pool(queue, stage):
+    return RuntimeError(
+        f"a worker process died during the {stage} stage and took the pool down. "
+        f"Nothing is lost, run build-all again to resume from the queue in {queue.fpath}"
+    )
+
+
+def drain(executor, queue, stage, batch_size, n_workers, start_time):
+    """
+    Keep n_workers batches of a stage in flight until the stage is empty.
+
+    Returns {"items": n, "seconds": s, "per_second": n / s, "failed": n}
+    """
+    started = time.monotonic()
+    handled = 0
+    with tqdm(total=queue.remaining(stage), desc=stage) as pbar:
+        in_flight = set()
+        while True:
+            while len(in_flight) < n_workers and queue.pending(stage) > len(in_flight) * batch_size:
+                try:
+                    future = executor.submit(work, queue.fpath, stage, batch_size, start_time)
+                except BrokenProcessPool:
+                    raise broken_pool(queue, stage) from None
+                in_flight.add(future)
+            if not in_flight:
+                if queue.remaining(stage) == 0:
+                    break
+                queue.requeue_running()  # nothing is running, these were left by a dead worker
+                continue
+            finished, in_flight = concurrent.futures.wait(
+                in_flight, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in finished:
+                try:
+                    n, worker_metrics = future.result()
+                except BrokenProcessPool:
+                    raise broken_pool(queue, stage) from None
+                except Exception as err:
+                    print(f"a {stage} batch failed, its items will be retried. Print exception below")
+                    print(err)
+                    continue
+                metrics.REGISTRY.merge(worker_metrics)
+                handled += n
+                pbar.total = handled + queue.remaining(stage)
+                pbar.update(n)
+    seconds = time.monotonic() - started
+    stats = {
+        "items": handled,
+        "seconds": round(seconds, 2),
+        "per_second": round(handled / seconds, 2) if seconds else None,
+        "failed": queue.counts(stage).get(FAILED, 0),
+    }
+    print(f"{stage}: {stats}")
+    return stats
+
+
+def assemble(db, queue, clusters, pages, start_time):
+    """
+    Write each cluster's section (see Feed.dict) from the queue results and build its external url feed
+
+    start_time (str): the build's window, quote bank votes older than it are expired
+    """
+    page_results = queue.results("influencer_page")
+    pulls = queue.results("influencer")
+    links = queue.results("link")
+
+    def hydrate(ref_tweet_ids):
+        return {
+            i: (links[i]["ref_tweet_data"], links[i]["urls"])
+            for i in ref_tweet_ids
+            if i in links  # failed links are left out, their votes are retried by the next build
+        }
+
+    for cluster_name in clusters:
+        influencers = []
+        for page in pages:
+            for i in page_results.get(f"{cluster_name}:{page}") or []:
+                pull = pulls.get(influencer_username(i))
+                influencers.append({**i, **pull} if pull else i)
+        db.set_cluster_tweets(
+            cluster_name,
+            {
+                "influencers": influencers,
+                "cluster": cluster_name,
+                "all_feed_tweets": [t for i in influencers for t in i.get("tweets") or []],
+            },
+        )
+        print(f"building external url feed for {cluster_name}")
+        db.build_external_url_feed(cluster_name, start_time=start_time, hydrate=hydrate)
+        db.compact(cluster_name)  # only read until the save, keep the finished clusters small
+
+
+def build_all(
+    db, clusters, pages=range(1), n_workers=4, queue_fpath=QUEUE_FPATH, fresh=False, executor=None
+):
+    """
+    db (FeedDB): where the clusters are written, saved at the end
+    clusters (list): cluster names
+    pages (iterable): Borg influencer pages to pull per cluster
+    n_workers (int): worker processes
+    fresh (bool): drop an unfinished build's queue instead of resuming it, a queue started before the
+        current window is always dropped
+    executor (Executor): runs the batches instead of a pool of n_workers processes, each with its share of
+        the credentials (ie. a ThreadPoolExecutor sharing the default credential pool)
+
+    Returns {stage: stats} (see drain)
+    """
+    pages = list(pages)
+    queue = WorkQueue(queue_fpath)
+    queued_start_time = queue.results(META_STAGE).get("start_time")
+    if queued_start_time and queued_start_time < default_start_time(hours=2 * 24):
+        # the queue's start_time is a day before it was started, one started before the current window
+        # would assemble a stale pull as current
+        print(f"queue {queue_fpath} is from {queued_start_time}, older than the current window, starting over")
+        fresh = True
+    if fresh:
+        queue.clear()
+    if queue.requeue_running():
+        print("resuming an unfinished build")
+
+    queue.put(META_STAGE, "start_time", None)
+    meta = queue.claim(META_STAGE)
+    if meta:
+        queue.done(meta[0][0], default_start_time())
+    start_time = queue.results(META_STAGE)["start_time"]
+
+    queue.put_many(
+        "influencer_page",
+        ((f"{c}:{p}", {"cluster": c, "page": p}) for c in clusters for p in pages),
+    )
+
+    stats = {}
+    with contextlib.ExitStack() as stack:
+        if executor is None:
+            counter = multiprocessing.Value("i", 0)
+            executor = stack.enter_context(
+                concurrent.futures.ProcessPoolExecutor(
+                    n_workers, initializer=init_worker, initargs=(counter, n_workers)
+                )
+            )
+        for stage, batch_size in STAGES:
+            stats[stage] = drain(executor, queue, stage, batch_size, n_workers, start_time)
+
+    assemble(db, queue, clusters, pages, start_time)
+    db.save()
+    queue.clear()
+    queue.close()
+    return stats
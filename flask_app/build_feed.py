@@ -1,40 +1,64 @@
 ### Twitter API Auth, loading creds and instantiating client
 import os
-import concurrent.futures
 from pathlib import Path
 import requests
-import json
 import datetime
-from urllib.parse import urlsplit
-from bs4 import BeautifulSoup
-import re
 from dotenv import load_dotenv
-from tqdm import tqdm
-import tweepy
 from tweepy.errors import TooManyRequests
 
+from . import metrics
+from .caches import user_id_cache
+from .credentials import default_pool
+from .aggregate import build_url_feed, vote_view
+from .feed_snapshot import FEED_SNAPSHOT_KEY, build_feed_snapshot
+from .ingest import (
+    default_start_time,
+    fetch_influencers_tweets,
+    label_authors,
+    pull_start_time,
+    run_sync,
+)
+from .journal import PullJournal, journal_path
+from .page_meta import PageMetadataFetcher
+from .quote_bank import (
+    QUOTE_BANK_STATE_KEY,
+    empty_state,
+    hydrate_quoted_tweets,
+    state_from_bank,
+    update_quote_bank,
+)
+from .ranking import section_attention
+from .storage import open_store
+from .tweet_store import compact_section, is_compact, thaw_section
+from .urls import extract_external_urls, url_get_host
+
 load_dotenv()
 
-consumer_key = os.environ["TWITTER_API_KEY"]
-consumer_secret = os.environ["TWITTER_API_KEY_SECRET"]
+### Borg define base_url and header (for auth)
 
-access_token = os.environ["TWITTER_ACCESS_TOKEN"]
-access_token_secret = os.environ["TWITTER_ACCESS_TOKEN_SECRET"]
+BORG_BASE_URL = "https://api.borg.id"  # override with the BORG_BASE_URL env var, ie. to use standin.py
 
-## Twitter api v2 uses this client object instead
-client = tweepy.Client(
-    consumer_key=consumer_key,
-    consumer_secret=consumer_secret,
-    access_token=access_token,
-    access_token_secret=access_token_secret,
-    bearer_token=os.environ["TWITTER_API_BEARER_TOKEN"],
-)
 
+def borg_base_url():
+    return os.environ.get("BORG_BASE_URL") or BORG_BASE_URL
 
-### Borg define base_url and header (for auth)
 
-BORG_HEADER = {"Authorization": f"Token {os.environ['BORG_API_KEY']}"}
-BORG_BASE_URL = "https://api.borg.id"
+def borg_headers():
+    """
+    Read when a request is made rather than at import, so this module imports without a BORG_API_KEY
+    """
+    return {"Authorization": f"Token {os.environ['BORG_API_KEY']}"}
+
+
+def borg_get(endpoint, path):
+    """
+    GET a Borg api path, recording the call against endpoint (the path without its ids and query)
+    """
+    url = borg_base_url() + path
+    with metrics.outbound(url):
+        res = requests.get(url, headers=borg_headers())
+    metrics.api_call("borg", endpoint, res.status_code)
+    return res
 
 
 def get_clusters():
@@ -44,19 +68,10 @@ def get_clusters():
     Returns a list of dictionaries of cluster data structured like
     {'active': True, 'created_at': '2020-12-01T11:19:54Z', 'id': '2300535630', 'name': 'Tesla', 'updated_at': '2021-12-20T09:55:19Z'}
     """
-    res = requests.get(f"{BORG_BASE_URL}/influence/clusters/", headers=BORG_HEADER)
+    res = borg_get("/influence/clusters/", "/influence/clusters/")
     return res.json()["clusters"]  # returns a list of dictionaries of clusters
 
 
-def url_get_host(url):
-    split_url = urlsplit(url)
-    return f"{split_url.scheme}://{split_url.hostname}"
-
-
-clusters = get_clusters()
-[i["name"] for i in clusters]
-
-
 def get_cluster_influencers(
     cluster_name, sort_direction="desc", pages=[0], sort_by="rank"
 ):
@@ -67,45 +82,65 @@ def get_cluster_influencers(
     influence_type str(): one of personal, organisation, all # TODO: not including this yet
     """
     influencers = []
-    for i_page in pages:
-        res = requests.get(
-            f"{BORG_BASE_URL}/influence/clusters/{cluster_name}/influencers/?page={i_page}&sort_by={sort_by}&sort_direction={sort_direction}",
-            headers=BORG_HEADER,
-        )
-        influencers.extend(res.json()["influencers"])
+    with metrics.stage("influencer_fetch"):
+        for i_page in pages:
+            res = borg_get(
+                "/influence/clusters/:cluster/influencers/",
+                f"/influence/clusters/{cluster_name}/influencers/?page={i_page}&sort_by={sort_by}&sort_direction={sort_direction}",
+            )
+            influencers.extend(res.json()["influencers"])
     return influencers
 
 
-def get_influencer_tweets(influencer):
+def get_influencer_tweets(influencer, user_ids=None):
+    """
+    Synchronous single influencer pull, `Feed.fetch_tweets` uses the async engine in ingest.py instead
+
+    user_ids (JsonCache): screen_name -> user id cache, checked before spending a user lookup
+    """
     all_tweets = []
     NOW = datetime.datetime.now()
     NOW_24h = datetime.timedelta(hours=24)
     START_TIME = (datetime.datetime.now() - NOW_24h).isoformat("T")[:-3] + "Z"
     username = influencer["social_account"]["social_account"]["screen_name"]
-    try:
-        user = client.get_user(username=username)
-    except TooManyRequests as err:
-        print("hitting limit... breaking for now")
-        print(err)
-        return []
-    if user.data:
+    user_ids = user_ids if user_ids is not None else user_id_cache()
+    client = default_pool().tweepy_client()
+    user_id = user_ids.get(username.lower())
+    metrics.cache_lookups("user_ids", hits=int(bool(user_id)), misses=int(not user_id))
+    if not user_id:
+        try:
+            user = client.get_user(username=username)
+            metrics.api_call("twitter", "/2/users/by/username/:username", 200)
+        except TooManyRequests as err:
+            metrics.api_call("twitter", "/2/users/by/username/:username", 429)
+            print("hitting limit... breaking for now")
+            print(err)
+            return []
+        if user.data:
+            user_id = user.data.id
+            user_ids.set(username.lower(), str(user_id))
+            user_ids.save()
+    if user_id:
         try:
             user_tweets = client.get_users_tweets(
-                user.data.id,
+                user_id,
                 tweet_fields=[
                     "public_metrics",
                     "created_at",
                     "author_id",
                     "referenced_tweets",
+                    "entities",
                 ],
                 start_time=START_TIME,
             )
+            metrics.api_call("twitter", "/2/users/:id/tweets", 200)
             if user_tweets.data:
                 influencer["tweets"] = [i.data for i in user_tweets.data]
                 all_tweets.extend([i.data for i in user_tweets.data])
             else:
                 influencer["tweets"] = []
         except TooManyRequests as err:
+            metrics.api_call("twitter", "/2/users/:id/tweets", 429)
             print("hitting limit... breaking for now")
             print(err)
             return []
@@ -115,30 +150,12 @@ def get_influencer_tweets(influencer):
     return all_tweets
 
 
-def get_external_urls(tweet):
+def get_external_urls(tweet, resolver=None):
     """
-    Extract external links from a tweet by doing a request.get (which will follow redirects) and finding the final url
+    Extract external links from a tweet, from its entities when it has them, else by following each link in the text.
+    See urls.extract_external_urls
     """
-    urls = re.findall(
-        "http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+",
-        tweet.text,
-    )
-    external_links = []
-    if urls:
-        for url in urls:
-            try:
-                # opener = urllib.request.build_opener()
-                # request = urllib.request.Request(url)
-                # response = opener.open(request)
-                # actual_url = response.geturl()
-                res = requests.get(url)
-                actual_url = res.url
-                if "twitter" not in actual_url:
-                    external_links.append(actual_url)
-            except Exception as err:
-                print(f"error with url {url}. Prrint exception below")
-                print(err)
-    return external_links
+    return extract_external_urls(tweet, resolver=resolver)
 
 
 def filter_tweets_for_external_urls(tweets):
@@ -146,81 +163,20 @@ def filter_tweets_for_external_urls(tweets):
     Find tweets that **quote a tweet with an external url**.
     Keep a list of the tweets that "voted" for them by quoting it
 
+    Every distinct quoted tweet is hydrated once, 100 ids per request, then the votes are grouped in memory.
+    This builds a bank from scratch, see quote_bank.update_quote_bank to fold new tweets into an existing one.
 
     returns:
         {
             i_ref_tweet.id: {
                 external_urls: [], this is a list of url's (ideally 1) that the quotoed tweet links to
+                ref_tweet_data: {}, the data object of the quoted tweet
                 vote_tweets: [] # this is a list of tweets that quoted the tweet with the url
             }
         }
 
     """
-    quoted_tweet_bank = (
-        {}
-    )  # keys are tweet_id (this tweet is quoted), values are list of tweets by influencers that quoted the key tweet
-
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        results = list(
-            tqdm(executor.map(check_quote_get_url, tweets), total=len(tweets))
-        )
-
-    for urls, ref_tweet_id, vote_tweet in results:
-        if urls:
-            if ref_tweet_id not in quoted_tweet_bank:
-                quoted_tweet_bank[ref_tweet_id] = {
-                    "external_urls": urls,
-                    "vote_tweets": [vote_tweet],
-                }
-            else:
-                quoted_tweet_bank[ref_tweet_id]["vote_tweets"].append(vote_tweet)
-    # for i_tweet in tweets:
-    #     if "referenced_tweets" in i_tweet:
-    #         # "referenced tweets" include quoted tweets, find them by checking "type" of referenced tweet (other types are "replied_to" and "retweeted")
-    #         for i_ref_tweet in i_tweet["referenced_tweets"]:
-    #             if i_ref_tweet["type"] == "quoted":
-    #                 external_urls = get_external_urls(
-    #                     client.get_tweet(i_ref_tweet["id"]).data
-    #                 )
-    #                 if len(external_urls):
-    #                     if i_ref_tweet["id"] not in quoted_tweet_bank:
-    #                         quoted_tweet_bank[i_ref_tweet["id"]] = {
-    #                             "external_urls": external_urls,
-    #                             "vote_tweets": [],
-    #                         }
-    #                     quoted_tweet_bank[i_ref_tweet["id"]]["vote_tweets"].append(
-    #                         i_tweet
-    #                     )
-    return quoted_tweet_bank
-
-
-def check_quote_get_url(tweet):
-    """
-    If tweet quotes another tweet and that tweet has an external url, return the url, the quoted_tweet_id and the vote_tweet object, else return all Nones
-
-    tweet (dict): the data obj of tweepy.Tweet obj
-    """
-    urls = []
-    reference_tweet_id = None
-    vote_tweet = tweet
-    if "referenced_tweets" in tweet:
-        # "referenced tweets" include quoted tweets, find them by checking "type" of referenced tweet (other types are "replied_to" and "retweeted")
-        for i_ref_tweet in tweet["referenced_tweets"]:
-            if i_ref_tweet["type"] == "quoted":
-                external_urls = get_external_urls(
-                    client.get_tweet(i_ref_tweet["id"]).data
-                )
-                if external_urls:
-                    reference_tweet_id = i_ref_tweet["id"]
-                    vote_tweet = tweet
-                    return external_urls, reference_tweet_id, vote_tweet
-                else:
-                    return None, None, None
-            else:
-                return None, None, None
-
-    else:
-        return None, None, None
+    return update_quote_bank({}, empty_state(), tweets)
 
 
 class FeedDB:
@@ -234,92 +190,158 @@ class FeedDB:
 
     Plan is to make a bunch of accessors directly to the json strucutre.
     Don't access via python attributes for now
+
+    db_fpath ending in .sqlite/.sqlite3/.db is stored in sqlite instead of json (see storage.py)
+    compact (bool): hold clusters in the compact form of tweet_store.py, they are thawed when rebuilt
     """
 
-    def __init__(self, db_fpath):
+    def __init__(self, db_fpath, compact=False):
         self.db_fpath = db_fpath
-        if os.path.isfile(db_fpath):
-            with open(db_fpath, "r") as f:
-                self._db = json.load(f)
-        else:
+        if not os.path.isfile(db_fpath):
             os.makedirs(Path(db_fpath).parent, exist_ok=True)
-            self._db = {}
-
-    def load(self, db_fpath):
-        with open(db_fpath, "r") as f:
-            db = json.load(f)
+        self._db = open_store(db_fpath, compact=compact)
+        self._journals = {}  # cluster_name -> PullJournal of a pull not saved yet
 
     def save(self, fpath=None):
         if fpath:
-            self.db_path = fpath
-        with open(self.db_fpath, "w") as f:
-            json.dump(self._db, f)
+            self.db_fpath = fpath
+        self._db.save(self.db_fpath)
+        # the pulls are in the db now, journals of complete pulls are no longer needed
+        for cluster_name, journal in list(self._journals.items()):
+            if journal.pending():
+                print(
+                    f"{len(journal.pending())} influencers of {cluster_name} failed, "
+                    "fetch again with resume to retry only those"
+                )
+            else:
+                journal.remove()
+            del self._journals[cluster_name]
+
+    def compact(self, cluster_name):
+        """
+        Hold a cluster in the compact form of tweet_store.py, ie. once it's built and only read from here on
+        """
+        section = self._db[cluster_name]
+        if not is_compact(section):
+            section.update(compact_section(section))
+
+    def _thaw(self, cluster_name):
+        """
+        Compact tweet lists are read only, turn them back into dicts before a cluster is changed in place
+        """
+        section = self._db[cluster_name]
+        if is_compact(section):
+            section.update(thaw_section(section))
 
     def get_cluster_tweets(self, cluster_name):
-        return (
-            self._db[cluster_name]["all_feed_tweets"],
-            self._db[cluster_name]["influencers"],
-        )
+        return self._db.get_cluster_tweets(cluster_name)
 
     def get_external_url_feed(self, cluster_name):
-        return self._db[cluster_name]["external_url_feed"]
-
-    def fetch_tweets(self, cluster_name, influencer_pages=range(1)):
+        return self._db.get_external_url_feed(cluster_name)
+
+    def fetch_tweets(self, cluster_name, influencer_pages=range(1), resume=False):
+        """
+        Pull the cluster's influencers and their tweets. Each influencer is written to a journal as soon as
+        its pull finishes (see journal.py), and the journal is removed once the db is saved.
+
+        resume (bool): pick up the cluster's unfinished journal, only pulling the influencers it doesn't have yet.
+            A journal started before the current window is replaced by a fresh one
+        """
+        fpath = journal_path(self.db_fpath, cluster_name)
+        journal = PullJournal.load(fpath) if resume else None
         feed = Feed(cluster_name, influencer_pages=influencer_pages)
-        feed.fetch_tweets()
+        # a journal's start_time is a day before it was started, one started before the current window
+        # would merge a stale pull as current
+        if journal is not None and journal.start_time < default_start_time(hours=2 * 24):
+            print(f"journal {fpath} is from {journal.start_time}, older than the current window, starting over")
+            journal = None
+        if journal is not None and journal.cluster_name == cluster_name:
+            print(
+                f"resuming pull of {cluster_name} from {fpath}, "
+                f"{len(journal.records)}/{len(journal.influencers)} influencers already pulled"
+            )
+        else:
+            journal = PullJournal.create(
+                fpath, cluster_name, default_start_time(), feed.fetch_influencers()
+            )
+        feed.fetch_tweets(journal=journal)
+        self._journals[cluster_name] = journal
         # feed.build_feed()
-        self._db[cluster_name] = feed.dict()
-
-    def build_external_url_feed(self, cluster_name):
-        url_tweet_bank = filter_tweets_for_external_urls(
-            self._db[cluster_name]["all_feed_tweets"]
+        self.set_cluster_tweets(cluster_name, feed.dict())
+
+    def set_cluster_tweets(self, cluster_name, section):
+        """
+        Replace a cluster's influencers and tweets (see Feed.dict), keeping the quote bank and its state
+        so the next build only processes the new tweets
+        """
+        old_section = self._db[cluster_name] if cluster_name in self._db else {}
+        kept = {
+            k: old_section[k]
+            for k in ("external_url_quote_tweet_bank", QUOTE_BANK_STATE_KEY)
+            if k in old_section
+        }
+        self._db[cluster_name] = {**kept, **section}
+
+    def build_external_url_feed(self, cluster_name, start_time=None, hydrate=None):
+        """
+        start_time (str): iso string, votes older than this are expired from the quote bank
+            (and articles left without votes leave the feed), defaults to the window of the cluster's last pull
+            (see ingest.pull_start_time), nothing is expired for a cluster that was never pulled
+        hydrate (callable): how quoted tweets are looked up, see quote_bank.update_quote_bank
+        """
+        # fold only the tweets we haven't seen into the existing bank, see quote_bank.py
+        self._thaw(cluster_name)
+        section = self._db[cluster_name]
+        start_time = start_time or pull_start_time(section.get("influencers") or [])
+        url_tweet_bank = section.get("external_url_quote_tweet_bank") or {}
+        state = section.get(QUOTE_BANK_STATE_KEY) or (
+            state_from_bank(url_tweet_bank) if url_tweet_bank else empty_state()
+        )
+        update_quote_bank(
+            url_tweet_bank,
+            state,
+            section["all_feed_tweets"],
+            start_time=start_time,
+            hydrate=hydrate or hydrate_quoted_tweets,
         )
 
-        self._db[cluster_name]["external_url_quote_tweet_bank"] = url_tweet_bank
+        section["external_url_quote_tweet_bank"] = url_tweet_bank
+        section[QUOTE_BANK_STATE_KEY] = state
 
-        self.external_url_feed = []
-        for num, (i_tweet, i_tweet_data) in enumerate(url_tweet_bank.items()):
-            # Quick code to grab the html description of the site
-            response = requests.get(
-                i_tweet_data["external_urls"][0], headers={"User-Agent": "XY"}
-            )
-            soup = BeautifulSoup(response.text)
-            description = (  # taken from https://stackoverflow.com/questions/22318095/get-meta-description-from-external-website/22318311
-                soup.find("meta", attrs={"name": "description"})
-                or soup.find("meta", attrs={"property": "description"})
-                or soup.find("meta", attrs={"property": "og:description"})
-                or soup.find("meta", attrs={"name": "description"})
-            )
-            if description:
-                description = description.attrs["content"]
-            title = soup.find("title")
-            if title:
-                title = title.text
-            self.external_url_feed.append(
-                {
-                    "title": title,
-                    "description": description,
-                    "external_urls": i_tweet_data["external_urls"],
-                    "tweets": [],
-                }
-            )
-            for i in i_tweet_data["vote_tweets"]:
-                self.external_url_feed[-1]["tweets"].append(
-                    {
-                        "tweet_link": f"https://twitter.com/username/status/{i['id']}",
-                        "tweet_text": i["text"],
-                    }
-                )
+        pages = PageMetadataFetcher().fetch_all(
+            [i["external_urls"][0] for i in url_tweet_bank.values()]
+        )
+        label_authors([t for i in url_tweet_bank.values() for t in i["vote_tweets"]])
+
+        # one entry per article, votes for the same canonical url are merged
+        self.external_url_feed = build_url_feed(
+            url_tweet_bank,
+            pages,
+            vote_view=vote_view,
+        )
 
+        attention, attention_change = section_attention(section)
         self._db[cluster_name]["external_url_feed"] = self.external_url_feed
+        self._db[cluster_name][FEED_SNAPSHOT_KEY] = build_feed_snapshot(
+            self.external_url_feed,
+            attention=attention,
+            attention_change=attention_change,
+        )
         return self.external_url_feed
 
 
 class Feed:
-    def __init__(self, cluster_name, sort_direction="desc", influencer_pages=[0]):
+    def __init__(
+        self,
+        cluster_name,
+        sort_direction="desc",
+        influencer_pages=[0],
+        max_concurrency=20,
+    ):
         self.cluster_name = cluster_name
         self.sort_direction = sort_direction
         self.influencer_pages = influencer_pages
+        self.max_concurrency = max_concurrency
 
     def dict(self):
         return {
@@ -329,17 +351,36 @@ class Feed:
             # "external_url_quoted_tweet_bank": self.external_url_quoted_tweet_bank,
         }
 
-    def fetch_tweets(self):
+    def fetch_influencers(self):
         self.influencers = get_cluster_influencers(
             self.cluster_name, self.sort_direction, pages=self.influencer_pages
         )
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            results = list(
-                tqdm(
-                    executor.map(get_influencer_tweets, self.influencers),
-                    total=len(self.influencers),
+        return self.influencers
+
+    def fetch_tweets(self, journal=None):
+        """
+        journal (PullJournal): pull only the influencers it doesn't have yet (over its start_time),
+            journaling each as it finishes, then take influencers and tweets from the compacted journal
+        """
+        if journal is not None:
+            run_sync(
+                fetch_influencers_tweets(
+                    journal.pending(),
+                    start_time=journal.start_time,
+                    max_concurrency=self.max_concurrency,
+                    on_result=journal.append,
                 )
             )
+            section = journal.compact()
+            self.influencers = section["influencers"]
+            self.all_feed_tweets = section["all_feed_tweets"]
+            return self.all_feed_tweets
+
+        results = run_sync(
+            fetch_influencers_tweets(
+                self.fetch_influencers(), max_concurrency=self.max_concurrency
+            )
+        )
 
         self.all_feed_tweets = []
         for i in results:
@@ -0,0 +1,96 @@
+"""
+Small persistent caches that live next to the json dbs, so repeat pulls don't spend
+api requests on things we already know.
+"""
+import os
+import json
+import time
+import tempfile
+import threading
+from pathlib import Path
+
+CACHE_DIR = Path("db/cache")
+
+_MISSING = object()
+
+
+class JsonCache:
+    """
+    key -> value cache backed by a json file, read on init and written back by `save()`.
+
+    File Structure:
+        {
+            key: [value, expires_at]  # expires_at is a unix time, or null for never
+        }
+
+    ttl (int): default seconds an entry lives for, None means entries never expire
+    """
+
+    def __init__(self, fpath, ttl=None):
+        self.fpath = Path(fpath)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._dirty = False
+        if self.fpath.is_file():
+            with open(self.fpath, "r") as f:
+                self._entries = json.load(f)
+        else:
+            self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        value, expires_at = entry
+        if expires_at is not None and expires_at < time.time():
+            return default
+        return value
+
+    def set(self, key, value, ttl=None):
+        """
+        ttl (int): override the cache default for this entry (ie. shorter ttl for failed lookups)
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = [value, expires_at]
+            self._dirty = True
+
+    def save(self):
+        """
+        Write to a temp file and rename it over the old one so a crash never leaves half a cache
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            now = time.time()
+            entries = {
+                k: v for k, v in self._entries.items() if v[1] is None or v[1] >= now
+            }
+            os.makedirs(self.fpath.parent, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.fpath.parent, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.fpath)
+            self._entries = entries
+            self._dirty = False
+
+
+def user_id_cache():
+    """
+    screen_name (lowercased) -> twitter user id. User ids never change, so entries never expire
+    """
+    return JsonCache(CACHE_DIR / "user_ids.json")
+
+
+def user_handle_cache():
+    """
+    twitter user id -> screen_name, the reverse of user_id_cache. Handles can change, so entries expire after a week
+    """
+    return JsonCache(CACHE_DIR / "user_handles.json", ttl=7 * 24 * 60 * 60)
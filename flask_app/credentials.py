@@ -0,0 +1,305 @@
+"""
+Twitter api credentials and the rate limit accounting for each of them.
+
+Every credential we own has its own 15 minute budget per endpoint, so each gets its own RateLimitScheduler
+(a TokenBucket per endpoint, kept in line with the x-rate-limit-* headers of its responses). A CredentialPool
+hands every request the credential with the most headroom on that endpoint, so a pull only waits when
+every credential is out, and throughput grows with the number of credentials.
+
+Credentials come from the environment (or .env), the first set with the names we have always used
+and any extra sets with a numbered suffix:
+
+    TWITTER_API_BEARER_TOKEN, TWITTER_API_KEY, TWITTER_API_KEY_SECRET, TWITTER_ACCESS_TOKEN, TWITTER_ACCESS_TOKEN_SECRET
+    TWITTER_API_BEARER_TOKEN_2, TWITTER_API_KEY_2, ...
+    TWITTER_API_BEARER_TOKEN_3, ...
+"""
+import os
+import time
+import asyncio
+import functools
+import itertools
+
+import tweepy
+from dotenv import load_dotenv
+
+from . import metrics
+
+load_dotenv()
+
+RATE_LIMIT_WINDOW = 15 * 60  # seconds, twitter rate limits are per 15 minute window
+
+# requests allowed per 15 minute window with app (bearer token) auth
+# https://developer.twitter.com/en/docs/twitter-api/rate-limits
+ENDPOINT_LIMITS = {
+    "/2/users/by/username/:username": 300,
+    "/2/users/by": 300,
+    "/2/users": 300,
+    "/2/users/:id/tweets": 1500,
+    "/2/tweets": 300,
+}
+
+
+class TokenBucket:
+    """
+    Paces requests to a single endpoint.
+
+    Starts full (twitter lets you burst the whole window) and refills at limit / window tokens per second.
+    When the api tells us we are out (a 429, or x-rate-limit-remaining hits 0) the bucket is drained
+    and blocked until the reset time the api gave us.
+    """
+
+    def __init__(self, limit, window=RATE_LIMIT_WINDOW):
+        self.capacity = limit
+        self.rate = limit / window
+        self.tokens = float(limit)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self):
+        """
+        Tokens we could spend right now, 0 while the api has us blocked
+        """
+        self._refill()
+        return 0.0 if time.monotonic() < self.blocked_until else self.tokens
+
+    def try_acquire(self):
+        """
+        Take a token if one is free right now, never waits
+        """
+        if self.available() >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self):
+        """
+        Seconds until the next token is free
+        """
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def sync(self, remaining):
+        """
+        remaining (int): the x-rate-limit-remaining header, the api's count is authoritative so we never hold more
+        """
+        self.tokens = min(self.tokens, float(remaining))
+
+    def block_until(self, reset_epoch):
+        """
+        reset_epoch (int): unix time the window resets at (the x-rate-limit-reset header)
+        """
+        self.tokens = 0.0
+        wait = max(0.0, reset_epoch - time.time()) + 1
+        self.blocked_until = max(self.blocked_until, time.monotonic() + wait)
+
+
+class RateLimitScheduler:
+    """
+    Holds one TokenBucket per endpoint for a single credential, shared by every request made with it
+    """
+
+    def __init__(self, limits=ENDPOINT_LIMITS):
+        self.limits = limits
+        self.buckets = {}
+
+    def bucket(self, endpoint):
+        if endpoint not in self.buckets:
+            self.buckets[endpoint] = TokenBucket(self.limits[endpoint])
+        return self.buckets[endpoint]
+
+    def update(self, endpoint, status, headers):
+        """
+        Read the rate limit headers off a response. A 429 or a remaining count of 0 blocks the endpoint until reset
+        """
+        remaining = headers.get("x-rate-limit-remaining")
+        reset = headers.get("x-rate-limit-reset")
+        if remaining is not None:
+            self.bucket(endpoint).sync(int(remaining))
+        if status == 429 or remaining == "0":
+            reset_epoch = int(reset) if reset else time.time() + RATE_LIMIT_WINDOW
+            self.bucket(endpoint).block_until(reset_epoch)
+
+
+CREDENTIAL_ENV = {
+    "bearer_token": "TWITTER_API_BEARER_TOKEN",
+    "consumer_key": "TWITTER_API_KEY",
+    "consumer_secret": "TWITTER_API_KEY_SECRET",
+    "access_token": "TWITTER_ACCESS_TOKEN",
+    "access_token_secret": "TWITTER_ACCESS_TOKEN_SECRET",
+}
+
+
+class Credential:
+    """
+    One set of api keys, with its own rate limit budget.
+    Only bearer_token is needed for the async engine, the OAuth keys are passed on to tweepy
+    """
+
+    def __init__(
+        self,
+        name,
+        bearer_token,
+        consumer_key=None,
+        consumer_secret=None,
+        access_token=None,
+        access_token_secret=None,
+        limits=ENDPOINT_LIMITS,
+    ):
+        self.name = name
+        self.bearer_token = bearer_token
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.access_token = access_token
+        self.access_token_secret = access_token_secret
+        self.scheduler = RateLimitScheduler(limits)
+
+    def __repr__(self):
+        return f"Credential({self.name!r})"
+
+    @property
+    def headers(self):
+        return {"Authorization": f"Bearer {self.bearer_token}"}
+
+    @functools.cached_property
+    def tweepy_client(self):
+        return tweepy.Client(
+            consumer_key=self.consumer_key,
+            consumer_secret=self.consumer_secret,
+            access_token=self.access_token,
+            access_token_secret=self.access_token_secret,
+            bearer_token=self.bearer_token,
+        )
+
+
+def load_credentials(environ=None):
+    """
+    Every credential set in the environment, see the module docstring for the names.
+    Numbered sets are read from _2 up until the first missing bearer token
+    """
+    environ = os.environ if environ is None else environ
+    credentials = []
+    for n in itertools.count(1):
+        suffix = "" if n == 1 else f"_{n}"
+        bearer_token = environ.get(CREDENTIAL_ENV["bearer_token"] + suffix)
+        if not bearer_token:
+            break
+        credentials.append(
+            Credential(
+                f"twitter{suffix}" if suffix else "twitter",
+                **{k: environ.get(v + suffix) for k, v in CREDENTIAL_ENV.items()},
+            )
+        )
+    return credentials
+
+
+class CredentialPool:
+    """
+    Routes each request to the credential with the most headroom on its endpoint.
+
+    usage:
+        pool = CredentialPool(load_credentials())
+        credential = await pool.acquire("/2/tweets")
+        ...  # make the request with credential.headers
+        credential.scheduler.update("/2/tweets", res.status, res.headers)
+    """
+
+    def __init__(self, credentials):
+        if not credentials:
+            raise Exception(
+                f"no twitter credentials found, set {CREDENTIAL_ENV['bearer_token']} (see credentials.py)"
+            )
+        self.credentials = list(credentials)
+        self._round_robin = itertools.cycle(self.credentials)
+
+    def __len__(self):
+        return len(self.credentials)
+
+    def try_acquire(self, endpoint):
+        """
+        Spend a token on the credential with the most available for endpoint, None if every credential is out
+        """
+        buckets = [(c, c.scheduler.bucket(endpoint)) for c in self.credentials]
+        for credential, bucket in sorted(buckets, key=lambda x: -x[1].available()):
+            if bucket.try_acquire():
+                return credential
+        return None
+
+    async def acquire(self, endpoint):
+        """
+        The credential to make a request to endpoint with, waiting only when every credential is out of quota
+        """
+        while True:
+            credential = self.try_acquire(endpoint)
+            if credential is not None:
+                return credential
+            wait = min(c.scheduler.bucket(endpoint).wait_time() for c in self.credentials)
+            metrics.slept("rate_limit", wait)
+            await asyncio.sleep(wait)
+
+    def remaining(self):
+        """
+        {credential name: {endpoint: tokens left}} for every endpoint used so far
+        """
+        return {
+            c.name: {k: int(b.available()) for k, b in c.scheduler.buckets.items()}
+            for c in self.credentials
+        }
+
+    def tweepy_client(self):
+        """
+        A tweepy.Client for the synchronous code paths, taking turns across credentials
+        """
+        return next(self._round_robin).tweepy_client
+
+
+_default_pool = None
+
+
+def default_pool():
+    """
+    The process wide pool, every credential in the environment unless set_default_pool gave it another
+    """
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = CredentialPool(load_credentials())
+    return _default_pool
+
+
+def set_default_pool(pool):
+    """
+    Replace the process wide pool, ie. to give each worker process of a build its own share of the credentials
+    """
+    global _default_pool
+    _default_pool = pool
+
+
+def credential_share(credentials, worker_index, n_workers, limits=ENDPOINT_LIMITS):
+    """
+    The credentials one of n_workers processes should use, so the workers never spend the same quota twice.
+
+    With at least as many credentials as workers they are dealt out round robin. Otherwise a worker gets a
+    single credential, with its per endpoint limits divided between the workers sharing it
+    """
+    if len(credentials) >= n_workers:
+        return credentials[worker_index::n_workers]
+    credential = credentials[worker_index % len(credentials)]
+    sharing = len(range(worker_index % len(credentials), n_workers, len(credentials)))
+    return [
+        Credential(
+            credential.name,
+            credential.bearer_token,
+            credential.consumer_key,
+            credential.consumer_secret,
+            credential.access_token,
+            credential.access_token_secret,
+            limits={k: max(1, v // sharing) for k, v in limits.items()},
+        )
+    ]
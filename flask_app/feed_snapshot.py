@@ -0,0 +1,130 @@
+"""
+Ranked, precomputed feed snapshots.
+
+`build_feed_snapshot` runs when an external url feed is built and stores a ranked list next to the feed,
+with share counts and epoch timestamps already worked out. The web app wraps it in a FeedSnapshot, which
+is immutable, so a request only has to slice a page and work out how old each item is.
+
+Each snapshot item also keeps its votes as a few flat columns (see ranking.vote_columns), so the feed can be
+re-ranked by any algorithm in the ranking registry without going back to the vote tweets.
+"""
+import time
+from collections import namedtuple
+
+from .ranking import DEFAULT_RANKER, build_vote_arrays, rank, vote_columns
+from .time_index import as_epoch
+from .urls import url_get_host
+
+FEED_SNAPSHOT_KEY = "external_url_feed_snapshot"
+
+FeedItem = namedtuple(
+    "FeedItem",
+    [
+        "ref_tweet_id",
+        "ref_tweet_ids",  # every quoted tweet merged into this article
+        "canonical_url",
+        "title",
+        "description",
+        "external_urls",
+        "host",
+        "shares",
+        "shared_at",  # epoch seconds the quoted tweet was created at, None if we don't know
+    ],
+)
+
+
+def build_feed_snapshot(external_url_feed, attention=None, attention_change=None):
+    """
+    Rank an external url feed by share count and flatten each entry to what the feed page shows.
+
+    attention (dict): {twitter user id: attention_score} of the cluster's influencers, stored with each vote
+    attention_change (dict): {twitter user id: attention_score_change_week}, the same
+
+    Returns a json serializable list of dicts (the FeedItem fields), best first
+    """
+    snapshot = []
+    for entry in external_url_feed:
+        ref_tweet = entry.get("ref_tweet") or {}
+        snapshot.append(
+            {
+                "ref_tweet_id": ref_tweet.get("id"),
+                "ref_tweet_ids": entry.get("ref_tweet_ids")
+                or ([ref_tweet["id"]] if ref_tweet.get("id") else []),
+                "canonical_url": entry.get("canonical_url"),
+                "title": entry.get("title"),
+                "description": entry.get("description"),
+                "external_urls": entry["external_urls"],
+                "host": url_get_host(entry["external_urls"][0]),
+                "shares": len(entry["tweets"]),
+                "shared_at": as_epoch(ref_tweet["created_at"])
+                if ref_tweet.get("created_at")
+                else None,
+                "votes": vote_columns(
+                    entry["tweets"], attention, as_epoch, attention_change
+                ),
+            }
+        )
+    return sorted(snapshot, key=lambda x: x["shares"], reverse=True)
+
+
+class FeedSnapshot:
+    """
+    Immutable ranked feed for one cluster, safe to share between request threads
+    """
+
+    def __init__(self, snapshot):
+        self.items = tuple(
+            FeedItem(
+                **{
+                    "canonical_url": None,
+                    **{k: v for k, v in i.items() if k != "votes"},
+                    "external_urls": tuple(i["external_urls"]),
+                    # snapshots built before entries were merged by article only have ref_tweet_id
+                    "ref_tweet_ids": tuple(i.get("ref_tweet_ids") or [i["ref_tweet_id"]]),
+                }
+            )
+            for i in snapshot
+        )
+        self.votes = build_vote_arrays(
+            [i.get("votes") for i in snapshot], [i.shared_at for i in self.items]
+        )
+        self._by_ref_tweet_id = {
+            ref_tweet_id: item for item in self.items for ref_tweet_id in item.ref_tweet_ids
+        }
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, ref_tweet_id):
+        """
+        The item a quoted tweet was merged into, None if it isn't in the feed
+        """
+        return self._by_ref_tweet_id.get(ref_tweet_id)
+
+    def ranked(self, algorithm=DEFAULT_RANKER, now=None):
+        """
+        The items ordered by a ranking algorithm (see ranking.RANKERS), the stored share order for the default
+        """
+        if algorithm == DEFAULT_RANKER:
+            return self.items
+        return tuple(self.items[i] for i in rank(self.votes, algorithm, now))
+
+    def page(self, page=0, page_size=30, now=None, algorithm=DEFAULT_RANKER):
+        """
+        Returns fresh dicts for one page of the feed, with "hours_since_shared" relative to now
+        """
+        now = now or time.time()
+        feed = []
+        for item in self.ranked(algorithm, now)[page * page_size : (page + 1) * page_size]:
+            feed.append(
+                {
+                    **item._asdict(),
+                    "hours_since_shared": (now - item.shared_at) // 3600
+                    if item.shared_at is not None
+                    else None,
+                }
+            )
+        return feed
+
+    def has_page(self, page, page_size=30):
+        return 0 <= page * page_size < len(self.items)
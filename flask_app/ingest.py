@@ -0,0 +1,460 @@
+"""
+Asyncio ingestion engine for pulling influencer tweets from the Twitter v2 api.
+
+Every request goes through one pooled aiohttp session and is routed to a credential with quota left on
+its endpoint (see credentials.py), so instead of dropping an influencer when we hit a 429 we switch
+credential, or wait for the window to refill, and keep going.
+"""
+import os
+import asyncio
+import datetime
+import concurrent.futures
+
+import aiohttp
+from tqdm import tqdm
+
+from . import metrics
+from .caches import user_handle_cache, user_id_cache
+from .credentials import (  # re-exported, these used to live here
+    ENDPOINT_LIMITS,
+    RATE_LIMIT_WINDOW,
+    Credential,
+    CredentialPool,
+    RateLimitScheduler,
+    TokenBucket,
+    default_pool,
+)
+
+TWITTER_BASE_URL = "https://api.twitter.com"  # override with the TWITTER_BASE_URL env var, ie. to use standin.py
+
+TWEET_FIELDS = [
+    "public_metrics",
+    "created_at",
+    "author_id",
+    "referenced_tweets",
+    "entities",  # expanded urls, so most links never need resolving over http
+]
+
+USER_LOOKUP_BATCH = 100  # max usernames per /2/users/by request
+TWEET_LOOKUP_BATCH = 100  # max ids per /2/tweets request
+
+
+def default_start_time(hours=24):
+    """
+    The start_time we have always used for influencer pulls: `hours` ago, formatted for the api
+    """
+    start = datetime.datetime.now() - datetime.timedelta(hours=hours)
+    return start.isoformat("T")[:-3] + "Z"
+
+
+def pull_start_time(influencers, hours=24):
+    """
+    The start_time of the pull that produced these influencers: `hours` before their latest
+    last_tweet_pull, None if none of them has been pulled
+    """
+    pulls = [i["last_tweet_pull"] for i in influencers if i.get("last_tweet_pull")]
+    if not pulls:
+        return None
+    start = datetime.datetime.fromisoformat(max(pulls)) - datetime.timedelta(hours=hours)
+    return start.isoformat("T", timespec="milliseconds") + "Z"
+
+
+def twitter_base_url():
+    """
+    Read at client creation, not import, so a test or a load run can point the engine somewhere else
+    """
+    return os.environ.get("TWITTER_BASE_URL") or TWITTER_BASE_URL
+
+
+def run_sync(coro):
+    """
+    asyncio.run that also works when a loop is already running in this thread (ie. in a jupyter notebook),
+    by running the coroutine on its own loop in a worker thread
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
+class AsyncTwitterClient:
+    """
+    Minimal async client for the few Twitter v2 endpoints we use.
+
+    Responses are the raw json dicts, so tweets come back in the same shape as the `.data` of a tweepy.Tweet
+
+    usage:
+        async with AsyncTwitterClient() as client:
+            user = await client.get_user(username="vitalikbuterin")
+
+    bearer_token (str): use only this token, instead of the pool of every credential in the environment
+    base_url (str): defaults to twitter_base_url()
+    pool (CredentialPool): credentials to route requests over, defaults to credentials.default_pool()
+    """
+
+    def __init__(
+        self,
+        bearer_token=None,
+        base_url=None,
+        max_concurrency=20,
+        pool=None,
+        max_retries=5,
+    ):
+        if pool is None:
+            pool = (
+                CredentialPool([Credential("twitter", bearer_token)])
+                if bearer_token
+                else default_pool()
+            )
+        self.pool = pool
+        self.base_url = base_url or twitter_base_url()
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.session = None
+
+    async def __aenter__(self):
+        # the connector limit is what bounds concurrency, every request shares its pool
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+            timeout=aiohttp.ClientTimeout(total=30),
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def request(self, endpoint, path, params=None):
+        """
+        endpoint (str): key into ENDPOINT_LIMITS, used to pick the token bucket
+        path (str): the actual path to request, ie. endpoint with ids filled in
+        """
+        for attempt in range(self.max_retries):
+            credential = await self.pool.acquire(endpoint)
+            try:
+                with metrics.outbound(self.base_url):
+                    res = await self.session.get(
+                        self.base_url + path, params=params, headers=credential.headers
+                    )
+                async with res:
+                    credential.scheduler.update(endpoint, res.status, res.headers)
+                    metrics.api_call("twitter", endpoint, res.status)
+                    if res.status == 429:
+                        continue  # this credential is blocked until its window resets, another takes over
+                    if res.status >= 500:
+                        metrics.slept("backoff", 2**attempt)
+                        await asyncio.sleep(2**attempt)
+                        continue
+                    res.raise_for_status()
+                    return await res.json()
+            except asyncio.TimeoutError:
+                metrics.slept("backoff", 2**attempt)
+                await asyncio.sleep(2**attempt)
+        raise RuntimeError(f"giving up on {path} after {self.max_retries} attempts")
+
+    async def get_user(self, username):
+        res = await self.request(
+            "/2/users/by/username/:username", f"/2/users/by/username/{username}"
+        )
+        return res.get("data")
+
+    async def get_users(self, usernames):
+        """
+        Bulk lookup of up to USER_LOOKUP_BATCH usernames in one request.
+        Usernames that don't exist (suspended, renamed) come back in "errors" and are left out
+        """
+        res = await self.request(
+            "/2/users/by", "/2/users/by", {"usernames": ",".join(usernames)}
+        )
+        return res.get("data", [])
+
+    async def get_users_by_ids(self, ids):
+        """
+        Bulk lookup of up to USER_LOOKUP_BATCH user ids in one request
+        """
+        res = await self.request("/2/users", "/2/users", {"ids": ",".join(ids)})
+        return res.get("data", [])
+
+    async def get_users_tweets(
+        self,
+        user_id,
+        start_time=None,
+        since_id=None,
+        max_results=None,
+        paginate=False,
+        tweet_fields=TWEET_FIELDS,
+    ):
+        """
+        since_id (str): only return tweets newer than this id
+        paginate (bool): follow meta.next_token until every matching tweet is pulled, not just the first page
+
+        Returns tweets newest first, the same order the api gives them in
+        """
+        params = {"tweet.fields": ",".join(tweet_fields)}
+        if start_time:
+            params["start_time"] = start_time
+        if since_id:
+            params["since_id"] = since_id
+        if max_results:
+            params["max_results"] = max_results
+        tweets = []
+        while True:
+            res = await self.request(
+                "/2/users/:id/tweets", f"/2/users/{user_id}/tweets", params
+            )
+            tweets.extend(res.get("data", []))
+            next_token = res.get("meta", {}).get("next_token")
+            if not paginate or not next_token:
+                return tweets
+            params["pagination_token"] = next_token
+
+    async def get_tweets(self, ids, tweet_fields=TWEET_FIELDS):
+        """
+        Bulk lookup of up to TWEET_LOOKUP_BATCH tweet ids in one request.
+        Deleted or protected tweets come back in "errors" and are left out
+        """
+        params = {"ids": ",".join(ids), "tweet.fields": ",".join(tweet_fields)}
+        res = await self.request("/2/tweets", "/2/tweets", params)
+        return res.get("data", [])
+
+
+def influencer_username(influencer):
+    return influencer["social_account"]["social_account"]["screen_name"]
+
+
+async def gather_batches(lookup, batches, what):
+    """
+    Run lookup(batch) for every batch at once. A batch that fails (retries used up, connection errors)
+    is reported and left out, so its items stay unresolved instead of failing every other batch.
+
+    what (str): what the batches hold, for the message
+
+    Returns the results of the batches that succeeded
+    """
+    results = await asyncio.gather(*[lookup(b) for b in batches], return_exceptions=True)
+    succeeded = []
+    for batch, result in zip(batches, results):
+        if isinstance(result, (aiohttp.ClientError, RuntimeError)):
+            print(f"failed to look up a batch of {len(batch)} {what}, leaving them out. Print exception below")
+            print(result)
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            succeeded.append(result)
+    return succeeded
+
+
+async def resolve_user_ids(client, usernames, cache=None, handles=None):
+    """
+    Map screen names to twitter user ids, reading the persistent cache first and
+    looking up whatever is missing in batches of USER_LOOKUP_BATCH.
+
+    Every id found is also written to the handle cache (id -> screen_name), so vote tweets
+    by these users can be labelled without another lookup.
+
+    Returns {username: user_id} for every username twitter knows about (a batch whose lookup failed is left
+    out, see gather_batches)
+    """
+    cache = cache if cache is not None else user_id_cache()
+    handles = handles if handles is not None else user_handle_cache()
+    unique = {u.lower() for u in usernames}
+    missing = sorted(u for u in unique if u not in cache)
+    metrics.cache_lookups("user_ids", hits=len(unique) - len(missing), misses=len(missing))
+    batches = [
+        missing[i : i + USER_LOOKUP_BATCH]
+        for i in range(0, len(missing), USER_LOOKUP_BATCH)
+    ]
+    for users in await gather_batches(client.get_users, batches, "usernames"):
+        for user in users:
+            cache.set(user["username"].lower(), user["id"])
+    cache.save()
+
+    user_ids = {}
+    for username in usernames:
+        user_id = cache.get(username.lower())
+        if user_id:
+            user_ids[username] = user_id
+            handles.set(user_id, username)
+    handles.save()
+    return user_ids
+
+
+async def resolve_usernames(user_ids, handles=None, max_concurrency=20):
+    """
+    Map twitter user ids to screen names, reading the handle cache first and looking up
+    whatever is missing in batches of USER_LOOKUP_BATCH.
+
+    Returns {user_id: username} for every id twitter knows about (a batch whose lookup failed is left out,
+    see gather_batches)
+    """
+    handles = handles if handles is not None else user_handle_cache()
+    missing = sorted({i for i in user_ids if i not in handles})
+    metrics.cache_lookups("user_handles", hits=len(set(user_ids)) - len(missing), misses=len(missing))
+    if missing:
+        batches = [
+            missing[i : i + USER_LOOKUP_BATCH]
+            for i in range(0, len(missing), USER_LOOKUP_BATCH)
+        ]
+        async with AsyncTwitterClient(max_concurrency=max_concurrency) as client:
+            results = await gather_batches(client.get_users_by_ids, batches, "user ids")
+        for users in results:
+            for user in users:
+                handles.set(user["id"], user["username"])
+        handles.save()
+    return {i: handles.get(i) for i in user_ids if handles.get(i)}
+
+
+def tweet_link(tweet, username=None):
+    return f"https://twitter.com/{username or 'i/web'}/status/{tweet['id']}"
+
+
+def label_authors(tweets):
+    """
+    Set "author_username" on every tweet (and point "tweet_link" at the real handle), resolving the
+    author ids in bulk at build time so rendering a page never has to ask twitter.
+    Authors we couldn't resolve keep their id as author_username and an i/web link
+    """
+    usernames = run_sync(resolve_usernames({t["author_id"] for t in tweets if "author_id" in t}))
+    for i_tweet in tweets:
+        username = usernames.get(i_tweet.get("author_id"))
+        i_tweet["author_username"] = username or i_tweet.get("author_id")
+        i_tweet["tweet_link"] = tweet_link(i_tweet, username)
+    return tweets
+
+
+async def _fetch_influencer_tweets(client, influencer, user_id, start_time):
+    """
+    Async version of `build_feed.get_influencer_tweets`, sets influencer["tweets"] and
+    influencer["last_tweet_pull"] the same way and returns the list of tweets (None if the pull failed)
+
+    user_id (str): the influencer's twitter id from `resolve_user_ids`, None if the lookup found nothing
+    """
+    now = datetime.datetime.now()
+    username = influencer_username(influencer)
+    try:
+        if user_id:
+            tweets = await client.get_users_tweets(user_id, start_time=start_time)
+            influencer["tweets"] = tweets
+        else:
+            print(f"no data found for user '{username}'")
+            tweets = []
+    except (aiohttp.ClientError, RuntimeError) as err:
+        print(f"failed to pull tweets for '{username}'. Print exception below")
+        print(err)
+        return None
+    influencer["last_tweet_pull"] = str(now)
+    return tweets
+
+
+async def _fetch_new_user_tweets(client, username, user_id, since_id, start_time):
+    """
+    Every tweet newer than since_id (or start_time for a user we have never pulled), None if the pull failed
+    """
+    try:
+        return await client.get_users_tweets(
+            user_id,
+            start_time=None if since_id else start_time,
+            since_id=since_id,
+            max_results=100,
+            paginate=True,
+        )
+    except (aiohttp.ClientError, RuntimeError) as err:
+        print(f"failed to pull new tweets for '{username}'. Print exception below")
+        print(err)
+        return None
+
+
+async def fetch_new_tweets(since_ids, start_time=None, max_concurrency=20):
+    """
+    Delta pull for a set of users.
+
+    since_ids (dict): {username: newest tweet id we already hold, or None}
+
+    Returns {username: (user_id, [new tweets, newest first])}. Users that failed, or that twitter
+    doesn't know about, are left out so their stored tweets are not touched
+    """
+    start_time = start_time or default_start_time()
+    with metrics.stage("tweet_fetch"):
+        async with AsyncTwitterClient(max_concurrency=max_concurrency) as client:
+            user_ids = await resolve_user_ids(client, list(since_ids))
+            usernames = [u for u in since_ids if u in user_ids]
+            with tqdm(total=len(usernames)) as pbar:
+
+                async def fetch(username):
+                    tweets = await _fetch_new_user_tweets(
+                        client, username, user_ids[username], since_ids[username], start_time
+                    )
+                    pbar.update(1)
+                    return tweets
+
+                results = await asyncio.gather(*[fetch(u) for u in usernames])
+        return {
+            username: (user_ids[username], tweets)
+            for username, tweets in zip(usernames, results)
+            if tweets is not None
+        }
+
+
+async def fetch_influencers_tweets(
+    influencers, start_time=None, max_concurrency=20, on_result=None
+):
+    """
+    Pull tweets for every influencer concurrently, sharing one session and one rate limit budget.
+
+    on_result (callable): called with each influencer as soon as its pull succeeds (ie. PullJournal.append)
+
+    Returns a list of tweet lists, in the same order as influencers
+    """
+    start_time = start_time or default_start_time()
+    with metrics.stage("tweet_fetch"):
+        async with AsyncTwitterClient(max_concurrency=max_concurrency) as client:
+            user_ids = await resolve_user_ids(
+                client, [influencer_username(i) for i in influencers]
+            )
+            with tqdm(total=len(influencers)) as pbar:
+
+                async def fetch(influencer):
+                    user_id = user_ids.get(influencer_username(influencer))
+                    tweets = await _fetch_influencer_tweets(
+                        client, influencer, user_id, start_time
+                    )
+                    if tweets is not None and on_result:
+                        on_result(influencer)
+                    pbar.update(1)
+                    return tweets or []
+
+                return await asyncio.gather(*[fetch(i) for i in influencers])
+
+
+def quoted_tweet_id(tweet):
+    """
+    The id of the tweet this tweet quotes, None if it doesn't quote anything
+
+    "referenced tweets" include quoted tweets, find them by checking "type" of referenced tweet (other types are "replied_to" and "retweeted")
+    """
+    for i_ref_tweet in tweet.get("referenced_tweets", []):
+        if i_ref_tweet["type"] == "quoted":
+            return i_ref_tweet["id"]
+    return None
+
+
+async def lookup_tweets(ids, max_concurrency=20):
+    """
+    Hydrate tweet ids TWEET_LOOKUP_BATCH at a time.
+
+    Returns {id: tweet}, None for the tweets that no longer exist. The ids of a batch whose lookup failed
+    are missing, so the caller can tell them apart and try again later (see gather_batches)
+    """
+    ids = list(dict.fromkeys(ids))
+    batches = [
+        ids[i : i + TWEET_LOOKUP_BATCH] for i in range(0, len(ids), TWEET_LOOKUP_BATCH)
+    ]
+
+    async def lookup(batch):
+        found = {tweet["id"]: tweet for tweet in await client.get_tweets(batch)}
+        return {i: found.get(i) for i in batch}
+
+    async with AsyncTwitterClient(max_concurrency=max_concurrency) as client:
+        results = await gather_batches(lookup, batches, "tweet ids")
+    return {k: v for batch in results for k, v in batch.items()}
@@ -0,0 +1,139 @@
+"""
+Write-ahead journal for long cluster pulls.
+
+A pull of a few hundred influencers takes long enough (and burns enough rate limit) that losing it to a
+crash, a Ctrl-C or a stall is expensive. Each influencer's tweets are appended to a json lines journal the
+moment they arrive, so a pull started with resume=True skips everyone already journaled and only spends
+quota on the rest. Once every influencer is in, the journal is compacted into the cluster section and removed.
+
+Journal layout (one json object per line):
+    {"cluster": str, "start_time": str, "influencers": [...]}  header, the window and influencer list of the pull
+    {"username": str, "influencer": {...}}  one per finished influencer, with "tweets" and "last_tweet_pull" set
+
+A line cut short by a crash is ignored, that influencer is just pulled again.
+"""
+import os
+import json
+from pathlib import Path
+
+from .ingest import influencer_username
+
+JOURNAL_DIR = Path("db/journal")
+
+
+def journal_path(db_fpath, cluster_name):
+    """
+    db/test_db.json + Ethereum -> db/journal/test_db.json.Ethereum.jsonl
+    """
+    return JOURNAL_DIR / f"{Path(db_fpath).name}.{cluster_name}.jsonl"
+
+
+class PullJournal:
+    """
+    usage:
+        journal = PullJournal.load(fpath) or PullJournal.create(fpath, cluster_name, start_time, influencers)
+        for influencer in journal.pending():
+            ...  # pull it
+            journal.append(influencer)
+        section = journal.compact()
+        ...  # save section to the db
+        journal.remove()
+    """
+
+    def __init__(self, fpath, header, records):
+        self.fpath = Path(fpath)
+        self.header = header
+        self.records = records  # {username: influencer}, in the order they were journaled
+
+    @property
+    def cluster_name(self):
+        return self.header["cluster"]
+
+    @property
+    def start_time(self):
+        return self.header["start_time"]
+
+    @property
+    def influencers(self):
+        return self.header["influencers"]
+
+    @classmethod
+    def create(cls, fpath, cluster_name, start_time, influencers):
+        """
+        Start a new journal at fpath (replacing any old one) for a pull of influencers over start_time
+        """
+        header = {
+            "cluster": cluster_name,
+            "start_time": start_time,
+            "influencers": influencers,
+        }
+        Path(fpath).parent.mkdir(parents=True, exist_ok=True)
+        with open(fpath, "w") as f:
+            f.write(json.dumps(header) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return cls(fpath, header, {})
+
+    @classmethod
+    def load(cls, fpath):
+        """
+        Returns the journal at fpath, None if there isn't one (or its header never made it to disk)
+        """
+        if not os.path.isfile(fpath):
+            return None
+        header, records, good_bytes = None, {}, 0
+        with open(fpath, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # the last line of a crashed pull
+                if not line.endswith(b"\n"):
+                    break
+                good_bytes += len(line)
+                if header is None:
+                    header = record
+                else:
+                    records[record["username"]] = record["influencer"]
+        if header is None:
+            return None
+        # cut off a half written line, so the next append starts on a line of its own
+        if good_bytes < os.path.getsize(fpath):
+            with open(fpath, "r+b") as f:
+                f.truncate(good_bytes)
+        return cls(fpath, header, records)
+
+    def append(self, influencer):
+        """
+        Durably record one finished influencer (fsync'd before returning)
+        """
+        username = influencer_username(influencer)
+        with open(self.fpath, "a") as f:
+            f.write(json.dumps({"username": username, "influencer": influencer}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.records[username] = influencer
+
+    def pending(self):
+        """
+        The influencers of the pull that aren't journaled yet
+        """
+        return [i for i in self.influencers if influencer_username(i) not in self.records]
+
+    def compact(self):
+        """
+        The cluster section (see Feed.dict) built from the journal, influencers in their original order.
+        Influencers whose pull failed keep their Borg data with no tweets
+        """
+        influencers = [
+            self.records.get(influencer_username(i), i) for i in self.influencers
+        ]
+        return {
+            "influencers": influencers,
+            "cluster": self.cluster_name,
+            "all_feed_tweets": [t for i in influencers for t in i.get("tweets") or []],
+        }
+
+    def remove(self):
+        if self.fpath.exists():
+            self.fpath.unlink()
@@ -0,0 +1,299 @@
+"""
+Pipeline instrumentation: stage timers, counters and outbound latency histograms.
+
+Every process keeps its own registry, filled in by the pipeline as it runs:
+
+    stage_seconds{stage}                     influencer_fetch, tweet_fetch, quote_hydration, link_resolution, metadata_fetch
+    api_calls_total{api, endpoint, status}   every response from the Twitter and Borg apis
+    rate_limited_total{api, endpoint}        the 429s among them
+    sleeps_total{reason}                     waits on a rate limit window or a retry backoff,
+    sleep_seconds_total{reason}                  and how long they added up to
+    cache_hits_total{cache}                  lookups answered by one of the caches in caches.py,
+    cache_misses_total{cache}                    and the ones that had to go to the network
+    outbound_latency_seconds{host}           every outbound http request
+
+The web app serves it (and the reports of the last CLI runs) in the Prometheus text format on /metrics,
+and the CLI builds write it as a json report when they finish (see write_report).
+
+usage:
+    with stage("metadata_fetch"):
+        ...
+    inc("api_calls_total", api="borg", endpoint="/influence/clusters/", status=200)
+"""
+import os
+import json
+import time
+import threading
+import contextlib
+from pathlib import Path
+from urllib.parse import urlsplit
+
+REPORT_DIR = Path("db/metrics")
+
+NAMESPACE = "feed"
+
+STAGE_BUCKETS = [0.1, 0.5, 1, 5, 15, 60, 300, 900]
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    "stage_seconds": ("histogram", "Wall time of each run of a pipeline stage", STAGE_BUCKETS),
+    "api_calls_total": ("counter", "Responses from the Twitter and Borg apis", None),
+    "rate_limited_total": ("counter", "Responses from the Twitter and Borg apis that were 429s", None),
+    "sleeps_total": ("counter", "Waits on a rate limit window or a retry backoff", None),
+    "sleep_seconds_total": ("counter", "Seconds spent in those waits", None),
+    "cache_hits_total": ("counter", "Lookups answered by a persistent cache", None),
+    "cache_misses_total": ("counter", "Lookups a persistent cache couldn't answer", None),
+    "outbound_latency_seconds": ("histogram", "Latency of outbound http requests, per host", LATENCY_BUCKETS),
+}
+
+
+def _key(name, labels):
+    if name not in METRICS:
+        raise KeyError(f"unknown metric {name}, add it to METRICS")
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Registry:
+    """
+    Counters and histograms of one process. Thread safe, the page fetcher and link resolver record from threads
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}  # key -> {"buckets": [..., +Inf], "sum", "count", "max"}
+
+    def inc(self, name, n=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + n
+
+    def observe(self, name, value, **labels):
+        key = _key(name, labels)
+        buckets = METRICS[name][2]
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {
+                    "buckets": [0] * (len(buckets) + 1),
+                    "sum": 0.0,
+                    "count": 0,
+                    "max": 0.0,
+                }
+            index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+            histogram["buckets"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+            histogram["max"] = max(histogram["max"], value)
+
+    def snapshot(self):
+        """
+        Everything recorded so far as plain data (json and pickle friendly)
+        """
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self):
+        return {
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in self._counters.items()
+            ],
+            "histograms": [
+                {"name": name, "labels": dict(labels), **histogram, "buckets": list(histogram["buckets"])}
+                for (name, labels), histogram in self._histograms.items()
+            ],
+        }
+
+    def drain(self):
+        """
+        snapshot() and reset() in one go, how a worker process hands its metrics to the main process
+        """
+        with self._lock:
+            snapshot = self._snapshot()
+            self._counters = {}
+            self._histograms = {}
+        return snapshot
+
+    def merge(self, snapshot):
+        """
+        Add another registry's snapshot (ie. a worker process's) into this one
+        """
+        for i in snapshot["counters"]:
+            self.inc(i["name"], i["value"], **i["labels"])
+        with self._lock:
+            for i in snapshot["histograms"]:
+                key = _key(i["name"], i["labels"])
+                held = self._histograms.get(key)
+                if held is None:
+                    self._histograms[key] = {
+                        "buckets": list(i["buckets"]),
+                        "sum": i["sum"],
+                        "count": i["count"],
+                        "max": i["max"],
+                    }
+                    continue
+                held["buckets"] = [a + b for a, b in zip(held["buckets"], i["buckets"])]
+                held["sum"] += i["sum"]
+                held["count"] += i["count"]
+                held["max"] = max(held["max"], i["max"])
+
+
+REGISTRY = Registry()
+
+
+def inc(name, n=1, **labels):
+    REGISTRY.inc(name, n, **labels)
+
+
+def observe(name, value, **labels):
+    REGISTRY.observe(name, value, **labels)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Time a run of a pipeline stage, works around async code too
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("stage_seconds", time.perf_counter() - started, stage=name)
+
+
+@contextlib.contextmanager
+def outbound(url):
+    """
+    Time an outbound request, recorded against the url's host
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("outbound_latency_seconds", time.perf_counter() - started, host=urlsplit(url).hostname)
+
+
+def api_call(api, endpoint, status):
+    inc("api_calls_total", api=api, endpoint=endpoint, status=status)
+    if status == 429:
+        inc("rate_limited_total", api=api, endpoint=endpoint)
+
+
+def slept(reason, seconds):
+    """
+    Call before (or after) sleeping on a rate limit or a backoff
+    """
+    inc("sleeps_total", reason=reason)
+    inc("sleep_seconds_total", max(seconds, 0), reason=reason)
+
+
+def cache_lookups(cache, hits=0, misses=0):
+    """
+    cache (str): which cache, ie. "user_ids"
+    """
+    if hits:
+        inc("cache_hits_total", hits, cache=cache)
+    if misses:
+        inc("cache_misses_total", misses, cache=cache)
+
+
+def _label_text(labels):
+    return ",".join(f"{k}={v}" for k, v in sorted(labels.items()))
+
+
+def report(snapshot=None):
+    """
+    A readable summary of a snapshot (the live registry by default), with the raw snapshot under "snapshot"
+    """
+    snapshot = snapshot if snapshot is not None else REGISTRY.snapshot()
+    counters = {}
+    for i in snapshot["counters"]:
+        counters.setdefault(i["name"], {})[_label_text(i["labels"])] = i["value"]
+    stages, latency = {}, {}
+    for i in snapshot["histograms"]:
+        summary = {
+            "count": i["count"],
+            "seconds": round(i["sum"], 4),
+            "mean_seconds": round(i["sum"] / i["count"], 4) if i["count"] else None,
+            "max_seconds": round(i["max"], 4),
+        }
+        if i["name"] == "stage_seconds":
+            stages[i["labels"]["stage"]] = summary
+        elif i["name"] == "outbound_latency_seconds":
+            latency[i["labels"]["host"]] = summary
+    return {"stages": stages, "counters": counters, "latency": latency, "snapshot": snapshot}
+
+
+def write_report(name, fpath=None, **extra):
+    """
+    Dump the live registry as a json report, at the end of a CLI run.
+
+    name (str): the command, the report goes to REPORT_DIR/<name>.json unless fpath is given
+    extra: more keys for the report, ie. the build's per stage throughput
+
+    Returns the report's fpath
+    """
+    fpath = Path(fpath or REPORT_DIR / f"{name}.json")
+    os.makedirs(fpath.parent, exist_ok=True)
+    with open(fpath, "w") as f:
+        json.dump({"name": name, "finished_at": time.time(), **extra, **report()}, f, indent=2)
+    return fpath
+
+
+def read_reports(dirpath=REPORT_DIR):
+    """
+    {name: report} of every report in dirpath
+    """
+    reports = {}
+    for fpath in sorted(Path(dirpath).glob("*.json")):
+        try:
+            with open(fpath, "r") as f:
+                reports[fpath.stem] = json.load(f)
+        except (OSError, ValueError):
+            continue
+    return reports
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _series(name, labels, value):
+    label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+    return f"{NAMESPACE}_{name}{{{label_text}}} {value}" if label_text else f"{NAMESPACE}_{name} {value}"
+
+
+def prometheus_text(snapshots):
+    """
+    snapshots (list): (extra labels, snapshot) pairs, ie. ({"run": "app"}, REGISTRY.snapshot())
+
+    Returns the Prometheus text exposition format
+    """
+    by_name = {name: [] for name in METRICS}
+    for extra_labels, snapshot in snapshots:
+        for i in snapshot["counters"] + snapshot["histograms"]:
+            if i["name"] in by_name:
+                by_name[i["name"]].append({**i, "labels": {**extra_labels, **i["labels"]}})
+
+    lines = []
+    for name, series in by_name.items():
+        kind, help_text, buckets = METRICS[name]
+        lines.append(f"# HELP {NAMESPACE}_{name} {help_text}")
+        lines.append(f"# TYPE {NAMESPACE}_{name} {kind}")
+        for i in series:
+            if kind == "counter":
+                lines.append(_series(name, i["labels"], i["value"]))
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + ["+Inf"], i["buckets"]):
+                cumulative += count
+                lines.append(_series(f"{name}_bucket", {**i["labels"], "le": bound}, cumulative))
+            lines.append(_series(f"{name}_sum", i["labels"], i["sum"]))
+            lines.append(_series(f"{name}_count", i["labels"], i["count"]))
+    return "\n".join(lines) + "\n"
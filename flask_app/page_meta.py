@@ -0,0 +1,277 @@
+"""
+Fetch the title, description, og:image and canonical url of the pages in an external url feed.
+
+Pages are fetched concurrently by threads (with a per domain limit so we don't hammer one site) and only
+read up to </head>, so we never download more than the first few KB of a page. Parsing is CPU bound, so
+the raw head bytes are handed to a pool of parser processes instead of parsing on the fetch threads under
+the GIL. At most `max_pending` fetched heads wait for a parser at once, so memory stays flat however
+many pages a build has.
+"""
+import os
+import threading
+import concurrent.futures
+from collections import defaultdict
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+
+from . import caches, metrics
+from .caches import JsonCache
+from .urls import canonicalize_url
+
+MAX_HEAD_BYTES = 64 * 1024  # stop reading a page after this much, even if </head> never showed up
+CHUNK_SIZE = 4096
+
+PAGE_TTL = 7 * 24 * 60 * 60
+FAILED_PAGE_TTL = 60 * 60
+
+DESCRIPTION_KEYS = ["name:description", "property:description", "property:og:description"]
+
+
+class HeadParser(HTMLParser):
+    """
+    Incremental parser that only keeps <title>, <meta> and <link rel=canonical> tags, and marks itself done at </head> (or <body>)
+
+    usage:
+        parser = HeadParser()
+        parser.feed(chunk)  # as many times as you like, check parser.done between chunks
+        parser.metadata()
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.done = False
+        self.metas = {}  # "name:description" / "property:og:title" -> content
+        self._title = []
+        self._in_title = False
+        self._canonical = None
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if tag == "title":
+            self._in_title = True
+        elif tag == "meta":
+            attrs = dict(attrs)
+            content = attrs.get("content")
+            for key in ("name", "property"):
+                if attrs.get(key) and content is not None:
+                    self.metas.setdefault(f"{key}:{attrs[key].lower()}", content)
+        elif tag == "link":
+            attrs = dict(attrs)
+            if "canonical" in (attrs.get("rel") or "").lower().split() and attrs.get("href"):
+                self._canonical = self._canonical or attrs["href"]
+        elif tag == "body":
+            self.done = True
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self._in_title = False
+        elif tag == "head":
+            self.done = True
+
+    def handle_data(self, data):
+        if self._in_title and not self.done:
+            self._title.append(data)
+
+    def metadata(self):
+        title = "".join(self._title).strip() or None
+        description = next(
+            (self.metas[k] for k in DESCRIPTION_KEYS if k in self.metas), None
+        )
+        og = {
+            k[len("property:og:") :]: v
+            for k, v in self.metas.items()
+            if k.startswith("property:og:")
+        }
+        return {
+            "title": title,
+            "description": description,
+            "og": og,
+            "canonical": self._canonical,
+        }
+
+
+def empty_metadata():
+    return {"title": None, "description": None, "og": {}, "canonical": None}
+
+
+def page_metadata_cache():
+    """
+    canonical url -> page metadata, shared by every cluster so an article is only fetched once
+    """
+    return JsonCache(caches.CACHE_DIR / "page_metadata.json", ttl=PAGE_TTL)
+
+
+def read_head(session, url, timeout=(3.05, 10), max_bytes=MAX_HEAD_BYTES):
+    """
+    Stream a page until its </head> (or <body>, or max_bytes) has arrived.
+
+    Returns (raw bytes, encoding from the headers or None, the final url after redirects). An error status
+    raises requests.HTTPError, a 404 or paywall page is not the article's metadata
+    """
+    chunks, read, tail = [], 0, b""
+    with metrics.outbound(url):
+        res = session.get(url, stream=True, timeout=timeout)
+    with res:
+        res.raise_for_status()
+        for chunk in res.iter_content(CHUNK_SIZE):
+            chunks.append(chunk)
+            read += len(chunk)
+            # keep the end of the last chunk, a tag can be split across two chunks
+            window = (tail + chunk).lower()
+            if b"</head" in window or b"<body" in window or read >= max_bytes:
+                break
+            tail = window[-8:]
+        return b"".join(chunks), res.encoding, res.url
+
+
+def parse_head(raw, encoding=None, base_url=None):
+    """
+    The compact metadata record of a page head: {"title", "description", "og": {"image"}, "canonical"}.
+
+    Runs in the parser processes, so it only takes and returns plain data. A relative canonical url is made
+    absolute against base_url (the page's final url)
+    """
+    try:
+        text = raw.decode(encoding or "utf-8", errors="replace")
+    except LookupError:  # a charset python doesn't know, ie. "utf8mb4"
+        text = raw.decode("utf-8", errors="replace")
+    parser = HeadParser()
+    parser.feed(text)
+    metadata = parser.metadata()
+    metadata["og"] = {k: v for k, v in metadata["og"].items() if k == "image"}
+    if metadata["canonical"] and base_url:
+        metadata["canonical"] = urljoin(base_url, metadata["canonical"])
+    return metadata
+
+
+def fetch_page_metadata(session, url, timeout=(3.05, 10), max_bytes=MAX_HEAD_BYTES):
+    """
+    Fetch and parse a single page in this thread, returns the parsed metadata (see parse_head)
+    """
+    raw, encoding, final_url = read_head(session, url, timeout, max_bytes)
+    return parse_head(raw, encoding, final_url)
+
+
+class PageMetadataFetcher:
+    """
+    max_workers (int): pages fetched at once across all domains
+    per_domain (int): pages fetched at once from a single domain
+    parse_workers (int): parser processes, defaults to the number of cpus. 0 parses on the fetch threads
+    max_pending (int): fetched heads allowed to wait for a parser, fetch threads block past this
+    """
+
+    def __init__(
+        self,
+        max_workers=16,
+        per_domain=2,
+        cache=None,
+        parse_workers=None,
+        max_pending=64,
+    ):
+        self.cache = cache if cache is not None else page_metadata_cache()
+        self.max_workers = max_workers
+        self.per_domain = per_domain
+        self.parse_workers = os.cpu_count() if parse_workers is None else parse_workers
+        self.max_pending = max_pending
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=100, pool_maxsize=per_domain)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = "XY"
+        self._domain_locks = defaultdict(
+            lambda: threading.BoundedSemaphore(self.per_domain)
+        )
+        self._domain_locks_lock = threading.Lock()
+
+    def _domain_lock(self, url):
+        with self._domain_locks_lock:
+            return self._domain_locks[urlsplit(url).hostname]
+
+    def read(self, url):
+        """
+        Returns (raw head bytes, encoding, final url), or None if the page couldn't be fetched
+        """
+        with self._domain_lock(url):
+            try:
+                return read_head(self.session, url)
+            except requests.RequestException as err:
+                print(f"error fetching page {url}. Print exception below")
+                print(err)
+                return None
+
+    def fetch(self, url):
+        """
+        Returns the page metadata, or None if the page couldn't be fetched
+        """
+        head = self.read(url)
+        return parse_head(*head) if head is not None else None
+
+    def _parse_all(self, urls):
+        """
+        Fetch on threads and parse in processes, returns the metadata (or None) of each url in order.
+
+        A fetched head takes a slot until its parse finishes, so at most max_pending heads are in memory
+        """
+        slots = threading.BoundedSemaphore(self.max_pending)
+
+        with concurrent.futures.ProcessPoolExecutor(self.parse_workers) as parsers:
+
+            def fetch_then_parse(url):
+                head = self.read(url)
+                if head is None:
+                    return None
+                slots.acquire()
+                future = parsers.submit(parse_head, *head)
+                future.add_done_callback(lambda _: slots.release())
+                return future
+
+            with concurrent.futures.ThreadPoolExecutor(self.max_workers) as fetchers:
+                parses = list(tqdm(fetchers.map(fetch_then_parse, urls), total=len(urls)))
+
+            results = []
+            for future in parses:
+                try:
+                    results.append(future.result() if future is not None else None)
+                except Exception as err:
+                    print("error parsing a page. Print exception below")
+                    print(err)
+                    results.append(None)
+            return results
+
+    def fetch_all(self, urls):
+        """
+        Returns {url: {"title": str, "description": str, "og": {"image": str}, "canonical": str}} for every url.
+
+        Urls are deduplicated by canonical url and looked up in the persistent page cache first,
+        so each article is fetched once no matter how many links (or clusters) point at it
+        """
+        with metrics.stage("metadata_fetch"):
+            by_canonical = {}
+            for url in urls:
+                by_canonical.setdefault(canonicalize_url(url), url)
+            missing = [k for k in by_canonical if k not in self.cache]
+            to_fetch = [by_canonical[k] for k in missing]
+            metrics.cache_lookups("page_metadata", hits=len(by_canonical) - len(missing), misses=len(missing))
+
+            if self.parse_workers and to_fetch:
+                results = self._parse_all(to_fetch)
+            else:
+                with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+                    results = list(
+                        tqdm(executor.map(self.fetch, to_fetch), total=len(to_fetch))
+                    )
+            for canonical_url, metadata in zip(missing, results):
+                if metadata is None:
+                    self.cache.set(canonical_url, empty_metadata(), ttl=FAILED_PAGE_TTL)
+                else:
+                    self.cache.set(canonical_url, metadata)
+            self.cache.save()
+
+        return {
+            url: self.cache.get(canonicalize_url(url)) or empty_metadata() for url in urls
+        }
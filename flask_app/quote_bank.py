@@ -0,0 +1,170 @@
+"""
+Incremental maintenance of a cluster's external url quote tweet bank.
+
+The bank ({ref_tweet_id: {external_urls, ref_tweet_data, vote_tweets}}, see filter_tweets_for_external_urls)
+used to be rebuilt from every tweet in the cluster on each build, re-hydrating every quoted tweet and
+re-resolving every link. Now a small state dict is stored next to the bank:
+
+    processed: {vote tweet id: created_at} of every tweet already folded into the bank
+    ref_urls: {ref tweet id: {"urls": [...], "seen": created_at of its newest vote}}, including quoted tweets
+        without an external url (urls == []) so they are never looked up again
+    cursors: {username: id of the newest tweet already processed for that user}
+
+so a build only looks at tweets it hasn't seen, only hydrates quoted tweets it has never seen, and
+expires votes (and then entries) that fall out of the window.
+"""
+import concurrent.futures
+
+from tqdm import tqdm
+
+from . import metrics
+from .ingest import lookup_tweets, quoted_tweet_id, run_sync
+from .url_resolver import default_resolver
+from .urls import extract_external_urls
+
+QUOTE_BANK_STATE_KEY = "external_url_quote_tweet_bank_state"
+
+
+def empty_state():
+    # retry: votes whose quoted tweet couldn't be looked up, folded in again by the next update
+    return {"processed": {}, "ref_urls": {}, "cursors": {}, "retry": []}
+
+
+def state_from_bank(bank):
+    """
+    Index a bank built before incremental updates, so its votes and quoted tweets aren't processed again
+    """
+    state = empty_state()
+    for ref_tweet_id, entry in bank.items():
+        for i_tweet in entry["vote_tweets"]:
+            state["processed"][i_tweet["id"]] = i_tweet["created_at"]
+        state["ref_urls"][ref_tweet_id] = {
+            "urls": entry["external_urls"],
+            "seen": max((i["created_at"] for i in entry["vote_tweets"]), default=None),
+        }
+    return state
+
+
+def hydrate_quoted_tweets(ref_tweet_ids):
+    """
+    Look up quoted tweets (100 ids per request) and pull their external urls.
+
+    Returns {ref_tweet_id: (ref_tweet_data, external_urls)}, (None, []) for the tweets twitter no longer has.
+    Tweets whose lookup failed are missing
+    """
+    with metrics.stage("quote_hydration"):
+        ref_tweets = run_sync(lookup_tweets(list(ref_tweet_ids)))
+    found = [i for i in ref_tweet_ids if ref_tweets.get(i)]
+
+    with metrics.stage("link_resolution"), concurrent.futures.ThreadPoolExecutor() as executor:
+        results = list(
+            tqdm(
+                executor.map(extract_external_urls, [ref_tweets[i] for i in found]),
+                total=len(found),
+            )
+        )
+
+    default_resolver().save()
+    hydrated = {i: (None, []) for i in ref_tweet_ids if i in ref_tweets}
+    hydrated.update({i: (ref_tweets[i], urls) for i, urls in zip(found, results)})
+    return hydrated
+
+
+def new_user_tweets(users, cursors):
+    """
+    users (dict): {username: user_data} with tweets newest first (see tweet_db.merge_user_tweets)
+    cursors (dict): {username: newest tweet id already processed}, updated in place
+
+    Returns the tweets newer than each user's cursor. Only walks the new prefix of each user's tweets
+    """
+    tweets = []
+    for username, user_data in users.items():
+        cursor = int(cursors.get(username) or 0)
+        for i_tweet in user_data["tweets"]:
+            if int(i_tweet["id"]) <= cursor:
+                break
+            tweets.append(i_tweet)
+        if user_data["tweets"]:
+            cursors[username] = str(max(cursor, int(user_data["tweets"][0]["id"])))
+    return tweets
+
+
+def update_quote_bank(bank, state, tweets, start_time=None, hydrate=hydrate_quoted_tweets):
+    """
+    Fold new tweets into a quote tweet bank, in place.
+
+    bank (dict): the current bank, {} to start one
+    state (dict): see empty_state, stored next to the bank between builds
+    tweets (list): candidate vote tweets, tweets already in state["processed"] are skipped
+    start_time (str): iso string, votes older than this are expired (and entries left without votes dropped)
+    hydrate (callable): ref tweet ids -> {ref_tweet_id: (ref_tweet_data, external_urls)}, ids it couldn't
+        look up are left out and their votes kept in state["retry"] for the next update
+
+    Returns the bank
+    """
+    processed, ref_urls = state["processed"], state["ref_urls"]
+    retry = state.pop("retry", None) or []
+
+    new_votes = {}
+    for i_tweet in [*retry, *tweets]:
+        if i_tweet["id"] in processed:
+            continue
+        if start_time and i_tweet["created_at"] <= start_time:
+            continue
+        processed[i_tweet["id"]] = i_tweet["created_at"]
+        ref_tweet_id = quoted_tweet_id(i_tweet)
+        if ref_tweet_id:
+            new_votes.setdefault(ref_tweet_id, []).append(i_tweet)
+
+    # quoted tweets we have never looked up, or whose entry was dropped while we still knew their urls
+    unseen = [
+        i
+        for i in new_votes
+        if i not in ref_urls or (ref_urls[i]["urls"] and i not in bank)
+    ]
+    hydrated = hydrate(unseen) if unseen else {}
+    state["retry"] = []
+    for ref_tweet_id in unseen:
+        if ref_tweet_id not in hydrated:
+            for i_tweet in new_votes.pop(ref_tweet_id):
+                del processed[i_tweet["id"]]
+                state["retry"].append(i_tweet)
+            continue
+        ref_tweet_data, urls = hydrated[ref_tweet_id]
+        ref_urls[ref_tweet_id] = {"urls": urls, "seen": ref_urls.get(ref_tweet_id, {}).get("seen")}
+        if urls:
+            bank[ref_tweet_id] = {
+                "external_urls": urls,
+                "ref_tweet_data": ref_tweet_data,
+                "vote_tweets": [],
+            }
+
+    for ref_tweet_id, votes in new_votes.items():
+        newest = max(i["created_at"] for i in votes)
+        seen = ref_urls[ref_tweet_id]["seen"]
+        ref_urls[ref_tweet_id]["seen"] = max(seen, newest) if seen else newest
+        if ref_tweet_id in bank:
+            bank[ref_tweet_id]["vote_tweets"].extend(votes)
+
+    if start_time:
+        expire(bank, state, start_time)
+    return bank
+
+
+def expire(bank, state, start_time):
+    """
+    Drop votes created before start_time, bank entries left with no votes,
+    and the processed / ref_urls index entries that can no longer matter
+    """
+    for ref_tweet_id in list(bank):
+        votes = [i for i in bank[ref_tweet_id]["vote_tweets"] if i["created_at"] > start_time]
+        if votes:
+            bank[ref_tweet_id]["vote_tweets"] = votes
+        else:
+            del bank[ref_tweet_id]
+    state["processed"] = {k: v for k, v in state["processed"].items() if v > start_time}
+    state["ref_urls"] = {
+        k: v
+        for k, v in state["ref_urls"].items()
+        if v["seen"] is None or v["seen"] > start_time
+    }
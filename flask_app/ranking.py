@@ -0,0 +1,234 @@
+"""
+Feed ranking algorithms, scored in batch with NumPy.
+
+Every vote (a tweet quoting an article) becomes one row of a VoteArrays table: which feed item it voted for,
+the voter's Borg attention score (and how much it changed over the last week), the vote tweet's public_metrics
+and when it was posted. An algorithm is a
+function of that table returning one score per item, so re-ranking a cluster is a handful of vectorized ops
+(np.bincount does the per item sums) instead of a python loop over every tweet.
+
+usage:
+    @register_ranker("my_algo")
+    def my_algo(votes, now):
+        return per_item_sum(votes, votes.attention * 2)
+
+    order = rank(votes, "my_algo")  # item indexes, best first
+"""
+import time
+from collections import namedtuple
+
+import numpy as np
+
+DEFAULT_RANKER = "shares"
+
+DECAY_HALF_LIFE_HOURS = 12  # a vote this old counts half as much in "decay"
+VELOCITY_WINDOW_HOURS = 6  # "velocity" only counts votes this recent
+GRAVITY = 1.8  # hacker news style age penalty in "hot"
+
+# columns of the votes table stored with each feed snapshot item, see vote_columns
+VOTE_COLUMNS = ["attention", "attention_change", "created_at", "likes", "retweets", "replies", "quotes"]
+
+# TweetDB sections have no Borg influencer list, the attention of their users is stored under this key
+INFLUENCER_ATTENTION_KEY = "influencer_attention"
+ATTENTION_FIELDS = ["attention_score", "attention_score_change_week"]
+
+VoteArrays = namedtuple(
+    "VoteArrays",
+    [
+        "n_items",
+        "item",  # int index of the feed item each vote is for
+        "shared_at",  # per item, epoch seconds the quoted tweet was posted (nan if unknown)
+        *VOTE_COLUMNS,
+    ],
+)
+
+RANKERS = {}
+
+
+def register_ranker(name):
+    """
+    Decorator adding a ranking algorithm to the registry under name.
+    The function gets (votes: VoteArrays, now: epoch seconds) and returns a float array of n_items scores
+    """
+
+    def decorator(func):
+        RANKERS[name] = func
+        return func
+
+    return decorator
+
+
+def influencer_attention(influencers, field="attention_score"):
+    """
+    {twitter user id: score} from a cluster's Borg influencer list
+
+    field (str): one of ATTENTION_FIELDS
+    """
+    attention = {}
+    for i in influencers or []:
+        try:
+            user_id = i["social_account"]["social_account"]["id"]
+        except (KeyError, TypeError):
+            continue
+        attention[user_id] = i.get(field) or 0.0
+    return attention
+
+
+def attention_by_field(influencers):
+    """
+    {field: {twitter user id: score}} for every ATTENTION_FIELDS, what TweetDB stores under INFLUENCER_ATTENTION_KEY
+    """
+    return {field: influencer_attention(influencers, field) for field in ATTENTION_FIELDS}
+
+
+def section_attention(section):
+    """
+    ({user id: attention_score}, {user id: attention_score_change_week}) of a cluster section, from its Borg
+    influencer list (FeedDB) or from what was stored under INFLUENCER_ATTENTION_KEY (TweetDB)
+    """
+    stored = section.get(INFLUENCER_ATTENTION_KEY) or attention_by_field(section.get("influencers"))
+    return tuple(stored.get(field) or {} for field in ATTENTION_FIELDS)
+
+
+def vote_columns(vote_tweets, attention=None, created_at_epoch=None, attention_change=None):
+    """
+    Flatten an item's vote tweets into the VOTE_COLUMNS lists stored in a feed snapshot.
+
+    attention (dict): {author_id: attention_score}, voters we have no score for count as 1.0
+    created_at_epoch (callable): parses a tweet's created_at
+    attention_change (dict): {author_id: attention_score_change_week}, unknown for voters we have no score for
+    """
+    attention = attention or {}
+    attention_change = attention_change or {}
+    columns = {k: [] for k in VOTE_COLUMNS}
+    for i_tweet in vote_tweets:
+        metrics = i_tweet.get("public_metrics") or {}
+        columns["attention"].append(attention.get(i_tweet.get("author_id"), 1.0))
+        columns["attention_change"].append(attention_change.get(i_tweet.get("author_id")))
+        columns["created_at"].append(
+            created_at_epoch(i_tweet["created_at"])
+            if created_at_epoch and i_tweet.get("created_at")
+            else None
+        )
+        columns["likes"].append(metrics.get("like_count", 0))
+        columns["retweets"].append(metrics.get("retweet_count", 0))
+        columns["replies"].append(metrics.get("reply_count", 0))
+        columns["quotes"].append(metrics.get("quote_count", 0))
+    return columns
+
+
+def build_vote_arrays(items_votes, shared_at):
+    """
+    items_votes (list): per feed item, a dict of VOTE_COLUMNS lists (see vote_columns), in feed order
+    shared_at (list): per feed item, epoch seconds or None
+
+    Returns a VoteArrays with one row per vote across the whole feed
+    """
+    counts = [len(i["attention"]) if i else 0 for i in items_votes]
+    arrays = {}
+    for column in VOTE_COLUMNS:
+        # snapshots stored before a column existed don't have it, its values are unknown
+        values = [
+            v for i in items_votes if i for v in i.get(column) or [None] * len(i["attention"])
+        ]
+        arrays[column] = np.array(
+            [np.nan if v is None else v for v in values], dtype=np.float64
+        )
+    return VoteArrays(
+        n_items=len(items_votes),
+        item=np.repeat(np.arange(len(items_votes), dtype=np.int64), counts),
+        shared_at=np.array(
+            [np.nan if i is None else i for i in shared_at], dtype=np.float64
+        ),
+        **arrays,
+    )
+
+
+def per_item_sum(votes, weights=None):
+    return np.bincount(votes.item, weights=weights, minlength=votes.n_items).astype(
+        np.float64
+    )
+
+
+def vote_age_hours(votes, now):
+    """
+    Hours since each vote was posted, votes without a timestamp use their item's shared_at
+    """
+    created_at = np.where(
+        np.isnan(votes.created_at), votes.shared_at[votes.item], votes.created_at
+    )
+    return np.clip((now - created_at) / 3600, 0, None)
+
+
+@register_ranker("shares")
+def shares(votes, now):
+    """
+    One point per vote, the original ranking
+    """
+    return per_item_sum(votes)
+
+
+@register_ranker("attention")
+def attention(votes, now):
+    """
+    Votes weighted by the voter's attention score
+    """
+    return per_item_sum(votes, votes.attention)
+
+
+@register_ranker("engagement")
+def engagement(votes, now):
+    """
+    Votes weighted by how much engagement the vote tweet itself got (log scaled so one viral tweet doesn't win alone)
+    """
+    interactions = votes.likes + 2 * votes.retweets + votes.replies + votes.quotes
+    return per_item_sum(votes, 1 + np.log1p(interactions))
+
+
+@register_ranker("decay")
+def decay(votes, now):
+    """
+    Attention weighted votes, each halving in value every DECAY_HALF_LIFE_HOURS
+    """
+    age = np.nan_to_num(vote_age_hours(votes, now), nan=0.0)
+    return per_item_sum(votes, votes.attention * 0.5 ** (age / DECAY_HALF_LIFE_HOURS))
+
+
+@register_ranker("velocity")
+def velocity(votes, now):
+    """
+    Attention weighted votes per hour over the last VELOCITY_WINDOW_HOURS, what's picking up right now
+    """
+    age = vote_age_hours(votes, now)
+    recent = np.nan_to_num(age, nan=np.inf) < VELOCITY_WINDOW_HOURS
+    return per_item_sum(votes, votes.attention * recent) / VELOCITY_WINDOW_HOURS
+
+
+@register_ranker("hot")
+def hot(votes, now):
+    """
+    Attention weighted votes over (item age + 2) ** GRAVITY, as on hacker news
+    """
+    age = np.nan_to_num(np.clip((now - votes.shared_at) / 3600, 0, None), nan=0.0)
+    return per_item_sum(votes, votes.attention) / (age + 2) ** GRAVITY
+
+
+@register_ranker("rising")
+def rising(votes, now):
+    """
+    Attention weighted votes, plus how much attention the voter gained over the last week: voices on the way up
+    count more than established ones on the way down
+    """
+    change = np.nan_to_num(votes.attention_change, nan=0.0)
+    return per_item_sum(votes, np.clip(votes.attention + change, 0, None))
+
+
+def rank(votes, algorithm=DEFAULT_RANKER, now=None):
+    """
+    Returns the item indexes ordered best first by the named algorithm.
+    Ties keep feed order, so they fall back to the share count ranking
+    """
+    if algorithm not in RANKERS:
+        raise KeyError(f"unknown ranking algorithm '{algorithm}', one of {sorted(RANKERS)}")
+    scores = RANKERS[algorithm](votes, now or time.time())
+    return np.argsort(-scores, kind="stable")
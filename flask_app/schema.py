@@ -0,0 +1,235 @@
+"""
+Normalized on-disk layout for the json stores, every tweet is written once.
+
+In memory a cluster section holds the same tweet in up to four places: an influencer's "tweets" (a user's
+"tweets" in a TweetDB), "all_feed_tweets", the "vote_tweets" of the quote tweet bank and the "tweets" of the
+external url feed entries, with quoted tweets held twice more as the bank's "ref_tweet_data" and the feed's
+"ref_tweet". Dumped as is every copy is serialized, and once loaded back the copies are separate dicts that
+drift apart (ie. label_authors only ever touched the bank's copies).
+
+On disk tweets live once in a table keyed by id, and every one of those places holds ids instead:
+
+    JsonStore file:          {"schema": 2, "tweets": {id: tweet}, "clusters": {cluster_name: section}}
+    SplitJsonStore cluster:  {"schema": 2, "tweets": {id: tweet}, "section": section}
+
+    influencer / TweetDB user     "tweets"          -> "tweet_ids"
+    section                       "all_feed_tweets" -> "all_feed_tweet_ids"
+    quote tweet bank entry        "vote_tweets"     -> "vote_tweet_ids", "ref_tweet_data" -> "ref_tweet_data_id"
+    external url feed entry       "tweets"          -> "vote_tweet_ids" + "vote_view", "ref_tweet" -> "ref_tweet_id"
+
+Feed entries hold a view of each vote tweet (aggregate.vote_view for FeedDB, the tweet itself for TweetDB),
+which is rebuilt from the table on read. An entry whose tweets can't be rebuilt exactly (feeds from before
+the views existed) is kept inline, as is anything else this module doesn't know about.
+
+Reading resolves the ids through the table, so every place holding a tweet holds the same dict.
+Files written before this layout have no "schema" key and are read as they are.
+"""
+from collections.abc import Sequence
+
+from .aggregate import vote_view
+
+SCHEMA_VERSION = 2
+
+# name stored in a feed entry's "vote_view" -> tweet -> what build_url_feed put in the entry
+VOTE_VIEWS = {
+    "tweet": lambda tweet: tweet,
+    "vote": vote_view,
+}
+
+
+def is_normalized(data):
+    return isinstance(data, dict) and data.get("schema") == SCHEMA_VERSION and "tweets" in data
+
+
+def is_tweet(value):
+    return isinstance(value, dict) and "id" in value
+
+
+def is_tweet_list(value):
+    """
+    A list of tweets, or a compacted tweet_store.TweetList
+    """
+    return isinstance(value, Sequence) and not isinstance(value, str)
+
+
+class TweetTable:
+    """
+    {id: tweet}, with each tweet kept once. A tweet added again under the same id as a different dict is
+    merged: the first copy's values win, keys only the later copy has are kept
+    """
+
+    def __init__(self, tweets=None):
+        self.tweets = tweets if tweets is not None else {}
+
+    def add(self, tweet):
+        tweet_id = tweet["id"]
+        held = self.tweets.get(tweet_id)
+        if held is None:
+            self.tweets[tweet_id] = tweet
+        elif held is not tweet and any(k not in held for k in tweet):
+            self.tweets[tweet_id] = {**tweet, **held}
+        return tweet_id
+
+    def add_all(self, tweets):
+        return [self.add(i) for i in tweets]
+
+    def get(self, tweet_id):
+        return self.tweets.get(tweet_id)
+
+    def resolve(self, tweet_ids):
+        return [self.tweets[i] for i in tweet_ids if i in self.tweets]
+
+
+def _replace(d, key, ref_key, value):
+    """
+    d with key swapped for ref_key (holding value), in the same position
+    """
+    return {ref_key if k == key else k: value if k == key else v for k, v in d.items()}
+
+
+def normalize_section(section, table):
+    """
+    section (dict): a FeedDB or TweetDB cluster section
+    table (TweetTable): every tweet of the section is added to it
+
+    Returns a new section holding tweet ids, the section itself is not changed
+    """
+    normalized = {}
+    # raw tweets first, so the feed views below are checked against the final table
+    for key, value in section.items():
+        if key == "influencers":
+            normalized[key] = [_normalize_timeline(i, table) for i in value]
+        elif key == "all_feed_tweets":
+            normalized["all_feed_tweet_ids"] = table.add_all(value)
+        elif key == "external_url_quote_tweet_bank":
+            normalized[key] = {k: _normalize_bank_entry(v, table) for k, v in value.items()}
+        elif key == "external_url_feed":
+            normalized[key] = value  # done below
+        elif isinstance(value, dict) and is_tweet_list(value.get("tweets")):
+            normalized[key] = _normalize_timeline(value, table)
+        else:
+            normalized[key] = value
+    if "external_url_feed" in section:
+        normalized["external_url_feed"] = [
+            _normalize_feed_entry(i, table) for i in section["external_url_feed"]
+        ]
+    return normalized
+
+
+def denormalize_section(section, table):
+    """
+    The in memory section for a section written by normalize_section, tweets resolved through table
+    (a TweetTable, or a tweet_store.ClusterTweets to get compact TweetLists instead of lists of dicts)
+    """
+    denormalized = {}
+    for key, value in section.items():
+        if key == "influencers":
+            denormalized[key] = [_denormalize_timeline(i, table) for i in value]
+        elif key == "all_feed_tweet_ids":
+            denormalized["all_feed_tweets"] = table.resolve(value)
+        elif key == "external_url_quote_tweet_bank":
+            denormalized[key] = {k: _denormalize_bank_entry(v, table) for k, v in value.items()}
+        elif key == "external_url_feed":
+            denormalized[key] = [_denormalize_feed_entry(i, table) for i in value]
+        elif isinstance(value, dict) and "tweet_ids" in value:
+            denormalized[key] = _denormalize_timeline(value, table)
+        else:
+            denormalized[key] = value
+    return denormalized
+
+
+def _normalize_timeline(user, table):
+    if not is_tweet_list(user.get("tweets")):
+        return user
+    return _replace(user, "tweets", "tweet_ids", table.add_all(user["tweets"]))
+
+
+def _denormalize_timeline(user, table):
+    if "tweet_ids" not in user:
+        return user
+    return _replace(user, "tweet_ids", "tweets", table.resolve(user["tweet_ids"]))
+
+
+def _normalize_bank_entry(entry, table):
+    entry = _replace(entry, "vote_tweets", "vote_tweet_ids", table.add_all(entry["vote_tweets"]))
+    if is_tweet(entry.get("ref_tweet_data")):
+        entry = _replace(entry, "ref_tweet_data", "ref_tweet_data_id", table.add(entry["ref_tweet_data"]))
+    return entry
+
+
+def _denormalize_bank_entry(entry, table):
+    entry = _replace(entry, "vote_tweet_ids", "vote_tweets", table.resolve(entry["vote_tweet_ids"]))
+    if "ref_tweet_data_id" in entry:
+        entry = _replace(entry, "ref_tweet_data_id", "ref_tweet_data", table.get(entry["ref_tweet_data_id"]))
+    return entry
+
+
+def _normalize_feed_entry(entry, table):
+    tweets = entry.get("tweets")
+    if is_tweet_list(tweets) and all(is_tweet(i) for i in tweets):
+        view_name = _matching_view(tweets, table)
+        if view_name:
+            entry = _replace(entry, "tweets", "vote_tweet_ids", [i["id"] for i in tweets])
+            entry["vote_view"] = view_name
+    ref_tweet = entry.get("ref_tweet")
+    if is_tweet(ref_tweet) and table.get(ref_tweet["id"]) == ref_tweet:
+        entry = _replace(entry, "ref_tweet", "ref_tweet_id", ref_tweet["id"])
+    return entry
+
+
+def _denormalize_feed_entry(entry, table):
+    if "vote_tweet_ids" in entry:
+        view = VOTE_VIEWS[entry["vote_view"]]
+        tweets = [view(i) for i in table.resolve(entry["vote_tweet_ids"])]
+        entry = _replace(entry, "vote_tweet_ids", "tweets", tweets)
+        del entry["vote_view"]
+    if "ref_tweet_id" in entry:
+        entry = _replace(entry, "ref_tweet_id", "ref_tweet", table.get(entry["ref_tweet_id"]))
+    return entry
+
+
+def _matching_view(tweets, table):
+    """
+    The name of the view every tweet of a feed entry can be rebuilt with from the table, None if there isn't one
+    """
+    for name, view in VOTE_VIEWS.items():
+        try:
+            if all(view(table.get(i["id"]) or {}) == i for i in tweets):
+                return name
+        except KeyError:
+            continue
+    return None
+
+
+def normalize(clusters):
+    """
+    {cluster_name: section} -> the JsonStore file layout
+    """
+    table = TweetTable()
+    normalized = {k: normalize_section(v, table) for k, v in clusters.items()}
+    return {"schema": SCHEMA_VERSION, "tweets": table.tweets, "clusters": normalized}
+
+
+def denormalize(data):
+    """
+    A JsonStore file -> {cluster_name: section}, files from before this layout are returned as they are
+    """
+    if not is_normalized(data):
+        return data
+    table = TweetTable(data["tweets"])
+    return {k: denormalize_section(v, table) for k, v in data["clusters"].items()}
+
+
+def normalize_cluster(section):
+    """
+    One section -> the SplitJsonStore cluster file layout
+    """
+    table = TweetTable()
+    normalized = normalize_section(section, table)
+    return {"schema": SCHEMA_VERSION, "tweets": table.tweets, "section": normalized}
+
+
+def denormalize_cluster(data):
+    if not is_normalized(data):
+        return data
+    return denormalize_section(data["section"], TweetTable(data["tweets"]))
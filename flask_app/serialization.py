@@ -0,0 +1,361 @@
+"""
+Snapshot codecs for the db files: stdlib json, orjson or msgpack, each optionally gzip or zstd compressed.
+
+The file extension picks what is written:
+
+    db.json         json (with orjson when it is installed, it is several times faster than the stdlib)
+    db.jsonl        json, one entry per line (see below)
+    db.msgpack      msgpack entries (.mpk works too)
+    + .gz / .zst    compressed, ie. db.msgpack.zst
+
+and reading detects the codec and compression from the file's first bytes, whatever its name.
+
+Every snapshot is written to a temp file next to the target, fsync'd and renamed over it, so a crash mid-save
+leaves the previous snapshot in place instead of a truncated one.
+
+Layouts: a .json file is one json document, as the db files have always been. .jsonl and .msgpack files are
+a stream of entries instead, a header then one entry per top level key, or per item of a top level dict:
+
+    {"__snapshot__": "entries", "version": 1}
+    ["schema", 2]
+    ["tweets", "1498622966694883333", {...}]
+    ["clusters", "Ethereum", {...}]
+
+which is read back one entry at a time, so a big snapshot is never held as one string of bytes next to the
+objects parsed from it. Use them for the big dbs, the stdlib has no incremental parser for a json document.
+
+usage:
+    write_snapshot("db/tweet_db.msgpack.zst", data)
+    data = read_snapshot("db/tweet_db.msgpack.zst")
+"""
+import io
+import os
+import gzip
+import json
+import time
+import tempfile
+from pathlib import Path
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib json is used instead
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional, only needed for .msgpack snapshots
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed for .zst snapshots
+    zstandard = None
+
+ENTRIES_HEADER = {"__snapshot__": "entries", "version": 1}
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+GZIP_LEVEL = 5
+ZSTD_LEVEL = 3
+
+READ_CHUNK = 1 << 20
+
+
+class JsonCodec:
+    """
+    Stdlib json, always available
+    """
+
+    name = "json"
+    available = True
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def write_entries(self, f, entries):
+        for entry in entries:
+            f.write(self.dumps(entry) + b"\n")
+
+    def iter_entries(self, f):
+        for line in f:
+            if line.strip():
+                yield self.loads(line)
+
+
+class OrjsonCodec(JsonCodec):
+    """
+    orjson, the same json but several times faster. Falls back to the stdlib for anything orjson refuses
+    (ints over 64 bits, non string keys)
+    """
+
+    name = "orjson"
+    available = orjson is not None
+
+    def dumps(self, obj):
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            return super().dumps(obj)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+class MsgpackCodec:
+    name = "msgpack"
+    available = msgpack is not None
+
+    def dumps(self, obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, data):
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+    def write_entries(self, f, entries):
+        packer = msgpack.Packer(use_bin_type=True)
+        for entry in entries:
+            f.write(packer.pack(entry))
+
+    def iter_entries(self, f):
+        return msgpack.Unpacker(f, raw=False, strict_map_key=False, max_buffer_size=0)
+
+
+CODECS = {i.name: i for i in [JsonCodec(), OrjsonCodec(), MsgpackCodec()]}
+
+COMPRESSIONS = [None, "gzip", "zstd"]
+
+# extension -> codec name (None: the fastest json codec installed)
+CODEC_EXTENSIONS = {".json": None, ".jsonl": None, ".msgpack": "msgpack", ".mpk": "msgpack"}
+COMPRESSION_EXTENSIONS = {".gz": "gzip", ".zst": "zstd"}
+ENTRIES_EXTENSIONS = {".jsonl", ".msgpack", ".mpk"}
+
+
+def get_codec(name=None):
+    """
+    name (str): json, orjson or msgpack. None is orjson when it's installed, else json
+    """
+    if name is None:
+        name = "orjson" if CODECS["orjson"].available else "json"
+    codec = CODECS[name]
+    if not codec.available:
+        raise Exception(f"the {name} codec needs `pip install {name}`")
+    return codec
+
+
+def snapshot_format(fpath):
+    """
+    (codec name, compression, entries layout) an fpath is written with, from its extensions
+    """
+    suffixes = Path(fpath).suffixes
+    compression = COMPRESSION_EXTENSIONS.get(suffixes[-1]) if suffixes else None
+    if compression:
+        suffixes = suffixes[:-1]
+    ext = suffixes[-1] if suffixes else ".json"
+    return CODEC_EXTENSIONS.get(ext), compression, ext in ENTRIES_EXTENSIONS
+
+
+def compress(data, compression):
+    if compression is None:
+        return data
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    if compression == "zstd":
+        if zstandard is None:
+            raise Exception("zstd snapshots need `pip install zstandard`")
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    raise ValueError(f"unknown compression {compression!r}")
+
+
+def _compressed_writer(f, compression):
+    """
+    A file object compressing into f as it is written to, close it before closing f
+    """
+    if compression is None:
+        return _Unclosed(f)
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=f, mode="wb", compresslevel=GZIP_LEVEL, mtime=0)
+    if compression == "zstd":
+        if zstandard is None:
+            raise Exception("zstd snapshots need `pip install zstandard`")
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(f, closefd=False)
+    raise ValueError(f"unknown compression {compression!r}")
+
+
+class _Unclosed(io.BufferedIOBase):
+    """
+    Writes through to f, closing it leaves f open (as the compressed writers do)
+    """
+
+    def __init__(self, f):
+        self.f = f
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.f.write(data)
+
+
+def iter_entries(obj):
+    """
+    The entries layout of obj (a dict): the header, then each top level key, dicts item by item
+    """
+    yield ENTRIES_HEADER
+    for key, value in obj.items():
+        if isinstance(value, dict):
+            for sub_key, sub_value in value.items():
+                yield [key, sub_key, sub_value]
+            if not value:
+                yield [key, {}]
+        else:
+            yield [key, value]
+
+
+def from_entries(entries):
+    obj = {}
+    for entry in entries:
+        if len(entry) == 3:
+            obj.setdefault(entry[0], {})[entry[1]] = entry[2]
+        else:
+            obj[entry[0]] = entry[1]
+    return obj
+
+
+def write_snapshot(fpath, obj, codec=None, compression=None, entries=None):
+    """
+    Atomically replace fpath with obj.
+
+    codec (str): json, orjson or msgpack, defaults to what the extension says (see snapshot_format)
+    compression (str): None, gzip or zstd, defaults to what the extension says
+    entries (bool): write the entries layout, defaults to what the extension says (always for msgpack)
+
+    Returns the number of bytes written
+    """
+    ext_codec, ext_compression, ext_entries = snapshot_format(fpath)
+    codec = get_codec(codec or ext_codec)
+    compression = compression if compression is not None else ext_compression
+    if entries is None:
+        entries = ext_entries or codec.name == "msgpack"
+
+    fpath = Path(fpath)
+    os.makedirs(fpath.parent, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=fpath.parent, prefix=f".{fpath.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if entries:
+                with _compressed_writer(f, compression) as writer:
+                    codec.write_entries(writer, iter_entries(obj))
+            else:
+                f.write(compress(codec.dumps(obj), compression))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, fpath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return os.path.getsize(fpath)
+
+
+def open_snapshot(fpath):
+    """
+    fpath opened for reading with its compression undone, as a buffered binary file.
+    Returns (file, compression)
+    """
+    raw = open(fpath, "rb")
+    magic = raw.read(4)
+    raw.seek(0)
+    if magic.startswith(GZIP_MAGIC):
+        return io.BufferedReader(gzip.GzipFile(fileobj=raw, mode="rb"), READ_CHUNK), "gzip"
+    if magic.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raw.close()
+            raise Exception(f"{fpath} is zstd compressed, reading it needs `pip install zstandard`")
+        reader = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return io.BufferedReader(reader, READ_CHUNK), "zstd"
+    return io.BufferedReader(raw, READ_CHUNK), None
+
+
+def detect_format(fpath):
+    """
+    (codec name, compression) of a snapshot, from its first bytes
+    """
+    f, compression = open_snapshot(fpath)
+    with f:
+        first = f.peek(1)[:1]
+    is_json = not first or first in b"{[ \t\r\n"
+    return (get_codec().name if is_json else "msgpack"), compression
+
+
+def read_snapshot(fpath, json_codec=None):
+    """
+    The object in a snapshot written by write_snapshot (or a plain json file), codec and compression detected.
+    The entries layout is parsed one entry at a time
+
+    json_codec (str): json or orjson, which one parses a json snapshot. Defaults to orjson when it's installed
+    """
+    codec_name, _ = detect_format(fpath)
+    codec = get_codec(json_codec if codec_name != "msgpack" and json_codec else codec_name)
+    f, _ = open_snapshot(fpath)
+    with f:
+        if codec.name == "msgpack":
+            entries = iter(codec.iter_entries(f))
+            first = next(entries)
+            return from_entries(entries) if first == ENTRIES_HEADER else first
+
+        first_line = f.readline()
+        try:
+            first = codec.loads(first_line)
+        except ValueError:
+            first = None  # the first line of a pretty printed document
+        if first == ENTRIES_HEADER:
+            return from_entries(codec.iter_entries(f))
+        rest = f.read()
+        if first is not None and not rest.strip():
+            return first
+        return codec.loads(first_line + rest)
+
+
+def benchmark_codecs(obj, dirpath, combinations=None, repeat=3):
+    """
+    Time write_snapshot / read_snapshot of obj for every available codec and compression.
+
+    combinations (list): (codec, compression, entries) to try, defaults to all of them
+    Returns a list of {"codec", "compression", "entries", "bytes", "save_seconds", "load_seconds"}, best of repeat
+    """
+    if combinations is None:
+        combinations = [
+            (codec, compression, entries)
+            for codec in CODECS
+            for compression in COMPRESSIONS
+            for entries in ([True] if codec == "msgpack" else [False, True])
+        ]
+    rows = []
+    for codec, compression, entries in combinations:
+        if not CODECS[codec].available or (compression == "zstd" and zstandard is None):
+            continue
+        fpath = Path(dirpath) / f"bench.{codec}.{compression or 'raw'}"
+        save, load = [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            n_bytes = write_snapshot(fpath, obj, codec=codec, compression=compression, entries=entries)
+            save.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            read_snapshot(fpath, json_codec=codec if codec != "msgpack" else None)
+            load.append(time.perf_counter() - start)
+        os.remove(fpath)
+        rows.append(
+            {
+                "codec": codec,
+                "compression": compression,
+                "entries": entries,
+                "bytes": n_bytes,
+                "save_seconds": round(min(save), 4),
+                "load_seconds": round(min(load), 4),
+            }
+        )
+    return rows
@@ -0,0 +1,416 @@
+"""
+Offline stand-in for the Twitter v2 and Borg apis, for deterministic tests, load runs and benchmarks.
+
+Serves every endpoint we use from fixtures seeded from FeedDB files (db/test_db.json by default):
+
+    Borg:    /influence/clusters/, /influence/clusters/<name>/influencers/?page=&sort_by=&sort_direction=
+    Twitter: /2/users/by, /2/users, /2/users/by/username/<username>, /2/users/<id>/tweets, /2/tweets
+
+Every response can be delayed (latency + up to jitter seconds), each bearer token gets its own per endpoint
+budget per rate limit window (answered with the x-rate-limit-* headers and 429s twitter sends), and a share of
+requests can be failed with a 429 at random, so ingestion concurrency can be measured and tuned without
+spending real quota. Point the code at it with the base url overrides:
+
+    python manage.py standin --port 8765 --latency 0.05
+    TWITTER_BASE_URL=http://127.0.0.1:8765 BORG_BASE_URL=http://127.0.0.1:8765 python manage.py pull_test_db
+
+Fixture tweets are shifted in time so the newest one was posted a minute before the server started,
+so the usual "last 24 hours" pulls find them.
+
+usage:
+    with StandInServer(Fixtures.from_db_files(["db/test_db.json"]), latency=0.05) as server:
+        os.environ.update(server.env())
+        ...
+"""
+import re
+import json
+import time
+import random
+import threading
+import collections
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from .credentials import ENDPOINT_LIMITS, RATE_LIMIT_WINDOW
+from .ingest import quoted_tweet_id
+from .storage import open_store
+from .time_index import as_epoch, iso_time
+
+DEFAULT_FIXTURES = ["db/test_db.json"]
+
+BORG_PAGE_SIZE = 50
+
+# (endpoint, path pattern), endpoint is the ENDPOINT_LIMITS key the request is counted against
+ROUTES = [
+    ("/influence/clusters", re.compile(r"^/influence/clusters/?$")),
+    ("/influence/clusters/:name/influencers", re.compile(r"^/influence/clusters/(?P<name>[^/]+)/influencers/?$")),
+    ("/2/users/by/username/:username", re.compile(r"^/2/users/by/username/(?P<username>[^/]+)$")),
+    ("/2/users/by", re.compile(r"^/2/users/by$")),
+    ("/2/users/:id/tweets", re.compile(r"^/2/users/(?P<id>\d+)/tweets$")),
+    ("/2/users", re.compile(r"^/2/users$")),
+    ("/2/tweets", re.compile(r"^/2/tweets$")),
+]
+
+
+class Fixtures:
+    """
+    What the stand-in serves, indexed for its endpoints.
+
+    clusters (dict): {cluster name: {"cluster": borg cluster, "influencers": [borg influencer, ...]}}
+    users (dict): {user id: {"id", "username", "name"}}
+    tweets (dict): {tweet id: tweet}, the influencers' tweets and the quoted tweets we know urls for
+    timelines (dict): {user id: [tweet id, ...] newest first}
+    """
+
+    def __init__(self, clusters, users, tweets, timelines):
+        self.clusters = clusters
+        self.users = users
+        self.tweets = tweets
+        self.timelines = timelines
+        self.usernames = {v["username"].lower(): k for k, v in users.items()}
+
+    @classmethod
+    def from_db_files(cls, fpaths=DEFAULT_FIXTURES):
+        """
+        Seed from FeedDB files (see Feed.dict). Quoted tweets only the quote tweet bank knows about are
+        rebuilt from their external urls, any other quoted tweet is "not found" as a deleted tweet would be
+        """
+        clusters, users, tweets, timelines = {}, {}, {}, {}
+        quoted_urls = {}
+        for fpath in fpaths:
+            store = open_store(fpath, read_only=True)
+            for cluster_name in store:
+                section = store[cluster_name]
+                if "influencers" not in section:
+                    continue  # a TweetDB cluster, it has no Borg data to serve
+                influencers = []
+                for i in section["influencers"]:
+                    account = i["social_account"]["social_account"]
+                    users[account["id"]] = {
+                        "id": account["id"],
+                        "username": account["screen_name"],
+                        "name": account.get("name", account["screen_name"]),
+                    }
+                    for i_tweet in i.get("tweets") or []:
+                        tweets[i_tweet["id"]] = i_tweet
+                    influencers.append(
+                        {k: v for k, v in i.items() if k not in ("tweets", "last_tweet_pull")}
+                    )
+                for i_tweet in section.get("all_feed_tweets") or []:
+                    tweets.setdefault(i_tweet["id"], i_tweet)
+                for ref_tweet_id, entry in (section.get("external_url_quote_tweet_bank") or {}).items():
+                    if entry.get("ref_tweet_data"):
+                        tweets.setdefault(ref_tweet_id, entry["ref_tweet_data"])
+                    quoted_urls[ref_tweet_id] = entry["external_urls"]
+                clusters[cluster_name] = {
+                    "cluster": cluster_info(cluster_name, influencers),
+                    "influencers": influencers,
+                }
+
+        quotes = {}
+        for i_tweet in tweets.values():
+            quotes.setdefault(quoted_tweet_id(i_tweet), []).append(i_tweet)
+        for ref_tweet_id, urls in quoted_urls.items():
+            if ref_tweet_id not in tweets:
+                tweets[ref_tweet_id] = quoted_tweet(ref_tweet_id, urls, quotes.get(ref_tweet_id, []))
+
+        for i_tweet in tweets.values():
+            if i_tweet.get("author_id") in users:
+                timelines.setdefault(i_tweet["author_id"], []).append(i_tweet["id"])
+        for ids in timelines.values():
+            ids.sort(key=int, reverse=True)
+        return cls(clusters, users, tweets, timelines)
+
+
+def cluster_info(cluster_name, influencers):
+    """
+    The cluster as /influence/clusters lists it, taken from an influencer's identity when there is one
+    """
+    for i in influencers:
+        for i_cluster in i.get("identity", {}).get("clusters", []):
+            if i_cluster["name"] == cluster_name:
+                return i_cluster
+    cluster_id = influencers[0].get("cluster_id") if influencers else None
+    return {"active": True, "id": cluster_id or cluster_name, "name": cluster_name}
+
+
+def quoted_tweet(ref_tweet_id, urls, quotes):
+    """
+    A stand-in for a quoted tweet we only know the external urls of, posted just before its first quote
+
+    quotes (list): the fixture tweets quoting it
+    """
+    created_at = min((i["created_at"] for i in quotes), default="2022-03-01T00:00:00.000Z")
+    return {
+        "id": ref_tweet_id,
+        "text": " ".join(urls),
+        "created_at": created_at,
+        "author_id": "0",
+        "public_metrics": {"retweet_count": 0, "reply_count": 0, "like_count": 0, "quote_count": len(quotes)},
+        "entities": {"urls": [{"url": i, "expanded_url": i} for i in urls]},
+    }
+
+
+class StandInServer:
+    """
+    fixtures (Fixtures): what to serve
+    port (int): 0 picks a free port, see base_url
+    latency (float): seconds every response is delayed by
+    jitter (float): up to this many seconds more, drawn at random per request
+    limits (dict): requests per window per bearer token, by ENDPOINT_LIMITS key. Borg endpoints are not limited
+    window (float): rate limit window in seconds
+    error_rate (float): share of requests answered with a 429 regardless of the budget left
+    seed (int): seeds jitter and error injection, so runs are repeatable
+    """
+
+    def __init__(
+        self,
+        fixtures=None,
+        host="127.0.0.1",
+        port=0,
+        latency=0.0,
+        jitter=0.0,
+        limits=ENDPOINT_LIMITS,
+        window=RATE_LIMIT_WINDOW,
+        error_rate=0.0,
+        seed=0,
+        verbose=False,
+    ):
+        self.fixtures = fixtures or Fixtures.from_db_files()
+        self.latency = latency
+        self.jitter = jitter
+        self.limits = limits
+        self.window = window
+        self.error_rate = error_rate
+        self.verbose = verbose
+        self.stats = collections.Counter()
+        self._random = random.Random(seed)
+        self._windows = {}  # (token, endpoint) -> [window start, requests made]
+        self._lock = threading.Lock()
+        self._thread = None
+
+        epochs = [as_epoch(i["created_at"]) for i in self.fixtures.tweets.values()]
+        self.time_shift = time.time() - 60 - max(epochs) if epochs else 0.0
+
+        handler = type("Handler", (StandInHandler,), {"standin": self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self):
+        """
+        The base url overrides that send our Twitter and Borg requests here
+        """
+        return {"TWITTER_BASE_URL": self.base_url, "BORG_BASE_URL": self.base_url}
+
+    def start(self):
+        """
+        Serve from a background thread
+        """
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def delay(self):
+        with self._lock:
+            extra = self._random.uniform(0, self.jitter) if self.jitter else 0.0
+        if self.latency or extra:
+            time.sleep(self.latency + extra)
+
+    def spend(self, token, endpoint):
+        """
+        Count a request against token's budget on endpoint.
+
+        Returns (status, headers): 200 with the x-rate-limit-* headers, or a 429 when the budget is spent
+        or the request was picked for error injection
+        """
+        now = time.time()
+        with self._lock:
+            self.stats[endpoint] += 1
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.stats["injected_429"] += 1
+                return 429, {"x-rate-limit-reset": str(int(now))}
+            limit = self.limits.get(endpoint)
+            if limit is None:
+                return 200, {}
+            window = self._windows.setdefault((token, endpoint), [now, 0])
+            if now >= window[0] + self.window:
+                window[:] = [now, 0]
+            reset = str(int(window[0] + self.window))
+            if window[1] >= limit:
+                self.stats["rate_limited_429"] += 1
+                return 429, {
+                    "x-rate-limit-limit": str(limit),
+                    "x-rate-limit-remaining": "0",
+                    "x-rate-limit-reset": reset,
+                }
+            window[1] += 1
+            return 200, {
+                "x-rate-limit-limit": str(limit),
+                "x-rate-limit-remaining": str(limit - window[1]),
+                "x-rate-limit-reset": reset,
+            }
+
+    def shifted(self, tweet):
+        return {**tweet, "created_at": iso_time(as_epoch(tweet["created_at"]) + self.time_shift)}
+
+    ### endpoints, each takes the path params and the query ({name: value}) and returns the json body
+
+    def clusters(self, query):
+        return {"clusters": [v["cluster"] for v in self.fixtures.clusters.values()]}
+
+    def cluster_influencers(self, query, name):
+        if name not in self.fixtures.clusters:
+            return {"influencers": []}
+        influencers = self.fixtures.clusters[name]["influencers"]
+        sort_by = query.get("sort_by")
+        if sort_by and all(sort_by in i for i in influencers):
+            influencers = sorted(
+                influencers,
+                key=lambda i: float(i[sort_by]),
+                reverse=query.get("sort_direction", "desc") == "desc",
+            )
+        page = int(query.get("page", 0))
+        return {"influencers": influencers[page * BORG_PAGE_SIZE : (page + 1) * BORG_PAGE_SIZE]}
+
+    def user_by_username(self, query, username):
+        user_id = self.fixtures.usernames.get(username.lower())
+        if user_id is None:
+            return {"errors": [not_found("username", username)]}
+        return {"data": self.fixtures.users[user_id]}
+
+    def users_by_usernames(self, query):
+        return self._lookup(
+            query["usernames"].split(","),
+            lambda u: self.fixtures.users.get(self.fixtures.usernames.get(u.lower())),
+            "username",
+        )
+
+    def users_by_ids(self, query):
+        return self._lookup(query["ids"].split(","), self.fixtures.users.get, "id")
+
+    def tweets_by_ids(self, query):
+        return self._lookup(
+            query["ids"].split(","),
+            lambda i: self.shifted(self.fixtures.tweets[i]) if i in self.fixtures.tweets else None,
+            "id",
+        )
+
+    def user_tweets(self, query, id):
+        """
+        Newest first, max_results (5-100, default 10) per page, paged with meta.next_token
+        """
+        start_epoch = as_epoch(query.get("start_time"))
+        since_id = int(query.get("since_id") or 0)
+        tweets = []
+        for tweet_id in self.fixtures.timelines.get(id, []):
+            if int(tweet_id) <= since_id:
+                break
+            i_tweet = self.shifted(self.fixtures.tweets[tweet_id])
+            if start_epoch is not None and as_epoch(i_tweet["created_at"]) < start_epoch:
+                break
+            tweets.append(i_tweet)
+        max_results = min(100, max(5, int(query.get("max_results", 10))))
+        offset = int(query.get("pagination_token") or 0)
+        page = tweets[offset : offset + max_results]
+        meta = {"result_count": len(page)}
+        if page:
+            meta.update(newest_id=page[0]["id"], oldest_id=page[-1]["id"])
+        if offset + max_results < len(tweets):
+            meta["next_token"] = str(offset + max_results)
+        return {"data": page, "meta": meta} if page else {"meta": meta}
+
+    def _lookup(self, keys, get, parameter):
+        data, errors = [], []
+        for key in keys:
+            value = get(key)
+            if value is None:
+                errors.append(not_found(parameter, key))
+            else:
+                data.append(value)
+        res = {"data": data} if data else {}
+        if errors:
+            res["errors"] = errors
+        return res
+
+
+ENDPOINTS = {
+    "/influence/clusters": StandInServer.clusters,
+    "/influence/clusters/:name/influencers": StandInServer.cluster_influencers,
+    "/2/users/by/username/:username": StandInServer.user_by_username,
+    "/2/users/by": StandInServer.users_by_usernames,
+    "/2/users/:id/tweets": StandInServer.user_tweets,
+    "/2/users": StandInServer.users_by_ids,
+    "/2/tweets": StandInServer.tweets_by_ids,
+}
+
+
+def not_found(parameter, value):
+    return {
+        "value": value,
+        "detail": f"Could not find {parameter}: [{value}].",
+        "title": "Not Found Error",
+        "parameter": parameter,
+        "type": "https://api.twitter.com/2/problems/resource-not-found",
+    }
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    standin = None  # set on the subclass StandInServer makes
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        for endpoint, pattern in ROUTES:
+            match = pattern.match(url.path)
+            if match:
+                break
+        else:
+            return self.send_json(404, {"title": "Not Found", "detail": url.path})
+
+        authorization = self.headers.get("Authorization")
+        if not authorization:
+            return self.send_json(401, {"title": "Unauthorized", "status": 401})
+
+        self.standin.delay()
+        status, headers = self.standin.spend(authorization, endpoint)
+        if status == 429:
+            return self.send_json(429, {"title": "Too Many Requests", "status": 429}, headers)
+        try:
+            body = ENDPOINTS[endpoint](self.standin, query, **match.groupdict())
+        except (KeyError, ValueError) as err:
+            return self.send_json(400, {"title": "Invalid Request", "detail": repr(err)}, headers)
+        self.send_json(200, body, headers)
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        if self.standin.verbose:
+            super().log_message(format, *args)
@@ -0,0 +1,813 @@
+"""
+Storage backends for FeedDB and TweetDB.
+
+Both DB classes keep using `self._db[cluster_name][...]` the way they always have. The backend decides
+how those cluster sections get to and from disk:
+
+    JsonStore: the original single json file, parsed on init and rewritten on save
+    SplitJsonStore: a directory with one json file per cluster, each parsed on first access and
+        evicted (least recently used first) under a memory cap
+    SQLiteStore: indexed sqlite tables, a cluster section is only read when it is first accessed,
+        and the accessors (`get_external_url_feed`, `get_user_tweets_since`...) query the tables directly
+        for clusters that haven't been loaded
+
+`open_store` picks the backend from the file extension. Opened with compact=True, a backend holds every
+section it loads in the compact form of tweet_store.py. The json backends write every tweet once and
+reference it by id (see schema.py), sqlite does the same with its `tweets` table.
+
+The json backends read and write through serialization.py, so a JsonStore path can just as well be
+db/tweet_db.msgpack.zst, and every file is replaced atomically.
+"""
+import os
+import re
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+from .schema import denormalize, denormalize_cluster, normalize, normalize_cluster
+from .serialization import read_snapshot, write_snapshot
+from .tweet_store import compact_section
+
+SQLITE_SUFFIXES = {".sqlite", ".sqlite3", ".db"}
+
+QUOTE_BANK_KEY = "external_url_quote_tweet_bank"
+URL_FEED_KEY = "external_url_feed"
+
+
+SPLIT_SUFFIX = ".d"
+
+
+def open_store(db_fpath, max_bytes=None, read_only=False, compact=False):
+    """
+    db_fpath (str): .sqlite/.sqlite3/.db -> SQLiteStore, a directory or .d path -> SplitJsonStore, anything else -> JsonStore
+    max_bytes, read_only: see SplitJsonStore, ignored by the other backends
+    compact (bool): hold loaded sections as tweet_store.compact_section leaves them, for reading
+    """
+    if Path(db_fpath).suffix in SQLITE_SUFFIXES:
+        return SQLiteStore(db_fpath, compact=compact)
+    if Path(db_fpath).suffix == SPLIT_SUFFIX or os.path.isdir(db_fpath):
+        return SplitJsonStore(db_fpath, max_bytes=max_bytes, read_only=read_only, compact=compact)
+    return JsonStore(db_fpath, compact=compact)
+
+
+def is_user_section(value):
+    """
+    TweetDB keeps users next to the feed keys in a cluster section, a user is any dict with a "tweets" list
+    """
+    return isinstance(value, dict) and "tweets" in value
+
+
+class ClusterStore(MutableMapping):
+    """
+    Mapping of cluster_name -> cluster section (a dict), plus the read accessors the DB classes use.
+    The accessors here read from the section, backends can override them with something cheaper
+    """
+
+    compact = False
+
+    def _loaded_section(self, section):
+        """
+        What a backend holds for a section it just read from disk
+        """
+        return compact_section(section) if self.compact else section
+
+    def get_cluster_tweets(self, cluster_name):
+        return (
+            self[cluster_name]["all_feed_tweets"],
+            self[cluster_name]["influencers"],
+        )
+
+    def get_quote_tweet_bank(self, cluster_name):
+        return self[cluster_name][QUOTE_BANK_KEY]
+
+    def get_external_url_feed(self, cluster_name):
+        return self[cluster_name][URL_FEED_KEY]
+
+    def get_user_tweets_since(self, cluster_name, start_time):
+        """
+        Every user tweet in the cluster created after start_time (an iso string), newest first
+        """
+        tweets = [
+            i_tweet
+            for i_user in self[cluster_name].values()
+            if is_user_section(i_user)
+            for i_tweet in i_user["tweets"]
+            if i_tweet["created_at"] > start_time
+        ]
+        return sorted(tweets, key=lambda t: t["created_at"], reverse=True)
+
+
+class JsonStore(ClusterStore):
+    """
+    The whole db in one snapshot file, in the normalized layout of schema.py (older files load as they are).
+    The codec and compression follow the file extension, see serialization.py
+    """
+
+    def __init__(self, fpath, compact=False):
+        self.fpath = fpath
+        self.compact = compact
+        if os.path.isfile(fpath):
+            self._clusters = {
+                k: self._loaded_section(v) for k, v in denormalize(read_snapshot(fpath)).items()
+            }
+        else:
+            self._clusters = {}
+
+    def __getitem__(self, cluster_name):
+        return self._clusters[cluster_name]
+
+    def __setitem__(self, cluster_name, section):
+        self._clusters[cluster_name] = section
+
+    def __delitem__(self, cluster_name):
+        del self._clusters[cluster_name]
+
+    def __iter__(self):
+        return iter(self._clusters)
+
+    def __len__(self):
+        return len(self._clusters)
+
+    def save(self, fpath=None):
+        write_snapshot(fpath or self.fpath, normalize(self._clusters))
+
+
+class SplitJsonStore(ClusterStore):
+    """
+    One json file per cluster (each normalized on its own, see schema.py) in a directory, plus an index.json listing them:
+
+        tweet_db.d/
+            index.json  {"clusters": {cluster_name: file_name}}
+            Ethereum.json
+            Python.json
+
+    A cluster is only parsed the first time it is accessed. Once the loaded clusters add up to more than
+    max_bytes (measured by their size on disk) the least recently used ones are evicted. A writable store
+    writes a cluster back before evicting it, since it may have been changed in place.
+
+    max_bytes (int): memory cap, None keeps every cluster that has been loaded
+    read_only (bool): never write, evicting is free (the web app)
+    """
+
+    INDEX_FNAME = "index.json"
+
+    def __init__(self, dirpath, max_bytes=None, read_only=False, compact=False):
+        self.fpath = dirpath
+        self.compact = compact
+        self.dirpath = Path(dirpath)
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        self._lock = threading.RLock()  # the web app reads from several threads
+        self._loaded = OrderedDict()  # cluster_name -> section, least recently used first
+        self._sizes = {}
+        index_fpath = self.dirpath / self.INDEX_FNAME
+        if index_fpath.is_file():
+            self._index = read_snapshot(index_fpath)["clusters"]
+        else:
+            self._index = {}
+
+    @staticmethod
+    def cluster_fname(cluster_name):
+        return re.sub(r"[^A-Za-z0-9_.-]", "_", cluster_name) + ".json"
+
+    def is_loaded(self, cluster_name):
+        return cluster_name in self._loaded
+
+    def loaded_bytes(self):
+        return sum(self._sizes.get(k, 0) for k in self._loaded)
+
+    def __getitem__(self, cluster_name):
+        with self._lock:
+            if cluster_name in self._loaded:
+                self._loaded.move_to_end(cluster_name)
+                return self._loaded[cluster_name]
+            if cluster_name not in self._index:
+                raise KeyError(cluster_name)
+            fpath = self.dirpath / self._index[cluster_name]
+            section = self._loaded_section(denormalize_cluster(read_snapshot(fpath)))
+            self._sizes[cluster_name] = os.path.getsize(fpath)
+            self._loaded[cluster_name] = section
+            self._evict()
+            return section
+
+    def __setitem__(self, cluster_name, section):
+        if self.read_only:
+            raise TypeError("this store was opened read only")
+        with self._lock:
+            self._index.setdefault(cluster_name, self.cluster_fname(cluster_name))
+            self._loaded[cluster_name] = section
+            self._loaded.move_to_end(cluster_name)
+            self._evict()
+
+    def __delitem__(self, cluster_name):
+        if self.read_only:
+            raise TypeError("this store was opened read only")
+        with self._lock:
+            fname = self._index.pop(cluster_name)
+            self._loaded.pop(cluster_name, None)
+            self._sizes.pop(cluster_name, None)
+            if (self.dirpath / fname).is_file():
+                os.remove(self.dirpath / fname)
+            self._write_index()
+
+    def __iter__(self):
+        return iter(list(self._index))
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, cluster_name):
+        return cluster_name in self._index
+
+    def _evict(self):
+        """
+        Drop least recently used clusters until we're under max_bytes, always keeping the most recent one
+        """
+        if self.max_bytes is None:
+            return
+        while len(self._loaded) > 1 and self.loaded_bytes() > self.max_bytes:
+            cluster_name, section = self._loaded.popitem(last=False)
+            if not self.read_only:
+                self._write_cluster(cluster_name, section)
+                self._write_index()
+
+    def _write_cluster(self, cluster_name, section, dirpath=None):
+        fpath = Path(dirpath or self.dirpath) / self._index[cluster_name]
+        write_snapshot(fpath, normalize_cluster(section))
+        if dirpath is None:
+            self._sizes[cluster_name] = os.path.getsize(fpath)
+
+    def _write_index(self, dirpath=None):
+        write_snapshot(Path(dirpath or self.dirpath) / self.INDEX_FNAME, {"clusters": self._index})
+
+    def save(self, fpath=None):
+        """
+        Writes every loaded cluster (clusters that were never loaded can't have changed).
+        fpath (str): write a full copy of the db to another directory instead
+        """
+        if self.read_only:
+            raise TypeError("this store was opened read only")
+        with self._lock:
+            if fpath and os.path.abspath(fpath) != os.path.abspath(self.dirpath):
+                for cluster_name in self._index:
+                    self._write_cluster(cluster_name, self[cluster_name], dirpath=fpath)
+                self._write_index(dirpath=fpath)
+                return
+            for cluster_name, section in self._loaded.items():
+                self._write_cluster(cluster_name, section)
+            self._write_index()
+
+
+def split_json_db(json_fpath, dirpath):
+    """
+    Convert a single file json db into a SplitJsonStore directory
+    """
+    source = JsonStore(json_fpath)
+    dest = SplitJsonStore(dirpath)
+    for cluster_name in source:
+        dest[cluster_name] = source[cluster_name]
+    dest.save()
+    return dest
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clusters (
+    name TEXT PRIMARY KEY,
+    keys TEXT NOT NULL,  -- json list of the section's keys, in order
+    extra TEXT NOT NULL  -- json dict of any section keys without their own table
+);
+CREATE TABLE IF NOT EXISTS tweets (
+    id TEXT PRIMARY KEY,
+    author_id TEXT,
+    created_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS influencers (
+    cluster TEXT NOT NULL,
+    username TEXT NOT NULL,
+    kind TEXT NOT NULL,  -- 'influencer' (FeedDB "influencers" list) or 'user' (TweetDB user key)
+    position INTEGER NOT NULL,
+    has_tweets INTEGER NOT NULL,
+    data TEXT NOT NULL,  -- the influencer/user dict without its "tweets"
+    PRIMARY KEY (cluster, kind, username)
+);
+CREATE TABLE IF NOT EXISTS user_tweets (
+    cluster TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    username TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    tweet_id TEXT NOT NULL,
+    created_at TEXT,
+    PRIMARY KEY (cluster, kind, username, position)
+);
+CREATE INDEX IF NOT EXISTS user_tweets_cluster_created_at ON user_tweets (cluster, created_at);
+CREATE TABLE IF NOT EXISTS feed_tweets (
+    cluster TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    tweet_id TEXT NOT NULL,
+    created_at TEXT,
+    PRIMARY KEY (cluster, position)
+);
+CREATE INDEX IF NOT EXISTS feed_tweets_cluster_created_at ON feed_tweets (cluster, created_at);
+CREATE TABLE IF NOT EXISTS quote_bank (
+    cluster TEXT NOT NULL,
+    ref_tweet_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    external_urls TEXT NOT NULL,
+    data TEXT NOT NULL,  -- any other keys of the bank entry (ie. ref_tweet_data)
+    PRIMARY KEY (cluster, ref_tweet_id)
+);
+CREATE TABLE IF NOT EXISTS quote_votes (
+    cluster TEXT NOT NULL,
+    ref_tweet_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    vote_tweet_id TEXT NOT NULL,
+    PRIMARY KEY (cluster, ref_tweet_id, position)
+);
+CREATE INDEX IF NOT EXISTS quote_votes_ref_tweet_id ON quote_votes (ref_tweet_id);
+CREATE TABLE IF NOT EXISTS feed_entries (
+    cluster TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    ref_tweet_id TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (cluster, position)
+);
+CREATE INDEX IF NOT EXISTS feed_entries_ref_tweet_id ON feed_entries (ref_tweet_id);
+"""
+
+class TrackedSection(dict):
+    """
+    A cluster section that remembers which of its keys were set or removed, so SQLiteStore.save only writes those.
+    Only its own keys are watched: the DB classes always set a key to change what's below it
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.changed_keys = set()
+        self.replaced = False  # the whole section was set, every key is written
+
+    @property
+    def changed(self):
+        return self.replaced or bool(self.changed_keys)
+
+    def saved(self):
+        self.changed_keys = set()
+        self.replaced = False
+
+    def __setitem__(self, key, value):
+        self.changed_keys.add(key)
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self.changed_keys.add(key)
+        super().__delitem__(key)
+
+    def update(self, *args, **kwargs):
+        other = dict(*args, **kwargs)
+        self.changed_keys.update(other)
+        super().update(other)
+
+    def pop(self, key, *default):
+        self.changed_keys.add(key)
+        return super().pop(key, *default)
+
+    def popitem(self):
+        key, value = super().popitem()
+        self.changed_keys.add(key)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        self.changed_keys.add(key)
+        return super().setdefault(key, default)
+
+    def clear(self):
+        self.changed_keys.update(self)
+        super().clear()
+
+
+CLUSTER_TABLES = [
+    "influencers",
+    "user_tweets",
+    "feed_tweets",
+    "quote_bank",
+    "quote_votes",
+    "feed_entries",
+]
+
+
+class SQLiteStore(ClusterStore):
+    """
+    Cluster sections stored across indexed tables. Tweets are stored once in `tweets` and referenced by id
+    from everywhere else.
+
+    A section is rebuilt from the tables the first time it is accessed and kept in memory after that.
+    `save()` upserts the rows of every changed section key (see TrackedSection) in a single transaction, and
+    deletes the rows of keys a section no longer has.
+    """
+
+    def __init__(self, fpath, compact=False):
+        self.fpath = fpath
+        self.compact = compact
+        os.makedirs(Path(fpath).parent, exist_ok=True)
+        self.conn = sqlite3.connect(fpath, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self._lock = threading.RLock()  # the web app reads from several threads
+        self._loaded = {}
+
+    def is_loaded(self, cluster_name):
+        return cluster_name in self._loaded
+
+    def _cluster_names(self):
+        with self._lock:
+            rows = self.conn.execute("SELECT name FROM clusters").fetchall()
+        return [r[0] for r in rows]
+
+    def __getitem__(self, cluster_name):
+        if cluster_name not in self._loaded:
+            with self._lock:
+                self._loaded[cluster_name] = TrackedSection(
+                    self._loaded_section(self._read_section(cluster_name))
+                )
+        return self._loaded[cluster_name]
+
+    def __setitem__(self, cluster_name, section):
+        """
+        The store holds a (shallow) copy of section, change it through store[cluster_name] afterwards
+        """
+        self._loaded[cluster_name] = TrackedSection(section)
+        self._loaded[cluster_name].replaced = True
+
+    def __delitem__(self, cluster_name):
+        if cluster_name not in self:
+            raise KeyError(cluster_name)
+        self._loaded.pop(cluster_name, None)
+        with self._lock, self.conn:
+            self._delete_cluster_rows(cluster_name)
+            self.conn.execute("DELETE FROM clusters WHERE name = ?", (cluster_name,))
+
+    def __iter__(self):
+        names = dict.fromkeys(self._cluster_names())
+        names.update(dict.fromkeys(self._loaded))
+        return iter(list(names))
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def __contains__(self, cluster_name):
+        return cluster_name in self._loaded or cluster_name in self._cluster_names()
+
+    def save(self, fpath=None):
+        """
+        fpath (str): save a copy of the whole db somewhere else, the store keeps using its own file
+        """
+        with self._lock, self.conn:
+            for cluster_name, section in self._loaded.items():
+                if section.changed:
+                    self._write_section(cluster_name, section, None if section.replaced else section.changed_keys)
+        for section in self._loaded.values():
+            section.saved()
+        if fpath and os.path.abspath(fpath) != os.path.abspath(self.fpath):
+            dest = sqlite3.connect(fpath)
+            try:
+                with self._lock:
+                    self.conn.backup(dest)
+            finally:
+                dest.close()
+
+    def _delete_cluster_rows(self, cluster_name):
+        for table in CLUSTER_TABLES:
+            self.conn.execute(f"DELETE FROM {table} WHERE cluster = ?", (cluster_name,))
+
+    def _upsert_tweets(self, tweets):
+        self.conn.executemany(
+            """
+            INSERT INTO tweets (id, author_id, created_at, data) VALUES (?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                author_id = excluded.author_id,
+                created_at = excluded.created_at,
+                data = excluded.data
+            """,
+            [
+                (t["id"], t.get("author_id"), t.get("created_at"), json.dumps(t))
+                for t in tweets
+            ],
+        )
+
+    def _write_tweet_list(self, cluster_name, kind, username, tweets):
+        self._upsert_tweets(tweets)
+        self.conn.executemany(
+            """
+            INSERT INTO user_tweets VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(cluster, kind, username, position) DO UPDATE SET
+                tweet_id = excluded.tweet_id,
+                created_at = excluded.created_at
+            """,
+            [
+                (cluster_name, kind, username, pos, t["id"], t.get("created_at"))
+                for pos, t in enumerate(tweets)
+            ],
+        )
+        self.conn.execute(
+            "DELETE FROM user_tweets WHERE cluster = ? AND kind = ? AND username = ? AND position >= ?",
+            (cluster_name, kind, username, len(tweets)),
+        )
+
+    def _write_influencer(self, cluster_name, kind, username, position, data):
+        tweets = data.get("tweets")
+        self.conn.execute(
+            """
+            INSERT INTO influencers VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(cluster, kind, username) DO UPDATE SET
+                position = excluded.position,
+                has_tweets = excluded.has_tweets,
+                data = excluded.data
+            """,
+            (
+                cluster_name,
+                username,
+                kind,
+                position,
+                tweets is not None,
+                json.dumps({k: v for k, v in data.items() if k != "tweets"}),
+            ),
+        )
+        self._write_tweet_list(cluster_name, kind, username, tweets or [])
+
+    def _write_influencers(self, cluster_name, influencers):
+        written = set()
+        for i, influencer in enumerate(influencers):
+            username = influencer["social_account"]["social_account"]["screen_name"]
+            # Borg rankings can move between page requests, an influencer listed twice is kept once
+            if username in written:
+                continue
+            written.add(username)
+            self._write_influencer(cluster_name, "influencer", username, i, influencer)
+        stored = self.conn.execute(
+            "SELECT username FROM influencers WHERE cluster = ? AND kind = 'influencer'", (cluster_name,)
+        ).fetchall()
+        self._delete_influencers(cluster_name, "influencer", [r[0] for r in stored if r[0] not in written])
+
+    def _delete_influencers(self, cluster_name, kind, usernames):
+        for table in ("influencers", "user_tweets"):
+            self.conn.executemany(
+                f"DELETE FROM {table} WHERE cluster = ? AND kind = ? AND username = ?",
+                [(cluster_name, kind, u) for u in usernames],
+            )
+
+    def _write_positions(self, table, cluster_name, rows):
+        """
+        Upsert the (cluster, position, ...) rows of a list, dropping the positions past its end
+        """
+        if rows:
+            columns = ", ".join(["?"] * (len(rows[0]) + 2))
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO {table} VALUES ({columns})",
+                [(cluster_name, pos, *row) for pos, row in enumerate(rows)],
+            )
+        self.conn.execute(
+            f"DELETE FROM {table} WHERE cluster = ? AND position >= ?", (cluster_name, len(rows))
+        )
+
+    def _delete_key_rows(self, cluster_name, key):
+        """
+        Drop the rows of a key the section no longer has
+        """
+        if key == "influencers":
+            for table in ("influencers", "user_tweets"):
+                self.conn.execute(f"DELETE FROM {table} WHERE cluster = ? AND kind = 'influencer'", (cluster_name,))
+        elif key == "all_feed_tweets":
+            self.conn.execute("DELETE FROM feed_tweets WHERE cluster = ?", (cluster_name,))
+        elif key == QUOTE_BANK_KEY:
+            for table in ("quote_bank", "quote_votes"):
+                self.conn.execute(f"DELETE FROM {table} WHERE cluster = ?", (cluster_name,))
+        elif key == URL_FEED_KEY:
+            self.conn.execute("DELETE FROM feed_entries WHERE cluster = ?", (cluster_name,))
+        else:
+            self._delete_influencers(cluster_name, "user", [key])
+
+    def _write_section(self, cluster_name, section, keys=None):
+        """
+        Upsert the rows of the section's changed keys (every key if None) by primary key, and delete the rows of
+        the keys it no longer has. Tweets are upserted and never deleted, since other clusters share them
+        """
+        row = self.conn.execute("SELECT keys FROM clusters WHERE name = ?", (cluster_name,)).fetchone()
+        for key in json.loads(row[0]) if row else []:
+            if key not in section:
+                self._delete_key_rows(cluster_name, key)
+        extra = {}
+        for position, (key, value) in enumerate(section.items()):
+            written = keys is None or key in keys
+            if key == "influencers":
+                if written:
+                    self._write_influencers(cluster_name, value)
+            elif key == "all_feed_tweets":
+                if written:
+                    self._upsert_tweets(value)
+                    self._write_positions(
+                        "feed_tweets", cluster_name, [(t["id"], t.get("created_at")) for t in value]
+                    )
+            elif key == QUOTE_BANK_KEY:
+                if written:
+                    self._write_quote_bank(cluster_name, value)
+            elif key == URL_FEED_KEY:
+                if written:
+                    self._write_positions(
+                        "feed_entries",
+                        cluster_name,
+                        [((e.get("ref_tweet") or {}).get("id"), json.dumps(e)) for e in value],
+                    )
+            elif is_user_section(value):
+                if written:
+                    self._write_influencer(cluster_name, "user", key, position, value)
+            else:
+                extra[key] = value
+        self.conn.execute(
+            "INSERT OR REPLACE INTO clusters VALUES (?, ?, ?)",
+            (cluster_name, json.dumps(list(section)), json.dumps(extra)),
+        )
+
+    def _write_quote_bank(self, cluster_name, bank):
+        for pos, (ref_tweet_id, entry) in enumerate(bank.items()):
+            self._upsert_tweets(entry["vote_tweets"])
+            self.conn.execute(
+                """
+                INSERT INTO quote_bank VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(cluster, ref_tweet_id) DO UPDATE SET
+                    position = excluded.position,
+                    external_urls = excluded.external_urls,
+                    data = excluded.data
+                """,
+                (
+                    cluster_name,
+                    ref_tweet_id,
+                    pos,
+                    json.dumps(entry["external_urls"]),
+                    json.dumps(
+                        {
+                            k: v
+                            for k, v in entry.items()
+                            if k not in ("external_urls", "vote_tweets")
+                        }
+                    ),
+                ),
+            )
+            self.conn.executemany(
+                """
+                INSERT INTO quote_votes VALUES (?, ?, ?, ?)
+                ON CONFLICT(cluster, ref_tweet_id, position) DO UPDATE SET vote_tweet_id = excluded.vote_tweet_id
+                """,
+                [
+                    (cluster_name, ref_tweet_id, i, t["id"])
+                    for i, t in enumerate(entry["vote_tweets"])
+                ],
+            )
+            self.conn.execute(
+                "DELETE FROM quote_votes WHERE cluster = ? AND ref_tweet_id = ? AND position >= ?",
+                (cluster_name, ref_tweet_id, len(entry["vote_tweets"])),
+            )
+        stored = self.conn.execute(
+            "SELECT ref_tweet_id FROM quote_bank WHERE cluster = ?", (cluster_name,)
+        ).fetchall()
+        gone = [(cluster_name, r[0]) for r in stored if r[0] not in bank]
+        for table in ("quote_bank", "quote_votes"):
+            self.conn.executemany(f"DELETE FROM {table} WHERE cluster = ? AND ref_tweet_id = ?", gone)
+
+    def _read_tweets(self, query, params):
+        """
+        Run a query selecting tweet data, returns the parsed tweets in query order
+        """
+        return [json.loads(r[0]) for r in self.conn.execute(query, params)]
+
+    def _read_section(self, cluster_name):
+        row = self.conn.execute(
+            "SELECT keys, extra FROM clusters WHERE name = ?", (cluster_name,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(cluster_name)
+        keys, extra = json.loads(row[0]), json.loads(row[1])
+
+        # read every tweet of the cluster once, so lists that share a tweet share the same dict
+        tweets = {}
+        for query in [
+            "SELECT t.id, t.data FROM user_tweets u JOIN tweets t ON t.id = u.tweet_id WHERE u.cluster = ?",
+            "SELECT t.id, t.data FROM feed_tweets f JOIN tweets t ON t.id = f.tweet_id WHERE f.cluster = ?",
+            "SELECT t.id, t.data FROM quote_votes q JOIN tweets t ON t.id = q.vote_tweet_id WHERE q.cluster = ?",
+        ]:
+            for tweet_id, data in self.conn.execute(query, (cluster_name,)):
+                if tweet_id not in tweets:
+                    tweets[tweet_id] = json.loads(data)
+
+        tweet_lists = {}
+        for kind, username, tweet_id in self.conn.execute(
+            "SELECT kind, username, tweet_id FROM user_tweets WHERE cluster = ? ORDER BY kind, username, position",
+            (cluster_name,),
+        ):
+            tweet_lists.setdefault((kind, username), []).append(tweets[tweet_id])
+
+        influencers, users = [], {}
+        for kind, username, has_tweets, data in self.conn.execute(
+            "SELECT kind, username, has_tweets, data FROM influencers WHERE cluster = ? ORDER BY position",
+            (cluster_name,),
+        ):
+            data = json.loads(data)
+            if has_tweets:
+                data["tweets"] = tweet_lists.get((kind, username), [])
+            if kind == "influencer":
+                influencers.append(data)
+            else:
+                users[username] = data
+
+        section = {}
+        for key in keys:
+            if key == "influencers":
+                section[key] = influencers
+            elif key == "all_feed_tweets":
+                section[key] = [
+                    tweets[r[0]]
+                    for r in self.conn.execute(
+                        "SELECT tweet_id FROM feed_tweets WHERE cluster = ? ORDER BY position",
+                        (cluster_name,),
+                    )
+                ]
+            elif key == QUOTE_BANK_KEY:
+                section[key] = self._read_quote_bank(cluster_name, tweets)
+            elif key == URL_FEED_KEY:
+                section[key] = self._read_feed_entries(cluster_name)
+            elif key in users:
+                section[key] = users[key]
+            else:
+                section[key] = extra[key]
+        return section
+
+    def _read_quote_bank(self, cluster_name, tweets=None):
+        votes = {}
+        for ref_tweet_id, vote_tweet_id, data in self.conn.execute(
+            """
+            SELECT q.ref_tweet_id, q.vote_tweet_id, t.data FROM quote_votes q
+            JOIN tweets t ON t.id = q.vote_tweet_id
+            WHERE q.cluster = ? ORDER BY q.ref_tweet_id, q.position
+            """,
+            (cluster_name,),
+        ):
+            tweet = tweets[vote_tweet_id] if tweets else json.loads(data)
+            votes.setdefault(ref_tweet_id, []).append(tweet)
+        bank = {}
+        for ref_tweet_id, external_urls, data in self.conn.execute(
+            "SELECT ref_tweet_id, external_urls, data FROM quote_bank WHERE cluster = ? ORDER BY position",
+            (cluster_name,),
+        ):
+            bank[ref_tweet_id] = {
+                "external_urls": json.loads(external_urls),
+                **json.loads(data),
+                "vote_tweets": votes.get(ref_tweet_id, []),
+            }
+        return bank
+
+    def _read_feed_entries(self, cluster_name):
+        return [
+            json.loads(r[0])
+            for r in self.conn.execute(
+                "SELECT data FROM feed_entries WHERE cluster = ? ORDER BY position",
+                (cluster_name,),
+            )
+        ]
+
+    def get_quote_tweet_bank(self, cluster_name):
+        if self.is_loaded(cluster_name):
+            return super().get_quote_tweet_bank(cluster_name)
+        with self._lock:
+            return self._read_quote_bank(cluster_name)
+
+    def get_external_url_feed(self, cluster_name):
+        if self.is_loaded(cluster_name):
+            return super().get_external_url_feed(cluster_name)
+        with self._lock:
+            return self._read_feed_entries(cluster_name)
+
+    def get_user_tweets_since(self, cluster_name, start_time):
+        if self.is_loaded(cluster_name):
+            return super().get_user_tweets_since(cluster_name, start_time)
+        with self._lock:
+            return self._read_tweets(
+                """
+                SELECT t.data FROM user_tweets u JOIN tweets t ON t.id = u.tweet_id
+                WHERE u.cluster = ? AND u.kind = 'user' AND u.created_at > ?
+                ORDER BY u.created_at DESC
+                """,
+                (cluster_name, start_time),
+            )
+
+
+def migrate_json_to_sqlite(json_fpath, sqlite_fpath):
+    """
+    Copy every cluster of a json db (FeedDB or TweetDB layout) into a sqlite db
+    """
+    source = JsonStore(json_fpath)
+    dest = SQLiteStore(sqlite_fpath)
+    for cluster_name in source:
+        dest[cluster_name] = source[cluster_name]
+    dest.save()
+    return dest
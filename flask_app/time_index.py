@@ -0,0 +1,125 @@
+"""
+Time index over a TweetDB cluster, so "the newest tweets across every user" doesn't scan every user.
+
+Each user's tweets are kept newest first next to a sorted array of their (negated) epoch timestamps,
+so the tweets newer than start_time are a prefix found with one bisect. The cluster feed is a heap
+based k-way merge of those prefixes, which is lazy: pulling the newest N tweets costs
+O(users with recent tweets + N log users), not users x tweets.
+
+usage:
+    index = ClusterTimeIndex.from_users(tweet_db.get_cluster_users("Ethereum"))
+    for i_tweet in index.iter_newest(start_time="2022-03-01T00:00:00.000Z", limit=50):
+        ...
+"""
+import heapq
+import bisect
+import datetime
+import itertools
+from array import array
+
+
+def as_epoch(when):
+    """
+    when (str|datetime|float): an iso string (twitter's created_at format works), a datetime or epoch seconds
+    """
+    if when is None:
+        return None
+    if isinstance(when, (int, float)):
+        return float(when)
+    if isinstance(when, str):
+        when = datetime.datetime.fromisoformat(when.replace("Z", "+00:00"))
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)  # naive times are utc, as twitter's are
+    return when.timestamp()
+
+
+def iso_time(epoch):
+    """
+    epoch seconds -> twitter's created_at format, ie. 2022-03-01T13:07:36.000Z
+    """
+    when = datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc)
+    return when.strftime("%Y-%m-%dT%H:%M:%S.") + f"{when.microsecond // 1000:03d}Z"
+
+
+class UserTimeline:
+    """
+    One user's tweets, newest first, with a parallel array of -epoch (ascending, so bisect works on it)
+    """
+
+    __slots__ = ("tweets", "neg_epochs")
+
+    def __init__(self, tweets):
+        if hasattr(tweets, "newest_first"):
+            # a compact tweet_store.TweetList, sorted off its epoch column without building the dicts
+            self.tweets, neg_epochs = tweets.newest_first()
+            self.neg_epochs = array("d", neg_epochs.tolist())
+            return
+        keyed = sorted(
+            ((-as_epoch(i["created_at"]), i) for i in tweets),
+            key=lambda x: x[0],
+        )
+        self.tweets = [i for _, i in keyed]
+        self.neg_epochs = array("d", (k for k, _ in keyed))
+
+    def __len__(self):
+        return len(self.tweets)
+
+    def count_since(self, start_epoch):
+        """
+        How many tweets are strictly newer than start_epoch (they are the first ones)
+        """
+        if start_epoch is None:
+            return len(self.tweets)
+        return bisect.bisect_left(self.neg_epochs, -start_epoch)
+
+    def iter_since(self, start_epoch):
+        """
+        (-epoch, tweet) for every tweet newer than start_epoch, newest first
+        """
+        n = self.count_since(start_epoch)
+        return zip(itertools.islice(self.neg_epochs, n), itertools.islice(self.tweets, n))
+
+
+class ClusterTimeIndex:
+    """
+    {username: UserTimeline} for one cluster, with a k-way merged view across users
+    """
+
+    def __init__(self, timelines=None):
+        self.timelines = timelines or {}
+
+    @classmethod
+    def from_users(cls, users):
+        """
+        users (dict): {username: user_data} as returned by TweetDB.get_cluster_users
+        """
+        return cls({k: UserTimeline(v["tweets"]) for k, v in users.items()})
+
+    def update_user(self, username, user_data):
+        """
+        Rebuild one user's timeline after their tweets changed, the rest of the index is untouched
+        """
+        self.timelines[username] = UserTimeline(user_data["tweets"])
+
+    def __len__(self):
+        return sum(len(i) for i in self.timelines.values())
+
+    def count_since(self, start_time=None):
+        start_epoch = as_epoch(start_time)
+        return sum(i.count_since(start_epoch) for i in self.timelines.values())
+
+    def iter_newest(self, start_time=None, limit=None):
+        """
+        Yields the cluster's tweets newer than start_time across every user, newest first.
+
+        start_time (str|datetime|float): see as_epoch, None for every tweet
+        limit (int): stop after this many tweets
+        """
+        start_epoch = as_epoch(start_time)
+        streams = [
+            i.iter_since(start_epoch)
+            for i in self.timelines.values()
+            if i.count_since(start_epoch)
+        ]
+        merged = (i_tweet for _, i_tweet in heapq.merge(*streams, key=lambda x: x[0]))
+        return itertools.islice(merged, limit)
@@ -1,32 +1,26 @@
 import os
-import json
-import re
-import requests
-from time import sleep
-import concurrent.futures
-from tqdm import tqdm
-from bs4 import BeautifulSoup
-from dotenv import load_dotenv
-
-import tweepy
-from tweepy.errors import TooManyRequests
-
-load_dotenv()
-
-consumer_key = os.environ["TWITTER_API_KEY"]
-consumer_secret = os.environ["TWITTER_API_KEY_SECRET"]
-
-access_token = os.environ["TWITTER_ACCESS_TOKEN"]
-access_token_secret = os.environ["TWITTER_ACCESS_TOKEN_SECRET"]
-
-## Twitter api v2 uses this client object instead
-client = tweepy.Client(
-    consumer_key=consumer_key,
-    consumer_secret=consumer_secret,
-    access_token=access_token,
-    access_token_secret=access_token_secret,
-    bearer_token=os.environ["TWITTER_API_BEARER_TOKEN"],
+import datetime
+
+from .aggregate import build_url_feed
+from .feed_snapshot import FEED_SNAPSHOT_KEY, FeedSnapshot, build_feed_snapshot
+from .ingest import (
+    fetch_new_tweets,
+    label_authors,
+    run_sync,
 )
+from .page_meta import PageMetadataFetcher
+from .quote_bank import (
+    QUOTE_BANK_STATE_KEY,
+    empty_state,
+    new_user_tweets,
+    state_from_bank,
+    update_quote_bank,
+)
+from .ranking import INFLUENCER_ATTENTION_KEY, attention_by_field, section_attention
+from .storage import SQLiteStore, open_store
+from .time_index import ClusterTimeIndex, as_epoch, iso_time
+from .tweet_store import compact_section, is_compact, thaw_section
+from .urls import extract_external_urls
 
 
 class TweetDB:
@@ -37,110 +31,266 @@ class TweetDB:
             "tweets": [chrono_order],
             "ids": {},
             "last_pull": str (datetime str)
+            "user_id": str,
+            "newest_id": str (id of the newest tweet we hold, the since_id of the next update)
+        }
+        "influencer_attention": {
+            "attention_score": {user_id: float},
+            "attention_score_change_week": {user_id: float}, (Borg's, see set_influencer_attention)
         }
     """
 
-    def __init__(self, db_fpath):
+    def __init__(self, db_fpath, max_bytes=None, read_only=False, compact=None):
+        """
+        db_fpath (str): json file, sqlite file or split json directory (see storage.open_store)
+        max_bytes (int): for split json dbs, cap on the clusters held in memory at once
+        read_only (bool): for split json dbs, never write (clusters can be evicted for free)
+        compact (bool): hold clusters in the compact form of tweet_store.py, defaults to read_only.
+            A compact cluster is thawed back to dicts the first time it is updated
+        """
         self.db_fpath = db_fpath
-        if os.path.isfile(db_fpath):
-            with open(db_fpath, "r") as f:
-                self._db = json.load(f)
+        self._snapshots = {}
+        self._time_indexes = {}
+        if os.path.exists(db_fpath):
+            self._db = open_store(
+                db_fpath,
+                max_bytes=max_bytes,
+                read_only=read_only,
+                compact=read_only if compact is None else compact,
+            )
         else:
-            raise Exception("must read json file")
+            raise Exception("must read json or sqlite db file")
+
+    def save(self, fpath=None):
+        self._db.save(fpath or self.db_fpath)
+
+    def compact(self, cluster_name):
+        """
+        Hold a cluster in the compact form of tweet_store.py, ie. once it's built and only read from here on
+        """
+        section = self._db[cluster_name]
+        if not is_compact(section):
+            section.update(compact_section(section))
+            self._time_indexes.pop(cluster_name, None)
+
+    def _thaw(self, cluster_name):
+        """
+        Compact tweet lists are read only, turn them back into dicts before a cluster is changed in place
+        """
+        section = self._db[cluster_name]
+        if is_compact(section):
+            section.update(thaw_section(section))
+            self._time_indexes.pop(cluster_name, None)
+
+    def get_cluster_users(self, cluster_name):
+        """
+        {username: user_data} for every user in the cluster, skipping the feed/bank keys that share the cluster dict
+        """
+        return {
+            k: v
+            for k, v in self._db[cluster_name].items()
+            if isinstance(v, dict) and "tweets" in v
+        }
 
-    def save(self, fpath):
-        with open(fpath, "w") as f:
-            json.dump(self._db, f)
+    def set_influencer_attention(self, cluster_name, influencers):
+        """
+        Store the Borg attention scores of the cluster's influencers, the ranking algorithms weight votes by them
+
+        influencers (list): the cluster's Borg influencer list (see build_feed.get_cluster_influencers)
+        """
+        self._db[cluster_name][INFLUENCER_ATTENTION_KEY] = attention_by_field(influencers)
+        self._snapshots.pop(cluster_name, None)
+
+    def update_db(self, cluster_name, usernames=None, start_time=None, influencers=None):
+        """
+        Pull only the tweets newer than the newest one we hold for each user (since_id) and merge them in.
+
+        usernames (list): users to update, defaults to every user already in the cluster.
+            New usernames are pulled from start_time (default last 24h)
+        influencers (list): the cluster's Borg influencer list, to refresh the stored attention scores
+
+        Users whose pull fails are left exactly as they were, including last_pull
+        """
+        self._thaw(cluster_name)
+        if influencers:
+            self.set_influencer_attention(cluster_name, influencers)
+        users = self.get_cluster_users(cluster_name)
+        usernames = usernames or list(users)
+        since_ids = {
+            u: newest_tweet_id(users[u]) if u in users else None for u in usernames
+        }
+        pulled = run_sync(fetch_new_tweets(since_ids, start_time=start_time))
+        pulled_at = str(datetime.datetime.now())
+        for username, (user_id, new_tweets) in pulled.items():
+            self._db[cluster_name][username] = merge_user_tweets(
+                users.get(username), new_tweets, user_id, pulled_at
+            )
+            if cluster_name in self._time_indexes:
+                self._time_indexes[cluster_name].update_user(
+                    username, self._db[cluster_name][username]
+                )
+        return pulled
 
     def get_cluster_tweets(self, cluster_name):
-        return (
-            self._db[cluster_name]["all_feed_tweets"],
-            self._db[cluster_name]["influencers"],
-        )
+        return self._db.get_cluster_tweets(cluster_name)
+
+    def get_external_url_feed(self, cluster_name):
+        return self._db.get_external_url_feed(cluster_name)
+
+    def get_quote_tweet_bank(self, cluster_name):
+        return self._db.get_quote_tweet_bank(cluster_name)
+
+    def get_shares(self, cluster_name, ref_tweet_id):
+        """
+        Every vote tweet for the article the feed shows under ref_tweet_id, including the votes of any
+        other quoted tweets that link to the same article
+        """
+        bank = self.get_quote_tweet_bank(cluster_name)
+        item = self.get_feed_snapshot(cluster_name).get(ref_tweet_id)
+        ref_tweet_ids = item.ref_tweet_ids if item else [ref_tweet_id]
+        vote_tweets = {}
+        for i in ref_tweet_ids:
+            for i_tweet in bank[i]["vote_tweets"]:
+                vote_tweets.setdefault(i_tweet["id"], i_tweet)
+        return list(vote_tweets.values())
+
+    def get_feed_snapshot(self, cluster_name):
+        """
+        The cluster's ranked FeedSnapshot, built once and reused. Dbs built before snapshots existed
+        get one materialized from their external_url_feed
+        """
+        if cluster_name not in self._snapshots:
+            section = self._db[cluster_name]
+            snapshot = section.get(FEED_SNAPSHOT_KEY)
+            if snapshot is None:
+                attention, attention_change = section_attention(section)
+                snapshot = build_feed_snapshot(
+                    section["external_url_feed"],
+                    attention=attention,
+                    attention_change=attention_change,
+                )
+            self._snapshots[cluster_name] = FeedSnapshot(snapshot)
+        return self._snapshots[cluster_name]
 
     def get_external_url_tweet_bank(self, cluster_name, start_time, update=False):
-        if not update and "external_url_quote_tweet_bank" in self._db[cluster_name]:
-            print("I am just returning this, not doing something dumb...")
-            return self._db[cluster_name]["external_url_quote_tweet_bank"]
-        # else:
-        #     feed = self.get_feed(cluster_name, start_time)
-
-        #     tweets_with_ref = []
-        #     for i_tweet in feed:
-        #         if "referenced_tweets" in i_tweet:
-        #             for ref in i_tweet["referenced_tweets"]:
-        #                 if ref["type"] == "quoted":
-        #                     tweets_with_ref.append(i_tweet)
-
-        #     build_quote_tweet_bank = input(
-        #         f"going to pull data for {len(tweets_with_ref)} tweets. is that okay? [y,n]"
-        #     )
-
-        #     if build_quote_tweet_bank == "y":
-        #         url_tweet_bank = filter_tweets_for_external_urls(tweets_with_ref)
-        #     else:
-        #         url_tweet_bank = None
-
-        #     return url_tweet_bank
+        """
+        The cluster's external url quote tweet bank. With update, only the user tweets pulled since the last
+        update are folded in (see quote_bank.update_quote_bank) and votes older than start_time are expired
+        """
+        section = self._db[cluster_name]
+        bank = section.get("external_url_quote_tweet_bank")
+        if bank is not None and not update:
+            return bank
+
+        self._thaw(cluster_name)
+        bank = section.get("external_url_quote_tweet_bank") or {}
+        state = section.get(QUOTE_BANK_STATE_KEY) or (
+            state_from_bank(bank) if bank else empty_state()
+        )
+        tweets = new_user_tweets(self.get_cluster_users(cluster_name), state["cursors"])
+        print(f"{len(tweets)} new tweets since the last quote bank update")
+        update_quote_bank(bank, state, tweets, start_time=start_time)
+
+        section["external_url_quote_tweet_bank"] = bank
+        section[QUOTE_BANK_STATE_KEY] = state
+        return bank
 
     def build_external_url_feed(self, cluster_name, start_time):
-        url_tweet_bank = self.get_external_url_tweet_bank(cluster_name, start_time)
-        self._db[cluster_name]["external_url_quote_tweet_bank"] = url_tweet_bank
-
-        self.external_url_feed = []
-        for num, (i_tweet, i_tweet_data) in enumerate(url_tweet_bank.items()):
-            # Quick code to grab the html description of the site
-            response = requests.get(
-                i_tweet_data["external_urls"][0], headers={"User-Agent": "XY"}
-            )
-            soup = BeautifulSoup(response.text)
-            description = (  # taken from https://stackoverflow.com/questions/22318095/get-meta-description-from-external-website/22318311
-                soup.find("meta", attrs={"name": "description"})
-                or soup.find("meta", attrs={"property": "description"})
-                or soup.find("meta", attrs={"property": "og:description"})
-                or soup.find("meta", attrs={"name": "description"})
-            )
-            if description:
-                description = description.attrs["content"]
-            title = soup.find("title")
-            if title:
-                title = title.text
-            self.external_url_feed.append(
-                {
-                    "title": title,
-                    "description": description,
-                    "ref_tweet": i_tweet_data["ref_tweet_data"],
-                    "external_urls": i_tweet_data["external_urls"],
-                    "tweets": [],
-                }
-            )
-            for i in i_tweet_data["vote_tweets"]:
-                i["tweet_link"] = f"https://twitter.com/username/status/{i['id']}"
-                self.external_url_feed[-1]["tweets"].append(i)
+        url_tweet_bank = self.get_external_url_tweet_bank(
+            cluster_name, start_time, update=True
+        )
+
+        pages = PageMetadataFetcher().fetch_all(
+            [i["external_urls"][0] for i in url_tweet_bank.values()]
+        )
+        label_authors([t for i in url_tweet_bank.values() for t in i["vote_tweets"]])
+
+        # one entry per article, votes for the same canonical url are merged
+        self.external_url_feed = build_url_feed(url_tweet_bank, pages)
 
+        attention, attention_change = section_attention(self._db[cluster_name])
         self._db[cluster_name]["external_url_feed"] = self.external_url_feed
+        self._db[cluster_name][FEED_SNAPSHOT_KEY] = build_feed_snapshot(
+            self.external_url_feed,
+            attention=attention,
+            attention_change=attention_change,
+        )
+        self._snapshots.pop(cluster_name, None)
         return self.external_url_feed
 
-    def get_feed(self, cluster_name, start_time):
-        feed_tweets = []
-        for num, (i_user_name, i_user_data) in enumerate(
-            self._db[cluster_name].items()
+    def get_time_index(self, cluster_name):
+        """
+        The cluster's ClusterTimeIndex, built on first use and kept up to date by update_db
+        """
+        if cluster_name not in self._time_indexes:
+            self._time_indexes[cluster_name] = ClusterTimeIndex.from_users(
+                self.get_cluster_users(cluster_name)
+            )
+        return self._time_indexes[cluster_name]
+
+    def iter_feed(self, cluster_name, start_time=None, limit=None):
+        """
+        Stream the cluster's user tweets newer than start_time, newest first across every user.
+
+        start_time (str|datetime|float): iso string, datetime or epoch seconds, None for everything
+        limit (int): stop after the newest limit tweets
+
+        A sqlite cluster that isn't loaded yet is read with one indexed query instead of being loaded whole
+        """
+        if (
+            isinstance(self._db, SQLiteStore)
+            and not self._db.is_loaded(cluster_name)
+            and cluster_name not in self._time_indexes
         ):
-            if (
-                i_user_name == "external_url_quote_tweet_bank"
-                or i_user_name == "external_url_feed"
-            ):
-                break
-            add_tweets = True
-            cur_index = 0
-            while cur_index < len(i_user_data["tweets"]) and add_tweets:
-                i_tweet = i_user_data["tweets"][cur_index]
-                if i_tweet["created_at"] > start_time:
-                    feed_tweets.append(i_tweet)
-                else:
-                    add_tweets = False
-                cur_index += 1
-        return feed_tweets
+            since = iso_time(as_epoch(start_time)) if start_time is not None else ""
+            tweets = self._db.get_user_tweets_since(cluster_name, since)
+            return iter(tweets[:limit] if limit is not None else tweets)
+        return self.get_time_index(cluster_name).iter_newest(start_time, limit)
+
+    def get_feed(self, cluster_name, start_time, limit=None):
+        """
+        Every user tweet in the cluster newer than start_time (iso string), newest first
+        """
+        return list(self.iter_feed(cluster_name, start_time, limit))
+
+
+def newest_tweet_id(user_data):
+    if user_data.get("newest_id"):
+        return user_data["newest_id"]
+    if user_data["tweets"]:
+        return max(user_data["tweets"], key=lambda t: int(t["id"]))["id"]
+    return None
+
+
+def merge_user_tweets(user_data, new_tweets, user_id, pulled_at):
+    """
+    Build a new user record with new_tweets merged into the chronological list (newest first), skipping ids we already hold.
+
+    A fresh dict is returned instead of mutating user_data, so the caller swaps the whole record
+    (tweets, ids, newest_id and last_pull) in one assignment
+    """
+    user_data = user_data or {"tweets": [], "ids": {}}
+    ids = user_data.get("ids") or {}
+    ids = dict(ids) if isinstance(ids, dict) else dict.fromkeys(ids)
+    for i_tweet in user_data["tweets"]:
+        ids.setdefault(i_tweet["id"], i_tweet["created_at"])
+
+    fresh = []
+    for i_tweet in new_tweets:
+        if i_tweet["id"] not in ids:
+            ids[i_tweet["id"]] = i_tweet["created_at"]
+            fresh.append(i_tweet)
+
+    # tweet ids are snowflakes, so sorting by id is sorting by time
+    tweets = sorted(fresh + user_data["tweets"], key=lambda t: int(t["id"]), reverse=True)
+    return {
+        **user_data,
+        "tweets": tweets,
+        "ids": ids,
+        "user_id": user_id,
+        "newest_id": tweets[0]["id"] if tweets else user_data.get("newest_id"),
+        "last_pull": pulled_at,
+    }
 
 
 def filter_tweets_for_external_urls(tweets):
@@ -148,115 +298,25 @@ def filter_tweets_for_external_urls(tweets):
     Find tweets that **quote a tweet with an external url**.
     Keep a list of the tweets that "voted" for them by quoting it
 
+    Every distinct quoted tweet is hydrated once, 100 ids per request, then the votes are grouped in memory.
+    This builds a bank from scratch, see quote_bank.update_quote_bank to fold new tweets into an existing one.
 
     returns:
         {
             i_ref_tweet.id: {
                 external_urls: [], this is a list of url's (ideally 1) that the quotoed tweet links to
+                ref_tweet_data: {}, the data object of the quoted tweet
                 vote_tweets: [] # this is a list of tweets that quoted the tweet with the url
             }
         }
 
     """
-    quoted_tweet_bank = (
-        {}
-    )  # keys are tweet_id (this tweet is quoted), values are list of tweets by influencers that quoted the key tweet
+    return update_quote_bank({}, empty_state(), tweets)
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        results = list(
-            tqdm(executor.map(check_quote_get_url, tweets), total=len(tweets))
-        )
-
-    for urls, ref_tweet_data, vote_tweet_data in results:
-        if urls:
-            if ref_tweet_data["id"] not in quoted_tweet_bank:
-                quoted_tweet_bank[ref_tweet_data["id"]] = {
-                    "external_urls": urls,
-                    "ref_tweet_data": ref_tweet_data,
-                    "vote_tweets": [vote_tweet_data],
-                }
-            else:
-                quoted_tweet_bank[ref_tweet_data["id"]]["vote_tweets"].append(
-                    vote_tweet_data
-                )
-    return quoted_tweet_bank
-
-
-def check_quote_get_url(vote_tweet):
-    """
-    If tweet quotes another tweet and that tweet has an external url, return the url, the quoted_tweet_id and the vote_tweet object, else return all Nones
-
-    vote_tweet (dict): the data obj of tweepy.Tweet obj
-        this becomes a true "vote tweet" if it qutoes another tweet that has an external url in it
-
-    returns:
-        external_urls: a list of the urls that are in the quoted/referenced tweet
-        i_ref_tweet_data: the data object of the reference twet
-        vote_tweet: the data object of the original tweet
-    """
 
-    if "referenced_tweets" in vote_tweet:
-        # "referenced tweets" include quoted tweets, find them by checking "type" of referenced tweet (other types are "replied_to" and "retweeted")
-        for i_ref_tweet in vote_tweet["referenced_tweets"]:
-            if i_ref_tweet["type"] == "quoted":
-                retry = True
-                while retry:
-                    try:
-                        i_ref_tweet = client.get_tweet(
-                            i_ref_tweet["id"],
-                            tweet_fields=[
-                                "public_metrics",
-                                "created_at",
-                                "author_id",
-                                "referenced_tweets",
-                            ],
-                        )
-                    except TooManyRequests as err:
-                        print(
-                            f"hitting api rate limit, sleeping for 1 minute, then continuing"
-                        )
-                        sleep(60)
-                    else:
-                        retry = False
-                if i_ref_tweet.data and i_ref_tweet.data.data:
-                    i_ref_tweet_data = (
-                        i_ref_tweet.data.data
-                    )  # TODO: add a check for failure to retrieve tweet...
-                else:
-                    return None, None, None
-                external_urls = get_external_urls(i_ref_tweet_data)
-                if external_urls:
-                    return external_urls, i_ref_tweet_data, vote_tweet
-                else:
-                    return None, None, None
-            else:
-                return None, None, None
-
-    else:
-        return None, None, None
-
-
-def get_external_urls(tweet):
+def get_external_urls(tweet, resolver=None):
     """
-    Extract external links from a tweet by doing a request.get (which will follow redirects) and finding the final url
+    Extract external links from a tweet, from its entities when it has them, else by following each link in the text.
+    See urls.extract_external_urls
     """
-    urls = re.findall(
-        "http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+",
-        tweet["text"],
-    )
-    external_links = []
-    if urls:
-        for url in urls:
-            try:
-                # opener = urllib.request.build_opener()
-                # request = urllib.request.Request(url)
-                # response = opener.open(request)
-                # actual_url = response.geturl()
-                res = requests.get(url)
-                actual_url = res.url
-                if "twitter" not in actual_url:
-                    external_links.append(actual_url)
-            except Exception as err:
-                print(f"error with url {url}. Print exception below")
-                print(err)
-    return external_links
+    return extract_external_urls(tweet, resolver=resolver)
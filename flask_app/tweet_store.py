@@ -0,0 +1,399 @@
+"""
+Compact in-memory tweets for clusters that are held to be read (the web app, finished clusters of a build).
+
+A tweet from the api is a dict of strings (id, author_id, created_at) with nested public_metrics and
+referenced_tweets dicts, so each costs well over a kilobyte of python objects before its text. A compacted
+cluster keeps its tweets once, in columns:
+
+    ids         int64
+    epochs      float64, created_at as epoch seconds
+    authors     int32 index into an interned author id table (usernames the same way)
+    metrics     int64 (n, 4) retweet, reply, like and quote counts
+    ref_types   int8 + ref_ids int64, the tweet's single referenced tweet
+    texts       the text strings
+    extras      {row: {key: value}}, only for tweets with anything the columns don't hold (ie. entities)
+
+and every tweet list of the section (an influencer's or user's "tweets", "all_feed_tweets", the quote bank's
+"vote_tweets") becomes a TweetList: a read only sequence of rows that builds the dict of a tweet when it is
+indexed or iterated, so code written against lists of dicts keeps working. TweetRecord (a __slots__ object)
+is the single tweet form in between, for code that only wants a few fields of many tweets.
+
+Materialized dicts are fresh copies, so a compact section is for reading: thaw_section turns it back into
+lists of dicts before anything is changed in place (see TweetDB.update_db, FeedDB.build_external_url_feed).
+
+usage:
+    section = compact_section(section)
+    section["alice"]["tweets"][0]  # a dict, built now
+    section["alice"]["tweets"].epochs()  # numpy array, no dicts built
+    section = thaw_section(section)
+"""
+import sys
+import json
+from collections.abc import Sequence
+
+import numpy as np
+
+from .ingest import tweet_link
+from .schema import TweetTable, denormalize_section, normalize_section
+from .time_index import as_epoch, iso_time
+
+METRICS = ["retweet_count", "reply_count", "like_count", "quote_count"]
+
+REF_TYPES = [None, "quoted", "replied_to", "retweeted"]  # ref_types column -> referenced tweet type
+
+NO_VALUE = -1  # an index column's value when the tweet has no value (a key set to None is kept in extras)
+
+# the keys a tweet's columns can hold, anything else goes to extras
+COLUMN_KEYS = {
+    "id",
+    "text",
+    "created_at",
+    "author_id",
+    "public_metrics",
+    "referenced_tweets",
+    "author_username",
+    "tweet_link",
+}
+
+
+class TweetRecord:
+    """
+    One tweet, with numbers as numbers and no dict per tweet.
+
+    extra (dict): keys the record has no slot for, None when there are none
+    """
+
+    __slots__ = (
+        "id",
+        "text",
+        "epoch",
+        "author_id",
+        "metrics",
+        "referenced_tweets",
+        "author_username",
+        "tweet_link",
+        "extra",
+    )
+
+    def __init__(
+        self,
+        id,
+        text=None,
+        epoch=None,
+        author_id=None,
+        metrics=None,
+        referenced_tweets=None,
+        author_username=None,
+        tweet_link=None,
+        extra=None,
+    ):
+        self.id = id
+        self.text = text
+        self.epoch = epoch
+        self.author_id = author_id
+        self.metrics = metrics  # (retweet, reply, like, quote) or None
+        self.referenced_tweets = referenced_tweets  # ((type, id int), ...) or None
+        self.author_username = author_username
+        self.tweet_link = tweet_link
+        self.extra = extra
+
+    def __repr__(self):
+        return f"TweetRecord({self.id})"
+
+    @property
+    def created_at(self):
+        return iso_time(self.epoch) if self.epoch is not None else None
+
+    @classmethod
+    def from_dict(cls, tweet):
+        """
+        Anything that wouldn't come back out of to_dict exactly is kept in extra as it was
+        """
+        extra = {k: v for k, v in tweet.items() if k not in COLUMN_KEYS}
+        record = cls(int(tweet["id"]))
+        if str(record.id) != tweet["id"]:
+            raise ValueError(f"tweet id {tweet['id']!r} is not a canonical integer")
+
+        for key in ("text", "author_id", "author_username", "tweet_link"):
+            if tweet.get(key) is not None:
+                setattr(record, key, tweet[key])
+            elif key in tweet:
+                extra[key] = None
+
+        created_at = tweet.get("created_at")
+        if created_at is not None:
+            record.epoch = as_epoch(created_at)
+            if iso_time(record.epoch) != created_at:
+                extra["created_at"] = created_at
+        elif "created_at" in tweet:
+            extra["created_at"] = None
+
+        metrics = tweet.get("public_metrics")
+        if (
+            isinstance(metrics, dict)
+            and list(metrics) == METRICS
+            and all(type(v) is int for v in metrics.values())
+        ):
+            record.metrics = tuple(metrics[k] for k in METRICS)
+        elif "public_metrics" in tweet:
+            extra["public_metrics"] = metrics
+
+        refs = tweet.get("referenced_tweets")
+        if (
+            isinstance(refs, list)
+            and len(refs) == 1
+            and list(refs[0]) == ["type", "id"]
+            and refs[0]["type"] in REF_TYPES[1:]
+            and str(int(refs[0]["id"])) == refs[0]["id"]
+        ):
+            record.referenced_tweets = ((refs[0]["type"], int(refs[0]["id"])),)
+        elif "referenced_tweets" in tweet:
+            extra["referenced_tweets"] = refs
+
+        record.extra = extra or None
+        return record
+
+    def to_dict(self):
+        tweet = {"id": str(self.id)}
+        if self.text is not None:
+            tweet["text"] = self.text
+        if self.epoch is not None:
+            tweet["created_at"] = iso_time(self.epoch)
+        if self.author_id is not None:
+            tweet["author_id"] = self.author_id
+        if self.metrics is not None:
+            tweet["public_metrics"] = dict(zip(METRICS, self.metrics))
+        if self.referenced_tweets is not None:
+            tweet["referenced_tweets"] = [{"type": t, "id": str(i)} for t, i in self.referenced_tweets]
+        if self.author_username is not None:
+            tweet["author_username"] = self.author_username
+        if self.tweet_link is not None:
+            tweet["tweet_link"] = self.tweet_link
+        if self.extra:
+            tweet.update(self.extra)  # nested values (ie. entities) are shared with the store, don't change them
+        return tweet
+
+
+class Interned:
+    """
+    A table of distinct strings, a column cell holds an index into it (NO_VALUE for None)
+    """
+
+    def __init__(self):
+        self.values = []
+        self._index = {}
+
+    def index(self, value):
+        if value is None:
+            return NO_VALUE
+        if value not in self._index:
+            self._index[value] = len(self.values)
+            self.values.append(sys.intern(value))
+        return self._index[value]
+
+    def value(self, i):
+        return self.values[i] if i >= 0 else None
+
+
+class ClusterTweets:
+    """
+    Every tweet of a cluster in columns, see the module docstring. Rows are in the order tweets were given,
+    each tweet id once (use schema.TweetTable to merge duplicates first)
+    """
+
+    def __init__(self, tweets):
+        records = [TweetRecord.from_dict(i) for i in tweets]
+        n = len(records)
+        self.authors = Interned()
+        self.usernames = Interned()
+
+        self.ids = np.array([r.id for r in records], dtype=np.int64)
+        self.epochs = np.array(
+            [np.nan if r.epoch is None else r.epoch for r in records], dtype=np.float64
+        )
+        self.author_index = np.array([self.authors.index(r.author_id) for r in records], dtype=np.int32)
+        self.has_metrics = np.array([r.metrics is not None for r in records], dtype=bool)
+        self.metrics = np.array([r.metrics or (0, 0, 0, 0) for r in records], dtype=np.int64).reshape(n, 4)
+        self.ref_types = np.array(
+            [REF_TYPES.index(r.referenced_tweets[0][0]) if r.referenced_tweets else 0 for r in records],
+            dtype=np.int8,
+        )
+        self.ref_ids = np.array(
+            [r.referenced_tweets[0][1] if r.referenced_tweets else 0 for r in records], dtype=np.int64
+        )
+        self.texts = [r.text for r in records]
+
+        # labelled tweets (ingest.label_authors): the username is interned, and a tweet_link that is
+        # the usual link for the tweet is only a flag
+        self.username_index = np.array([self.usernames.index(r.author_username) for r in records], dtype=np.int32)
+        self.derived_link = np.array(
+            [r.tweet_link is not None and r.tweet_link == _tweet_link(r) for r in records], dtype=bool
+        )
+        self.extras = {}
+        for row, record in enumerate(records):
+            extra = dict(record.extra or {})
+            if record.tweet_link is not None and not self.derived_link[row]:
+                extra["tweet_link"] = record.tweet_link
+            if extra:
+                self.extras[row] = extra
+        self._rows = {str(i): row for row, i in enumerate(self.ids.tolist())}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row(self, tweet_id):
+        return self._rows.get(tweet_id)
+
+    def record(self, row):
+        ref_type = self.ref_types[row]
+        record = TweetRecord(
+            int(self.ids[row]),
+            text=self.texts[row],
+            epoch=None if np.isnan(self.epochs[row]) else float(self.epochs[row]),
+            author_id=self.authors.value(self.author_index[row]),
+            metrics=tuple(self.metrics[row].tolist()) if self.has_metrics[row] else None,
+            referenced_tweets=((REF_TYPES[ref_type], int(self.ref_ids[row])),) if ref_type else None,
+            author_username=self.usernames.value(self.username_index[row]),
+            extra=self.extras.get(row),
+        )
+        if self.derived_link[row]:
+            record.tweet_link = _tweet_link(record)
+        return record
+
+    def tweet(self, row):
+        """
+        The tweet's dict, built from the columns
+        """
+        return self.record(row).to_dict()
+
+    ### the lookup interface of schema.TweetTable, so denormalize_section can build a compact section
+
+    def get(self, tweet_id):
+        row = self.row(tweet_id)
+        return None if row is None else self.tweet(row)
+
+    def resolve(self, tweet_ids):
+        rows = [self._rows[i] for i in tweet_ids if i in self._rows]
+        return TweetList(self, np.array(rows, dtype=np.int32))
+
+
+def _tweet_link(record):
+    """
+    The link label_authors would give the tweet, with a None username when it has none or it is None
+    """
+    return tweet_link({"id": str(record.id)}, record.author_username)
+
+
+class TweetList(Sequence):
+    """
+    A read only list of tweets: rows of a ClusterTweets, turned into dicts one at a time as they are read
+    """
+
+    __slots__ = ("store", "rows")
+
+    def __init__(self, store, rows):
+        self.store = store
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return TweetList(self.store, self.rows[i])
+        return self.store.tweet(int(self.rows[i]))
+
+    def __iter__(self):
+        for row in self.rows.tolist():
+            yield self.store.tweet(row)
+
+    def __eq__(self, other):
+        if isinstance(other, Sequence) and not isinstance(other, str):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return f"TweetList({len(self)} tweets)"
+
+    def records(self):
+        for row in self.rows.tolist():
+            yield self.store.record(row)
+
+    def ids(self):
+        return self.store.ids[self.rows]
+
+    def epochs(self):
+        return self.store.epochs[self.rows]
+
+    def take(self, order):
+        """
+        The tweets at positions order (ie. an argsort), as another TweetList
+        """
+        return TweetList(self.store, self.rows[order])
+
+    def newest_first(self):
+        """
+        (the tweets newest first, their -epochs ascending), sorted from the epoch column (see time_index.UserTimeline)
+        """
+        neg_epochs = -self.epochs()
+        order = np.argsort(neg_epochs, kind="stable")
+        return self.take(order), neg_epochs[order]
+
+
+def is_compact(section):
+    """
+    Whether any tweet list of the section is a TweetList
+    """
+    lists = [section.get("all_feed_tweets")]
+    lists += [i.get("tweets") for i in section.get("influencers") or []]
+    lists += [i.get("vote_tweets") for i in (section.get("external_url_quote_tweet_bank") or {}).values()]
+    lists += [i.get("tweets") for i in section.values() if isinstance(i, dict)]
+    return any(isinstance(i, TweetList) for i in lists)
+
+
+def share_equal_values(value, memo):
+    """
+    value with equal strings, and equal dicts / lists, replaced by a single shared object
+
+    memo (dict): shared between calls, so values are shared across them too
+    """
+    if isinstance(value, str):
+        return memo.setdefault(value, value)
+    if isinstance(value, dict):
+        value = {memo.setdefault(k, k): share_equal_values(v, memo) for k, v in value.items()}
+    elif isinstance(value, list):
+        value = [share_equal_values(v, memo) for v in value]
+    else:
+        return value
+    return memo.setdefault((type(value), json.dumps(value, sort_keys=True)), value)
+
+
+def compact_section(section):
+    """
+    The section with every tweet list as a TweetList over one ClusterTweets (tweets held in several lists
+    are stored once). Feed entries keep their dicts, they are views the templates read as they are.
+
+    The Borg data of influencers (and the fields of TweetDB users) repeats a lot, ie. every influencer holds
+    the same cluster records, so equal values below each record are shared: they must not be changed in place
+    """
+    table = TweetTable()
+    normalized = normalize_section(section, table)
+    memo = {}
+
+    def share_fields(record):
+        return {k: share_equal_values(v, memo) for k, v in record.items()}
+
+    for key, value in normalized.items():
+        if key == "influencers":
+            normalized[key] = [share_fields(i) for i in value]
+        elif isinstance(value, dict) and "tweet_ids" in value:
+            normalized[key] = share_fields(value)
+    return denormalize_section(normalized, ClusterTweets(table.tweets.values()))
+
+
+def thaw_section(section):
+    """
+    A compact section back as lists of dicts, with a single dict per tweet id
+    """
+    table = TweetTable()
+    return denormalize_section(normalize_section(section, table), table)
@@ -0,0 +1,93 @@
+"""
+Resolve short links (t.co, bit.ly, ...) to the url they finally land on, without downloading the pages.
+
+Redirects are followed by hand with HEAD requests (falling back to a streamed GET that is closed
+before the body is read) and every result is kept in a persistent cache keyed by the short link.
+"""
+import functools
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import caches, metrics
+from .caches import JsonCache
+
+RESOLVED_TTL = 30 * 24 * 60 * 60  # a resolved short link basically never changes
+FAILED_TTL = 60 * 60  # retry links that failed to resolve after an hour
+
+REDIRECT_CODES = {301, 302, 303, 307, 308}
+
+
+def resolved_url_cache():
+    """
+    short link -> final url, or None for a link that failed to resolve (negative entry)
+    """
+    return JsonCache(caches.CACHE_DIR / "resolved_urls.json", ttl=RESOLVED_TTL)
+
+
+class URLResolver:
+    """
+    timeout (tuple): (connect, read) seconds for every hop
+    max_redirects (int): give up on a link after this many hops
+    pool_maxsize (int): connections kept open per host
+    """
+
+    def __init__(self, cache=None, timeout=(3.05, 5), max_redirects=10, pool_maxsize=10):
+        self.cache = cache if cache is not None else resolved_url_cache()
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+
+        # requests keeps one connection pool per host, pool_connections is how many hosts' pools stay alive
+        adapter = HTTPAdapter(pool_connections=100, pool_maxsize=pool_maxsize)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = "XY"
+
+    def resolve(self, url):
+        """
+        Returns the final url a link redirects to, or None if it couldn't be resolved
+        """
+        if url in self.cache:
+            metrics.cache_lookups("resolved_urls", hits=1)
+            return self.cache.get(url)
+        metrics.cache_lookups("resolved_urls", misses=1)
+        try:
+            final_url = self._follow_redirects(url)
+        except requests.RequestException as err:
+            print(f"error resolving url {url}. Print exception below")
+            print(err)
+            final_url = None
+        self.cache.set(url, final_url, ttl=None if final_url else FAILED_TTL)
+        return final_url
+
+    def _follow_redirects(self, url):
+        for _ in range(self.max_redirects):
+            with metrics.outbound(url):
+                res = self.session.head(url, allow_redirects=False, timeout=self.timeout)
+            if res.status_code >= 400:
+                # plenty of servers refuse HEAD, ask again with a GET but close it before reading the body
+                with metrics.outbound(url):
+                    res = self.session.get(
+                        url, allow_redirects=False, stream=True, timeout=self.timeout
+                    )
+                res.close()
+            location = res.headers.get("location")
+            if res.status_code not in REDIRECT_CODES or not location:
+                return url
+            url = urljoin(url, location)
+        raise requests.TooManyRedirects(f"more than {self.max_redirects} redirects")
+
+    def save(self):
+        self.cache.save()
+
+
+@functools.lru_cache(maxsize=None)
+def default_resolver():
+    """
+    One resolver (and so one set of connection pools and one cache) shared by the whole process.
+    Its cache is read from caches.CACHE_DIR on the first call, after pointing CACHE_DIR elsewhere
+    call default_resolver.cache_clear() so the next one reads the new directory
+    """
+    return URLResolver()
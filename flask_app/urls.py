@@ -0,0 +1,144 @@
+"""
+Pull the external links out of a tweet, and canonicalize them so links to the same article compare equal.
+
+Tweets pulled with the "entities" field already carry the expanded destination of every t.co link, so
+we read those and only go to the network for links behind a known shortener (bit.ly and friends).
+Tweets stored before we asked for entities fall back to resolving every link in the text.
+"""
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from .url_resolver import default_resolver
+
+URL_PATTERN = re.compile(
+    "http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+"
+)
+
+# links to these hosts point back into twitter (quoted tweets, media, profiles), not to an article
+TWITTER_HOSTS = {"twitter.com", "mobile.twitter.com", "pic.twitter.com", "t.co", "x.com"}
+
+# an expanded url on one of these still needs a round trip to find out where it goes
+SHORTENER_HOSTS = {
+    "bit.ly",
+    "bitly.com",
+    "buff.ly",
+    "dlvr.it",
+    "goo.gl",
+    "is.gd",
+    "lnkd.in",
+    "ow.ly",
+    "rebrand.ly",
+    "t.ly",
+    "tinyurl.com",
+    "trib.al",
+    "shorturl.at",
+}
+
+# query params that only track where a click came from, they never change the page. A bare "ref" is left
+# alone: plenty of sites route on it (ie. github's ?ref=<branch>)
+TRACKING_PARAMS = {
+    "fbclid",
+    "gclid",
+    "dclid",
+    "msclkid",
+    "mc_cid",
+    "mc_eid",
+    "igshid",
+    "ref_src",
+    "ref_url",
+    "_hsenc",
+    "_hsmi",
+    "mkt_tok",
+}
+
+
+def url_host(url):
+    host = (urlsplit(url).hostname or "").lower()
+    return host[len("www.") :] if host.startswith("www.") else host
+
+
+def url_get_host(url):
+    """
+    https://www.example.com/post -> https://www.example.com, what the feed shows as an article's site
+    """
+    split_url = urlsplit(url)
+    return f"{split_url.scheme}://{split_url.hostname}"
+
+
+def is_twitter_url(url):
+    host = url_host(url)
+    return host in TWITTER_HOSTS or host.endswith(".twitter.com")
+
+
+def entity_urls(tweet):
+    """
+    The destination of every link in the tweet's entities, unwound_url when twitter followed the
+    redirects for us, else expanded_url
+    """
+    return [
+        i.get("unwound_url") or i.get("expanded_url") or i["url"]
+        for i in tweet["entities"].get("urls", [])
+    ]
+
+
+def extract_external_urls(tweet, resolver=None):
+    """
+    tweet (dict): the data obj of a tweepy.Tweet
+    resolver (URLResolver): used for shortened links, defaults to the process wide resolver
+
+    Returns the non twitter urls the tweet links to, in order, without duplicates
+    """
+    if "entities" in tweet:
+        urls = entity_urls(tweet)
+        needs_resolving = lambda url: url_host(url) in SHORTENER_HOSTS
+    else:
+        urls = URL_PATTERN.findall(tweet["text"])
+        needs_resolving = lambda url: True
+
+    external_links = []
+    for url in urls:
+        if needs_resolving(url):
+            url = (resolver or default_resolver()).resolve(url)
+        if url and not is_twitter_url(url) and url not in external_links:
+            external_links.append(url)
+    return external_links
+
+
+def is_tracking_param(key):
+    key = key.lower()
+    return key.startswith("utm_") or key in TRACKING_PARAMS
+
+
+def canonicalize_url(url):
+    """
+    Normalize a url so different links to the same article compare equal:
+    https scheme, lowercase host without www., no default port, no tracking params,
+    sorted query, no fragment and no trailing slash
+
+    https://www.Example.com/post/?utm_source=twitter&b=2&a=1#comments -> https://example.com/post?a=1&b=2
+
+    Fragments of single page app routes (#/route, #!route) pick the page, so they are kept.
+    A url that doesn't parse (ie. a port past 65535) is returned as it is
+    """
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = "https" if parts.scheme in ("http", "https") else parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[len("www.") :]
+    netloc = host if port in (None, 80, 443) else f"{host}:{port}"
+    path = re.sub("/{2,}", "/", parts.path) or "/"
+    if len(path) > 1:
+        path = path.rstrip("/")
+    query = urlencode(
+        sorted(
+            (k, v)
+            for k, v in parse_qsl(parts.query, keep_blank_values=True)
+            if not is_tracking_param(k)
+        )
+    )
+    fragment = parts.fragment if parts.fragment.startswith(("/", "!")) else ""
+    return urlunsplit((scheme, netloc, path, query, fragment))
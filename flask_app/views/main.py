@@ -1,38 +1,61 @@
-from datetime import datetime, timezone
-import os
-from flask import render_template, request, redirect, Blueprint, url_for, flash
+import threading
+from flask import render_template, request, redirect, Blueprint, url_for, flash, current_app, Response
 
 from .forms import ClusterSelectionForm
 
-from ..build_feed import FeedDB, url_get_host
+from .. import metrics
+from ..caches import user_handle_cache
+from ..ranking import DEFAULT_RANKER, RANKERS
 from ..tweet_db import TweetDB
 
 main_blueprint = Blueprint("main", __name__, template_folder="templates")
 
-from dotenv import load_dotenv
-import tweepy
+_tweet_db = None
+_tweet_db_lock = threading.Lock()
 
-load_dotenv()
 
-consumer_key = os.environ["TWITTER_API_KEY"]
-consumer_secret = os.environ["TWITTER_API_KEY_SECRET"]
+def get_tweet_db():
+    """
+    Open the TweetDB on the first request instead of at import, so workers start without parsing anything.
+    With a split json db (TWEET_DB_PATH is a directory) each cluster is only loaded when it's first asked for
+    """
+    global _tweet_db
+    with _tweet_db_lock:
+        if _tweet_db is None:
+            _tweet_db = TweetDB(
+                current_app.config["TWEET_DB_PATH"],
+                max_bytes=current_app.config["TWEET_DB_MAX_BYTES"],
+                read_only=True,
+            )
+    return _tweet_db
 
-access_token = os.environ["TWITTER_ACCESS_TOKEN"]
-access_token_secret = os.environ["TWITTER_ACCESS_TOKEN_SECRET"]
 
-## Twitter api v2 uses this client object instead 
-twitter_client=tweepy.Client(
-    consumer_key=consumer_key, 
-    consumer_secret=consumer_secret, 
-    access_token=access_token, 
-    access_token_secret=access_token_secret,
-    bearer_token=os.environ["TWITTER_API_BEARER_TOKEN"]
-)
-# db = FeedDB("db/test_db2.json")
+_user_handles = None  # (mtime the cache was read at, JsonCache)
+_user_handles_lock = threading.Lock()
+
+
+def get_user_handles():
+    """
+    Local user id -> screen_name index, for vote tweets stored before they were labelled at build time.
+    Read again whenever a build has written the cache file since
+    """
+    global _user_handles
+    with _user_handles_lock:
+        if _user_handles is not None:
+            mtime, handles = _user_handles
+            if mtime == file_mtime(handles.fpath):
+                return handles
+        handles = user_handle_cache()
+        _user_handles = (file_mtime(handles.fpath), handles)
+        return handles
+
+
+def file_mtime(fpath):
+    return fpath.stat().st_mtime_ns if fpath.is_file() else None
 
-tweet_db = TweetDB("db/tweet_db_1-eth-python-bitcoin-external-quote-bank2.json")
 
 CURRENT_CLUSTER = "Ethereum"
+FEED_PAGE_SIZE = 30
 
 
 def borg_get_account_details(uid):
@@ -41,27 +64,23 @@ def borg_get_account_details(uid):
 
 @main_blueprint.route("/", methods=["GET", "POST"])
 def index():
-    form = ClusterSelectionForm(request.form)
+    form = ClusterSelectionForm(request.values)
     current_cluster = form.data.get("cluster")
     if not current_cluster:
         current_cluster = "Ethereum"
-    external_url_feed = tweet_db._db[current_cluster]["external_url_feed"]
-    external_url_feed = sorted(
-        external_url_feed, key=lambda x: len(x["tweets"]), reverse=True
-    )
-    for obj in external_url_feed:
-        created_at = obj["ref_tweet"]["created_at"]
-        created_at = "".join(created_at.split(".")[:-1]) + "+00:00"
-        created_at = datetime.fromisoformat(created_at)
-        now = datetime.now(timezone.utc)
-        obj["hours_since_shared"] = (now - created_at).total_seconds() // 3600
+    page = request.args.get("page", 0, type=int)
+    algorithm = request.args.get("algorithm", DEFAULT_RANKER)
+    if algorithm not in RANKERS:
+        algorithm = DEFAULT_RANKER
+    snapshot = get_tweet_db().get_feed_snapshot(current_cluster)
 
     return render_template(
         "index.html",
         form=form,
-        feed=external_url_feed,
-        url_get_host=url_get_host,
-        len=len,
+        feed=snapshot.page(page, FEED_PAGE_SIZE, algorithm=algorithm),
+        page=page,
+        algorithm=algorithm,
+        has_next_page=snapshot.has_page(page + 1, FEED_PAGE_SIZE),
     )
 
 
@@ -77,17 +96,33 @@ def shares2():
 def get_shares(ref_tweet_id, current_cluster):
     print(ref_tweet_id)
 
-    ref_tweet_obj = tweet_db._db[current_cluster]["external_url_quote_tweet_bank"][
-        ref_tweet_id
+    handles = get_user_handles()
+    vote_tweets = [
+        {
+            **i,
+            "author_username": i.get("author_username")
+            or handles.get(i["author_id"], i["author_id"]),
+        }
+        for i in get_tweet_db().get_shares(current_cluster, ref_tweet_id)
     ]
     return render_template(
         "shares.html",
         ref_tweet_id=ref_tweet_id,
-        vote_tweets=ref_tweet_obj["vote_tweets"],
-        twitter_client=twitter_client
+        vote_tweets=vote_tweets,
     )
 
 
 @main_blueprint.route("/about/")
 def about():
     return render_template("about.html")
+
+
+@main_blueprint.route("/metrics")
+def metrics_endpoint():
+    """
+    Prometheus scrape target: this process's metrics under run="app", and each CLI run's last report under its name
+    """
+    snapshots = [({"run": "app"}, metrics.REGISTRY.snapshot())]
+    for name, report in metrics.read_reports(current_app.config["METRICS_REPORT_DIR"]).items():
+        snapshots.append(({"run": name}, report["snapshot"]))
+    return Response(metrics.prometheus_text(snapshots), mimetype="text/plain; version=0.0.4")
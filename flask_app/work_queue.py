@@ -0,0 +1,168 @@
+"""
+A small persistent work queue on sqlite, shared by the processes of a build.
+
+Items are keyed by (stage, key), so queueing the same work twice (ie. an influencer who is in several
+clusters) is a no-op and it is done once. Claims are atomic across processes, and everything survives
+a crash: on restart, items that were running go back to pending and finished results are kept.
+
+usage:
+    queue = WorkQueue("db/queue/build_all.sqlite")
+    queue.put("influencer", "vitalikbuterin", influencer)
+    for item_id, key, payload in queue.claim("influencer", 50):
+        ...
+        queue.done(item_id, result)
+"""
+import json
+import time
+import sqlite3
+from pathlib import Path
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    stage TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    updated_at REAL,
+    UNIQUE (stage, key)
+);
+CREATE INDEX IF NOT EXISTS items_stage_status ON items (stage, status);
+"""
+
+
+class WorkQueue:
+    """
+    fpath (str): sqlite file, created if missing
+    max_attempts (int): an item that failed this many times stays failed instead of going back to pending
+    """
+
+    def __init__(self, fpath, max_attempts=3):
+        Path(fpath).parent.mkdir(parents=True, exist_ok=True)
+        self.fpath = str(fpath)
+        self.max_attempts = max_attempts
+        # autocommit, transactions are opened explicitly where it matters
+        self._conn = sqlite3.connect(self.fpath, timeout=60, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def put(self, stage, key, payload=None):
+        """
+        Queue an item, returns False if (stage, key) was already queued
+        """
+        cursor = self._conn.execute(
+            "INSERT OR IGNORE INTO items (stage, key, payload, updated_at) VALUES (?, ?, ?, ?)",
+            (stage, str(key), json.dumps(payload), time.time()),
+        )
+        return cursor.rowcount == 1
+
+    def put_many(self, stage, items):
+        """
+        items (iterable): (key, payload) pairs, returns how many were new
+        """
+        with self._transaction():
+            return sum(self.put(stage, key, payload) for key, payload in items)
+
+    def claim(self, stage, n=1):
+        """
+        Mark up to n pending items of a stage as running and return them as (id, key, payload)
+        """
+        with self._transaction():
+            rows = self._conn.execute(
+                "SELECT id, key, payload FROM items WHERE stage = ? AND status = ? ORDER BY id LIMIT ?",
+                (stage, PENDING, n),
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE items SET status = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                [(RUNNING, time.time(), i) for i, _, _ in rows],
+            )
+        return [(i, key, json.loads(payload)) for i, key, payload in rows]
+
+    def done(self, item_id, result=None):
+        self._conn.execute(
+            "UPDATE items SET status = ?, result = ?, error = NULL, updated_at = ? WHERE id = ?",
+            (DONE, json.dumps(result), time.time(), item_id),
+        )
+
+    def fail(self, item_id, error):
+        """
+        Put a running item back to pending to be retried, or leave it failed after max_attempts
+        """
+        self._conn.execute(
+            """
+            UPDATE items SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, error = ?, updated_at = ?
+            WHERE id = ? AND status = ?
+            """,
+            (self.max_attempts, FAILED, PENDING, str(error), time.time(), item_id, RUNNING),
+        )
+
+    def requeue_running(self):
+        """
+        Items left running by a crashed build go back to pending, returns how many
+        """
+        cursor = self._conn.execute(
+            "UPDATE items SET status = ? WHERE status = ?", (PENDING, RUNNING)
+        )
+        return cursor.rowcount
+
+    def counts(self, stage=None):
+        """
+        {stage: {status: n}}, or {status: n} for one stage
+        """
+        counts = {}
+        for i_stage, status, n in self._conn.execute(
+            "SELECT stage, status, count(*) FROM items GROUP BY stage, status"
+        ):
+            counts.setdefault(i_stage, {})[status] = n
+        return counts.get(stage, {}) if stage else counts
+
+    def pending(self, stage):
+        return self.counts(stage).get(PENDING, 0)
+
+    def remaining(self, stage):
+        counts = self.counts(stage)
+        return counts.get(PENDING, 0) + counts.get(RUNNING, 0)
+
+    def results(self, stage):
+        """
+        {key: result} of every finished item of a stage
+        """
+        return {
+            key: json.loads(result)
+            for key, result in self._conn.execute(
+                "SELECT key, result FROM items WHERE stage = ? AND status = ?",
+                (stage, DONE),
+            )
+        }
+
+    def clear(self):
+        self._conn.execute("DELETE FROM items")
+
+    def _transaction(self):
+        return _Transaction(self._conn)
+
+
+class _Transaction:
+    """
+    BEGIN IMMEDIATE ... COMMIT, so two processes can't claim the same items
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, *exc):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
@@ -1,17 +1,182 @@
+import sys
+import json
+import tempfile
+
+import click
 from flask.cli import FlaskGroup
 
+from flask_app import metrics
 from flask_app.app import create_app
-from flask_app.build_feed import FeedDB
+from flask_app.build_all import QUEUE_FPATH, build_all as build_all_clusters
+from flask_app.build_feed import FeedDB, get_cluster_influencers, get_clusters
+from flask_app.schema import normalize
+from flask_app.serialization import benchmark_codecs
+from flask_app.tweet_db import TweetDB
+from flask_app.storage import JsonStore, migrate_json_to_sqlite, split_json_db
 
 
 cli = FlaskGroup(create_app=create_app)
 
 
 @cli.command()
-def pull_test_db():
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="finish an interrupted pull, only pulling the influencers not in its journal yet",
+)
+def pull_test_db(resume):
     db = FeedDB("db/test_db.json")
-    db.fetch_tweets("Ethereum", influencer_pages=range(6))
+    db.fetch_tweets("Ethereum", influencer_pages=range(6), resume=resume)
     db.save()
+    print(f"metrics report written to {metrics.write_report('pull_test_db')}")
+
+
+@cli.command("build-all")
+@click.argument("db_fpath")
+@click.option("--cluster", "clusters", multiple=True, help="defaults to every Borg cluster")
+@click.option("--pages", default=1, show_default=True, help="Borg influencer pages per cluster")
+@click.option("--workers", default=4, show_default=True, help="worker processes")
+@click.option("--queue", "queue_fpath", default=QUEUE_FPATH, show_default=True)
+@click.option("--fresh", is_flag=True, help="drop an unfinished build instead of resuming it")
+def build_all(db_fpath, clusters, pages, workers, queue_fpath, fresh):
+    """
+    Pull and build every cluster in parallel from a shared work queue (see flask_app/build_all.py)
+    """
+    clusters = clusters or [i["name"] for i in get_clusters()]
+    db = FeedDB(db_fpath)
+    stats = build_all_clusters(
+        db, clusters, range(pages), n_workers=workers, queue_fpath=queue_fpath, fresh=fresh
+    )
+    for stage, i_stats in stats.items():
+        print(f"{stage}: {i_stats['items']} items in {i_stats['seconds']}s ({i_stats['per_second']}/s)")
+    print(f"metrics report written to {metrics.write_report('build_all', queue_stages=stats)}")
+
+
+@cli.command()
+@click.argument("db_fpath")
+@click.option("--cluster", "clusters", multiple=True, help="defaults to every cluster in the db")
+@click.option(
+    "--borg-pages", default=1, show_default=True, help="Borg influencer pages whose attention scores are refreshed, 0 to skip"
+)
+def update_tweet_db(db_fpath, clusters, borg_pages):
+    """
+    Pull only the tweets posted since the last update for every user in the TweetDB, and refresh the
+    Borg attention scores the feed ranking weights votes by
+    """
+    db = TweetDB(db_fpath)
+    for cluster_name in clusters or list(db._db):
+        print(f"updating {cluster_name}")
+        influencers = get_cluster_influencers(cluster_name, pages=range(borg_pages)) if borg_pages else None
+        db.update_db(cluster_name, influencers=influencers)
+    db.save(db_fpath)
+    print(f"metrics report written to {metrics.write_report('update_tweet_db')}")
+
+
+@cli.command()
+@click.argument("json_fpath")
+@click.argument("sqlite_fpath")
+def migrate_db(json_fpath, sqlite_fpath):
+    """
+    Copy a json FeedDB/TweetDB file into a sqlite db (use a .sqlite path with FeedDB/TweetDB afterwards)
+    """
+    store = migrate_json_to_sqlite(json_fpath, sqlite_fpath)
+    print(f"migrated {len(store)} clusters to {sqlite_fpath}")
+
+
+@cli.command()
+@click.argument("json_fpath")
+@click.argument("dirpath")
+def split_db(json_fpath, dirpath):
+    """
+    Split a json FeedDB/TweetDB file into one file per cluster, so the web app can load clusters on demand
+    """
+    store = split_json_db(json_fpath, dirpath)
+    print(f"split {len(store)} clusters into {dirpath}")
+
+
+@cli.command()
+@click.argument("db_fpath")
+@click.option("--repeat", default=3, show_default=True, help="best of this many saves and loads")
+def bench_codecs(db_fpath, repeat):
+    """
+    Time saving and loading a db snapshot with every installed codec and compression (see flask_app/serialization.py)
+    """
+    data = normalize(dict(JsonStore(db_fpath)))
+    with tempfile.TemporaryDirectory() as dirpath:
+        rows = benchmark_codecs(data, dirpath, repeat=repeat)
+    print(f"{'codec':<8} {'compression':<12} {'entries':<8} {'MB':>8} {'save s':>8} {'load s':>8}")
+    for row in rows:
+        print(
+            f"{row['codec']:<8} {str(row['compression']):<12} {str(row['entries']):<8} "
+            f"{row['bytes'] / 1e6:>8.2f} {row['save_seconds']:>8.3f} {row['load_seconds']:>8.3f}"
+        )
+
+
+@cli.command()
+@click.option("--scale", "scales", type=int, multiple=True, help="fixture copies, defaults to DEFAULT_SCALES of benchmarks/suite.py")
+@click.option("--repeat", default=3, show_default=True, help="timed runs of each benchmark per scale")
+@click.option("--only", "names", multiple=True, help="benchmark names (see benchmarks/suite.py), defaults to all")
+@click.option("--out", help="results json, defaults to RESULTS_FPATH of benchmarks/suite.py")
+@click.option("--baseline", help="an earlier results json to compare the medians with")
+@click.option("--tolerance", default=0.2, show_default=True, help="slowdown past the baseline counted as a regression")
+def bench(scales, repeat, names, out, baseline, tolerance):
+    """
+    Time ingestion, feed builds and page rendering on the fixture dbs, offline (see benchmarks/suite.py)
+    """
+    # the benchmarks and their fixtures are only loaded for this command
+    from benchmarks import suite
+
+    unknown = [i for i in names if i not in suite.BENCHMARKS]
+    if unknown:
+        raise click.BadParameter(f"{unknown}, choose from {list(suite.BENCHMARKS)}", param_hint="--only")
+    out = out or suite.RESULTS_FPATH
+    results = suite.run(names=names, scales=scales or suite.DEFAULT_SCALES, repeat=repeat, fpath=out)
+    print(f"{'benchmark':<14} {'scale':>5} {'min s':>9} {'median s':>9}  info")
+    for row in results["results"]:
+        print(f"{row['name']:<14} {row['scale']:>5} {row['min']:>9.4f} {row['median']:>9.4f}  {row['info']}")
+    print(f"results written to {out}")
+    if not baseline:
+        return
+    with open(baseline) as f:
+        rows = suite.compare(results, json.load(f), tolerance=tolerance)
+    for row in rows:
+        flag = "REGRESSED" if row["regressed"] else ""
+        print(f"{row['name']:<14} {row['scale']:>5} {row['baseline']:>9.4f} -> {row['median']:>9.4f} x{row['ratio']} {flag}")
+    if any(i["regressed"] for i in rows):
+        sys.exit(1)
+
+
+@cli.command()
+@click.option("--fixture", "fixtures", multiple=True, help="FeedDB files to serve, defaults to db/test_db.json")
+@click.option("--port", default=8765, show_default=True)
+@click.option("--latency", default=0.0, show_default=True, help="seconds added to every response")
+@click.option("--jitter", default=0.0, show_default=True, help="up to this many random seconds more")
+@click.option("--window", default=15 * 60, show_default=True, help="rate limit window in seconds")
+@click.option("--error-rate", default=0.0, show_default=True, help="share of requests failed with a 429")
+@click.option("--seed", default=0, show_default=True)
+def standin(fixtures, port, latency, jitter, window, error_rate, seed):
+    """
+    Serve the Twitter and Borg endpoints we use from fixtures, for offline runs (see flask_app/standin.py)
+    """
+    from flask_app.standin import DEFAULT_FIXTURES, Fixtures, StandInServer
+
+    server = StandInServer(
+        Fixtures.from_db_files(fixtures or DEFAULT_FIXTURES),
+        port=port,
+        latency=latency,
+        jitter=jitter,
+        window=window,
+        error_rate=error_rate,
+        seed=seed,
+        verbose=True,
+    )
+    print(f"serving {len(server.fixtures.tweets)} tweets of {len(server.fixtures.users)} users, point the app here with:")
+    for k, v in server.env().items():
+        print(f"    export {k}={v}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
 
 
 if __name__ == "__main__":
@@ -6,6 +6,8 @@ import pytest
 
 from flask_app.app import create_app
 from flask_app.build_feed import FeedDB
+from flask_app.standin import StandInServer
+from flask_app.url_resolver import default_resolver
 
 TESTDB = "test_app.db"
 TESTDB_PATH = "db/{}".format(TESTDB)
@@ -22,6 +24,29 @@ def db():
     return FeedDB("db/test_db2.json")
 
 
+@pytest.fixture(autouse=True)
+def fresh_resolver():
+    """
+    The shared resolver keeps the cache of the CACHE_DIR it was made under, tests patching CACHE_DIR get their own
+    """
+    default_resolver.cache_clear()
+    yield
+    default_resolver.cache_clear()
+
+
+@pytest.fixture(scope="session")
+def standin():
+    """
+    Offline Twitter and Borg apis serving db/test_db.json, with the base urls and keys pointed at it
+    """
+    with StandInServer() as server, pytest.MonkeyPatch.context() as mp:
+        for k, v in server.env().items():
+            mp.setenv(k, v)
+        mp.setenv("BORG_API_KEY", "standin")
+        mp.setenv("TWITTER_API_BEARER_TOKEN", "standin")
+        yield server
+
+
 @pytest.fixture(scope="session")
 def app(request):
     """Session-wide test `Flask` application."""
@@ -0,0 +1,42 @@
+from flask_app.aggregate import build_url_feed
+from flask_app.feed_snapshot import FeedSnapshot, build_feed_snapshot
+
+
+def bank_entry(ref_tweet_id, url, vote_ids):
+    return {
+        "external_urls": [url],
+        "ref_tweet_data": {"id": ref_tweet_id, "created_at": "2022-03-01T08:00:00.000Z"},
+        "vote_tweets": [{"id": i} for i in vote_ids],
+    }
+
+
+def test_entries_for_the_same_article_are_merged():
+    bank = {
+        "1": bank_entry("1", "https://www.example.com/post/?utm_source=twitter", ["a"]),
+        "2": bank_entry("2", "http://example.com/post", ["a", "b", "c"]),
+        "3": bank_entry("3", "https://other.com/story?id=1", ["d"]),
+        "4": bank_entry("4", "https://amp.other.com/story", ["e"]),
+    }
+    pages = {
+        "https://other.com/story?id=1": {"title": "story", "canonical": "https://other.com/story"},
+        "https://amp.other.com/story": {"title": "story", "canonical": "https://other.com/story/"},
+    }
+    feed = build_url_feed(bank, pages)
+    assert len(feed) == 2
+
+    post = feed[0]
+    assert post["canonical_url"] == "https://example.com/post"
+    assert post["ref_tweet_ids"] == ["2", "1"], "the most voted quoted tweet comes first"
+    assert post["ref_tweet"]["id"] == "2"
+    assert [i["id"] for i in post["tweets"]] == ["a", "b", "c"], "votes are deduped by id"
+
+    story = feed[1]
+    assert story["canonical_url"] == "https://other.com/story"
+    assert story["title"] == "story"
+    assert len(story["tweets"]) == 2
+
+    snapshot = FeedSnapshot(build_feed_snapshot(feed))
+    assert snapshot.get("1") is snapshot.get("2")
+    assert snapshot.get("1").shares == 3
+    assert snapshot.get("5") is None
+
@@ -0,0 +1,61 @@
+import json
+
+import requests
+
+from benchmarks import suite
+from benchmarks.fixtures import scale_section, synthetic_pages
+from flask_app import caches
+from flask_app.storage import JsonStore
+from flask_app.url_resolver import default_resolver
+
+
+def test_scale_section_copies_are_distinct():
+    section = JsonStore("db/test_db2.json")["Ethereum"]
+    scaled = scale_section(section, 3)
+
+    tweet_ids = [i["id"] for i in scaled["all_feed_tweets"]]
+    assert len(tweet_ids) == 3 * len(section["all_feed_tweets"])
+    assert len(set(tweet_ids)) == len(set(i["id"] for i in section["all_feed_tweets"])) * 3
+    assert all(int(i) < 2**63 for i in tweet_ids)
+    usernames = {i["social_account"]["social_account"]["screen_name"] for i in scaled["influencers"]}
+    assert len(usernames) == 3 * len(section["influencers"])
+
+    bank = scaled["external_url_quote_tweet_bank"]
+    assert len(bank) == 3 * len(section["external_url_quote_tweet_bank"])
+    urls = [u for i in bank.values() for u in i["external_urls"]]
+    assert len(set(urls)) == len(urls)
+
+
+def test_synthetic_pages():
+    with synthetic_pages():
+        res = requests.get("https://example.com/a/post")
+    assert res.status_code == 200
+    assert b"<title>a/post | synthetic</title>" in res.content
+
+
+def test_run_and_compare(tmp_path):
+    fpath = tmp_path / "results.json"
+    names = ["db_load", "filter_tweets", "build_feed", "feed_snapshot", "render_feed"]
+    results = suite.run(names=names, scales=[1], repeat=1, fpath=str(fpath))
+
+    with open(fpath) as f:
+        assert json.load(f) == results
+    assert [i["name"] for i in results["results"]] == names
+    by_name = {i["name"]: i for i in results["results"]}
+    assert by_name["build_feed"]["info"]["feed_entries"] > 0
+    assert "metadata_fetch" in by_name["build_feed"]["stages"]
+    assert by_name["render_feed"]["info"]["bytes"] > 0
+
+    baseline = json.loads(json.dumps(results))
+    baseline["results"][0]["median"] = results["results"][0]["median"] / 2
+    rows = suite.compare(results, baseline, tolerance=0.2)
+    assert [i["regressed"] for i in rows] == [True] + [False] * (len(names) - 1)
+
+
+def test_fresh_caches_resets_the_shared_resolver(tmp_path):
+    with suite.Workspace(tmp_path, 1) as ws:
+        default_resolver().cache.set("https://t.co/warm", "https://example.com/warm")
+        ws.fresh_caches()
+        resolver = default_resolver()
+        assert resolver.cache.fpath.parent == caches.CACHE_DIR
+        assert "https://t.co/warm" not in resolver.cache, "a cold run starts cold"
@@ -0,0 +1,90 @@
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from flask_app import build_all, caches, credentials
+from flask_app.build_feed import FeedDB
+from flask_app.credentials import Credential, CredentialPool
+from flask_app.standin import Fixtures, StandInServer
+from flask_app.work_queue import WorkQueue
+
+from benchmarks.fixtures import synthetic_pages
+
+
+@pytest.fixture
+def standin_with_links(monkeypatch):
+    """
+    The stand-in over both fixture dbs, db/test_db2.json's quote bank gives the quoted tweets their links
+    """
+    with StandInServer(Fixtures.from_db_files(["db/test_db.json", "db/test_db2.json"])) as server:
+        for k, v in server.env().items():
+            monkeypatch.setenv(k, v)
+        monkeypatch.setenv("BORG_API_KEY", "standin")
+        monkeypatch.setenv("TWITTER_API_BEARER_TOKEN", "standin")
+        yield server
+
+
+def test_build_all_against_the_standin(standin_with_links, tmp_path, monkeypatch):
+    monkeypatch.setattr(caches, "CACHE_DIR", tmp_path)
+    monkeypatch.setattr(credentials, "_default_pool", CredentialPool([Credential("standin", "standin")]))
+    queue_fpath = tmp_path / "queue.sqlite"
+    db = FeedDB(str(tmp_path / "feed_db.json"))
+    windows = []
+    build_external_url_feed = db.build_external_url_feed
+
+    def build_and_record(cluster_name, start_time=None, hydrate=None):
+        windows.append(start_time)
+        return build_external_url_feed(cluster_name, start_time=start_time, hydrate=hydrate)
+
+    monkeypatch.setattr(db, "build_external_url_feed", build_and_record)
+
+    # the influencers quoting the articles of db/test_db2.json's bank are on these pages
+    with synthetic_pages(), concurrent.futures.ThreadPoolExecutor(2) as executor:
+        stats = build_all.build_all(
+            db, ["Ethereum"], pages=[2, 3], n_workers=2, queue_fpath=queue_fpath, executor=executor
+        )
+
+    assert [stats[i]["items"] for i in ["influencer_page", "influencer"]] == [2, 100]
+    assert stats["link"]["items"] > 0
+    assert all(i["failed"] == 0 for i in stats.values())
+    section = FeedDB(db.db_fpath)._db["Ethereum"]
+    assert len(section["influencers"]) == 100
+    assert len(section["external_url_feed"]) > 0
+
+    # the build's window went through to the quote bank
+    (start_time,) = windows
+    votes = [t for i in section["external_url_quote_tweet_bank"].values() for t in i["vote_tweets"]]
+    assert votes and all(i["created_at"] > start_time for i in votes)
+    assert WorkQueue(queue_fpath).remaining("influencer") == 0
+
+
+class BrokenExecutor:
+    def submit(self, *args):
+        raise BrokenProcessPool("a child process terminated abruptly")
+
+
+def test_drain_stops_when_the_pool_breaks(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.sqlite")
+    queue.put("influencer", "alice", {})
+    with pytest.raises(RuntimeError, match="resume from the queue"):
+        build_all.drain(BrokenExecutor(), queue, "influencer", 1, 1, None)
+    assert queue.remaining("influencer") == 1
+
+
+def test_a_stale_queue_is_started_over(tmp_path, monkeypatch):
+    queue_fpath = tmp_path / "queue.sqlite"
+    queue = WorkQueue(queue_fpath)
+    queue.put(build_all.META_STAGE, "start_time")
+    queue.done(queue.claim(build_all.META_STAGE)[0][0], "2022-02-28T08:00:00.000Z")
+    queue.put("influencer", "Ethereum:alice", {})
+    queue.close()
+    windows = []
+    monkeypatch.setattr(build_all, "assemble", lambda db, queue, clusters, pages, start_time: windows.append(start_time))
+
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        stats = build_all.build_all(
+            FeedDB(str(tmp_path / "feed_db.json")), [], pages=[], queue_fpath=queue_fpath, executor=executor
+        )
+    assert windows[0] > "2022-02-28T08:00:00.000Z"
+    assert stats["influencer"]["items"] == 0, "the stale queue's influencers are not pulled"
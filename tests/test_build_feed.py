@@ -4,6 +4,13 @@ from flask_app.build_feed import (
     get_cluster_influencers,
 )
 from flask_app.build_feed import FeedDB
+from flask_app import build_feed, caches, credentials
+from flask_app import journal as journal_module
+from flask_app.credentials import Credential, CredentialPool
+from flask_app.ingest import default_start_time
+from flask_app.journal import PullJournal, journal_path
+
+from benchmarks.fixtures import synthetic_pages
 
 
 def test_fetch_feed():
@@ -36,7 +43,9 @@ def test_external_url_feed(db):
         assert (
             "description" in i
         ), "feed must include a description key, even if value is None"
-        assert len(i["external_urls"]) > 0, "must be at least one external_url for each"
+        # db/test_db2.json's feed predates entry level urls, its entries carry them on each tweet
+        external_urls = i.get("external_urls") or [u for t in i["tweets"] for u in t["external_urls"]]
+        assert len(external_urls) > 0, "must be at least one external_url for each"
         for i_tweet in i["tweets"]:
             assert isinstance(
                 i_tweet["tweet_link"], str
@@ -44,7 +53,7 @@ def test_external_url_feed(db):
             assert isinstance(i_tweet["tweet_text"], str), "tweet text must be a str"
 
 
-def test_get_clusters():
+def test_get_clusters(standin):
     should_be_available = [
         "Tesla",
         "Ethereum",
@@ -65,10 +74,105 @@ def test_get_clusters():
         ), f"cluster '{i_cluster}' returned from Hive, but not in your should_be_available list! Was there an update?"
 
 
-def test_get_influencers():
+def test_get_influencers(standin):
     influencers = get_cluster_influencers(
         "Ethereum", pages=[0], sort_by="score", sort_direction="desc"
     )
     assert len(influencers) == 50
     assert isinstance(influencers[0], dict)
     assert "attention_score" in influencers[0]
+
+
+def quote(id, ref_tweet_id, created_at):
+    return {
+        "id": id,
+        "text": f"quoting {ref_tweet_id}",
+        "created_at": created_at,
+        "referenced_tweets": [{"type": "quoted", "id": ref_tweet_id}],
+    }
+
+
+def hydrate(ref_tweet_ids):
+    return {
+        i: ({"id": i, "text": i, "created_at": "2022-02-28T00:00:00.000Z"}, [f"https://example.com/{i}"])
+        for i in ref_tweet_ids
+    }
+
+
+def test_build_expires_votes_outside_the_window(standin, tmp_path, monkeypatch):
+    monkeypatch.setattr(caches, "CACHE_DIR", tmp_path)
+    monkeypatch.setattr(credentials, "_default_pool", CredentialPool([Credential("standin", "standin")]))
+    db = FeedDB(str(tmp_path / "feed_db.json"))
+    db.set_cluster_tweets(
+        "Ethereum",
+        {
+            "influencers": [],
+            "cluster": "Ethereum",
+            "all_feed_tweets": [
+                quote("1", "r1", "2022-03-01T01:00:00.000Z"),
+                quote("2", "r2", "2022-03-02T01:00:00.000Z"),
+                quote("3", "r2", "2022-03-02T02:00:00.000Z"),
+            ],
+        },
+    )
+    articles = lambda feed: sorted((i["external_urls"][0], len(i["tweets"])) for i in feed)
+
+    with synthetic_pages():
+        feed = db.build_external_url_feed("Ethereum", start_time="2022-02-28T00:00:00.000Z", hydrate=hydrate)
+        assert articles(feed) == [("https://example.com/r1", 1), ("https://example.com/r2", 2)]
+
+        # a day later, r1's only vote is out of the window
+        feed = db.build_external_url_feed("Ethereum", start_time="2022-03-02T01:30:00.000Z", hydrate=hydrate)
+        assert articles(feed) == [("https://example.com/r2", 1)]
+        assert list(db._db["Ethereum"]["external_url_quote_tweet_bank"]) == ["r2"]
+
+        # without a start_time nothing is expired until the cluster has been pulled
+        feed = db.build_external_url_feed("Ethereum", hydrate=hydrate)
+        assert articles(feed) == [("https://example.com/r1", 1), ("https://example.com/r2", 2)]
+
+        # then the window is the day before the last pull, however long ago that was
+        section = db._db["Ethereum"]
+        section["influencers"] = [{"last_tweet_pull": "2022-03-03 01:45:00.000000"}]
+        section["all_feed_tweets"].append(quote("4", "r3", "2022-03-02T01:40:00.000Z"))
+        feed = db.build_external_url_feed("Ethereum", hydrate=hydrate)
+        assert articles(feed) == [("https://example.com/r2", 1)]
+
+
+class JournaledFeed:
+    """
+    Stands in for Feed, pulling every pending influencer with one tweet
+    """
+
+    def __init__(self, cluster_name, influencer_pages=None):
+        self.influencers = [{"social_account": {"social_account": {"screen_name": u}}} for u in ["a", "b"]]
+
+    def fetch_influencers(self):
+        return self.influencers
+
+    def fetch_tweets(self, journal=None):
+        for i in journal.pending():
+            username = i["social_account"]["social_account"]["screen_name"]
+            journal.append(dict(i, tweets=[{"id": username}], last_tweet_pull="2022-03-01 08:00:00"))
+        self.section = journal.compact()
+
+    def dict(self):
+        return self.section
+
+
+def test_resume_starts_over_on_a_stale_journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(build_feed, "Feed", JournaledFeed)
+    monkeypatch.setattr(journal_module, "JOURNAL_DIR", tmp_path / "journal")
+    db = FeedDB(str(tmp_path / "feed_db.json"))
+    fpath = journal_path(db.db_fpath, "Ethereum")
+
+    journal = PullJournal.create(fpath, "Ethereum", default_start_time(), JournaledFeed("Ethereum").influencers)
+    journal.append(dict(journal.influencers[0], tweets=[{"id": "resumed"}]))
+    db.fetch_tweets("Ethereum", resume=True)
+    assert [i["id"] for i in db._db["Ethereum"]["all_feed_tweets"]] == ["resumed", "b"]
+    assert db._journals["Ethereum"].start_time == journal.start_time
+
+    journal = PullJournal.create(fpath, "Ethereum", default_start_time(hours=72), JournaledFeed("Ethereum").influencers)
+    journal.append(dict(journal.influencers[0], tweets=[{"id": "stale"}]))
+    db.fetch_tweets("Ethereum", resume=True)
+    assert [i["id"] for i in db._db["Ethereum"]["all_feed_tweets"]] == ["a", "b"]
+    assert db._journals["Ethereum"].start_time > journal.start_time
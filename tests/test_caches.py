@@ -0,0 +1,43 @@
+import os
+
+from flask_app import caches
+from flask_app.caches import JsonCache
+from flask_app.views import main
+
+
+def test_json_cache_persists(tmp_path):
+    fpath = tmp_path / "cache.json"
+    cache = JsonCache(fpath)
+    cache.set("vitalikbuterin", "295218901")
+    cache.save()
+
+    reloaded = JsonCache(fpath)
+    assert "vitalikbuterin" in reloaded
+    assert reloaded.get("vitalikbuterin") == "295218901"
+    assert reloaded.get("not_cached") is None
+
+
+def test_json_cache_expires(tmp_path):
+    cache = JsonCache(tmp_path / "cache.json", ttl=60)
+    cache.set("fresh", 1)
+    cache.set("stale", 2, ttl=-1)
+    assert cache.get("fresh") == 1
+    assert "stale" not in cache, "expired entries should read as missing"
+
+    cache.save()
+    assert len(JsonCache(tmp_path / "cache.json")) == 1, "save should drop expired entries"
+
+
+def test_user_handles_are_read_again_after_a_build(tmp_path, monkeypatch):
+    monkeypatch.setattr(caches, "CACHE_DIR", tmp_path)
+    monkeypatch.setattr(main, "_user_handles", None)
+    handles = caches.user_handle_cache()
+    handles.set("1", "alice")
+    handles.save()
+    assert main.get_user_handles().get("1") == "alice"
+    assert main.get_user_handles() is main.get_user_handles(), "read once while the file is unchanged"
+
+    handles.set("2", "bob")
+    handles.save()
+    os.utime(handles.fpath, ns=(0, 0))  # a new mtime, however coarse the filesystem's clock
+    assert main.get_user_handles().get("2") == "bob"
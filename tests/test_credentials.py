@@ -0,0 +1,43 @@
+import asyncio
+
+from flask_app.credentials import CredentialPool, load_credentials
+
+
+def test_load_numbered_credentials():
+    environ = {
+        "TWITTER_API_BEARER_TOKEN": "a",
+        "TWITTER_API_KEY": "key-a",
+        "TWITTER_API_BEARER_TOKEN_2": "b",
+        "TWITTER_API_BEARER_TOKEN_4": "skipped, there is no _3",
+    }
+    credentials = load_credentials(environ)
+    assert [c.bearer_token for c in credentials] == ["a", "b"]
+    assert credentials[0].consumer_key == "key-a"
+    assert credentials[1].consumer_key is None
+
+
+def test_requests_go_to_the_credential_with_headroom():
+    pool = CredentialPool(load_credentials({"TWITTER_API_BEARER_TOKEN": "a", "TWITTER_API_BEARER_TOKEN_2": "b"}))
+    a, b = pool.credentials
+
+    # a's window is almost spent according to the api
+    a.scheduler.update("/2/tweets", 200, {"x-rate-limit-remaining": "1"})
+    assert [pool.try_acquire("/2/tweets") for _ in range(5)] == [b] * 5
+
+    # b gets a 429, a still has its last request
+    b.scheduler.update("/2/tweets", 429, {"x-rate-limit-reset": "0"})
+    assert pool.try_acquire("/2/tweets") is a
+    assert pool.try_acquire("/2/tweets") is None
+    assert pool.remaining()["twitter_2"]["/2/tweets"] == 0
+
+    # other endpoints have their own budget
+    assert pool.try_acquire("/2/users/:id/tweets") is not None
+
+
+def test_acquire_waits_for_the_first_credential_to_refill():
+    pool = CredentialPool(load_credentials({"TWITTER_API_BEARER_TOKEN": "a"}))
+    bucket = pool.credentials[0].scheduler.bucket("/2/tweets")
+    bucket.tokens = 0.0
+    bucket.rate = 100.0  # a token every 10ms
+    credential = asyncio.run(asyncio.wait_for(pool.acquire("/2/tweets"), timeout=1))
+    assert credential is pool.credentials[0]
@@ -0,0 +1,33 @@
+from flask_app.feed_snapshot import FeedSnapshot, build_feed_snapshot
+from flask_app.time_index import as_epoch
+
+
+def feed_entry(ref_tweet_id, created_at, n_shares):
+    return {
+        "title": f"article {ref_tweet_id}",
+        "description": None,
+        "ref_tweet": {"id": ref_tweet_id, "created_at": created_at},
+        "external_urls": [f"https://example.com/{ref_tweet_id}?utm_source=twitter"],
+        "tweets": [{"id": str(i)} for i in range(n_shares)],
+    }
+
+
+def test_snapshot_is_ranked_and_paged():
+    feed = [
+        feed_entry("1", "2022-03-01T08:00:00.000Z", 1),
+        feed_entry("2", "2022-03-01T09:00:00.000Z", 3),
+        feed_entry("3", "2022-03-01T10:00:00.000Z", 2),
+    ]
+    snapshot = FeedSnapshot(build_feed_snapshot(feed))
+    assert [i.ref_tweet_id for i in snapshot.items] == ["2", "3", "1"]
+    assert snapshot.items[0].host == "https://example.com"
+    assert snapshot.items[0].shares == 3
+
+    now = as_epoch("2022-03-01T12:30:00.000Z")
+    page = snapshot.page(0, page_size=2, now=now)
+    assert [i["hours_since_shared"] for i in page] == [3, 2]
+    assert snapshot.has_page(1, page_size=2)
+    assert not snapshot.has_page(2, page_size=2)
+
+    page[0]["title"] = "changed"
+    assert snapshot.items[0].title == "article 2", "pages must not share state with the snapshot"
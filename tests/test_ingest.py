@@ -0,0 +1,71 @@
+import aiohttp
+
+from flask_app import caches, credentials, ingest
+from flask_app.caches import JsonCache
+from flask_app.credentials import Credential, CredentialPool
+from flask_app.ingest import AsyncTwitterClient, label_authors, lookup_tweets, resolve_user_ids, run_sync
+
+
+class FlakyUsersClient:
+    """
+    Looks usernames up from memory, a batch holding "broken" fails the way a request out of retries does
+    """
+
+    async def get_users(self, usernames):
+        if "broken" in usernames:
+            raise RuntimeError("giving up on /2/users/by after 5 attempts")
+        return [{"username": u, "id": f"id-{u}"} for u in usernames]
+
+
+def test_a_failed_user_batch_leaves_only_its_users_unresolved(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "USER_LOOKUP_BATCH", 2)
+    cache = JsonCache(tmp_path / "user_ids.json")
+    handles = JsonCache(tmp_path / "user_handles.json")
+    usernames = ["alice", "bob", "broken", "carol", "dave"]
+
+    user_ids = run_sync(resolve_user_ids(FlakyUsersClient(), usernames, cache=cache, handles=handles))
+
+    # batches are [alice, bob], [broken, carol], [dave]
+    assert user_ids == {"alice": "id-alice", "bob": "id-bob", "dave": "id-dave"}
+    assert JsonCache(tmp_path / "user_ids.json").get("dave") == "id-dave", "what succeeded is cached"
+
+
+def test_a_failed_tweet_batch_is_left_out(standin, tmp_path, monkeypatch):
+    monkeypatch.setattr(caches, "CACHE_DIR", tmp_path)
+    monkeypatch.setattr(credentials, "_default_pool", CredentialPool([Credential("standin", "standin")]))
+    monkeypatch.setattr(ingest, "TWEET_LOOKUP_BATCH", 2)
+    get_tweets = AsyncTwitterClient.get_tweets
+
+    async def flaky_get_tweets(client, ids, **kwargs):
+        if "broken" in ids:
+            raise aiohttp.ClientConnectionError("connection reset")
+        return await get_tweets(client, ids, **kwargs)
+
+    monkeypatch.setattr(AsyncTwitterClient, "get_tweets", flaky_get_tweets)
+    ids = list(standin.fixtures.tweets)[:3]
+
+    # batches are [ids[0], ids[1]], [broken, ids[2]], [404]
+    tweets = run_sync(lookup_tweets([ids[0], ids[1], "broken", ids[2], "404"]))
+    assert sorted(k for k, v in tweets.items() if v) == sorted(ids[:2])
+    assert "broken" not in tweets and ids[2] not in tweets, "a failed batch is missing, to be tried again"
+    assert tweets["404"] is None, "a tweet twitter doesn't have is None"
+
+
+def test_label_authors_survives_a_failed_batch(standin, tmp_path, monkeypatch):
+    monkeypatch.setattr(caches, "CACHE_DIR", tmp_path)
+    monkeypatch.setattr(credentials, "_default_pool", CredentialPool([Credential("standin", "standin")]))
+    monkeypatch.setattr(ingest, "USER_LOOKUP_BATCH", 1)
+    get_users_by_ids = AsyncTwitterClient.get_users_by_ids
+
+    async def flaky_get_users_by_ids(client, ids, **kwargs):
+        if "666" in ids:
+            raise RuntimeError("giving up on /2/users after 5 attempts")
+        return await get_users_by_ids(client, ids, **kwargs)
+
+    monkeypatch.setattr(AsyncTwitterClient, "get_users_by_ids", flaky_get_users_by_ids)
+    user_id = next(iter(standin.fixtures.users))
+    tweets = label_authors([{"id": "1", "author_id": user_id}, {"id": "2", "author_id": "666"}])
+
+    assert tweets[0]["author_username"] == standin.fixtures.users[user_id]["username"]
+    assert tweets[1]["author_username"] == "666"
+    assert tweets[1]["tweet_link"] == "https://twitter.com/i/web/status/2"
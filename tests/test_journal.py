@@ -0,0 +1,34 @@
+from flask_app.journal import PullJournal
+
+
+def influencer(username, tweets=None):
+    influencer = {"social_account": {"social_account": {"screen_name": username}}}
+    if tweets is not None:
+        influencer["tweets"] = tweets
+        influencer["last_tweet_pull"] = "2022-03-01 08:00:00"
+    return influencer
+
+
+def test_resume_after_crash(tmp_path):
+    fpath = tmp_path / "journal.jsonl"
+    influencers = [influencer("a"), influencer("b"), influencer("c")]
+    journal = PullJournal.create(fpath, "Ethereum", "2022-02-28T08:00:00.000Z", influencers)
+    journal.append(influencer("a", [{"id": "1"}]))
+    with open(fpath, "a") as f:
+        f.write('{"username": "b", "influ')  # crashed half way through writing b
+
+    resumed = PullJournal.load(fpath)
+    assert resumed.start_time == "2022-02-28T08:00:00.000Z"
+    assert [i["social_account"]["social_account"]["screen_name"] for i in resumed.pending()] == ["b", "c"]
+
+    resumed.append(influencer("c", [{"id": "3"}, {"id": "4"}]))
+    reloaded = PullJournal.load(fpath)
+    assert set(reloaded.records) == {"a", "c"}, "an append after a crash must not be lost"
+
+    section = reloaded.compact()
+    assert section["cluster"] == "Ethereum"
+    assert [t["id"] for t in section["all_feed_tweets"]] == ["1", "3", "4"]
+    assert len(section["influencers"]) == 3
+
+    reloaded.remove()
+    assert PullJournal.load(fpath) is None
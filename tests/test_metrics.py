@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+from flask_app import caches, credentials, metrics
+from flask_app.credentials import Credential, CredentialPool
+from flask_app.ingest import default_start_time, fetch_influencers_tweets, run_sync
+from flask_app.metrics import Registry, prometheus_text, report
+
+
+def test_registry_counts_and_buckets():
+    registry = Registry()
+    registry.inc("api_calls_total", api="twitter", endpoint="/2/tweets", status=200)
+    registry.inc("api_calls_total", 2, api="twitter", endpoint="/2/tweets", status=200)
+    for seconds in [0.01, 0.3, 60]:
+        registry.observe("outbound_latency_seconds", seconds, host="api.twitter.com")
+
+    snapshot = registry.snapshot()
+    assert snapshot["counters"] == [
+        {"name": "api_calls_total", "labels": {"api": "twitter", "endpoint": "/2/tweets", "status": "200"}, "value": 3}
+    ]
+    (histogram,) = snapshot["histograms"]
+    assert histogram["count"] == 3 and histogram["max"] == 60
+    assert histogram["buckets"][0] == 1 and histogram["buckets"][3] == 1 and histogram["buckets"][-1] == 1
+
+    with pytest.raises(KeyError):
+        registry.inc("not_a_metric")
+
+
+def test_drain_and_merge():
+    worker, main = Registry(), Registry()
+    worker.observe("stage_seconds", 2, stage="tweet_fetch")
+    worker.inc("cache_hits_total", 5, cache="user_ids")
+    main.observe("stage_seconds", 1, stage="tweet_fetch")
+
+    main.merge(worker.drain())
+    main.merge(worker.drain())  # nothing new, merging again changes nothing
+    summary = report(main.snapshot())
+    assert summary["stages"]["tweet_fetch"]["count"] == 2
+    assert summary["stages"]["tweet_fetch"]["seconds"] == 3
+    assert summary["counters"]["cache_hits_total"] == {"cache=user_ids": 5}
+    assert worker.snapshot() == {"counters": [], "histograms": []}
+
+
+def test_prometheus_text():
+    registry = Registry()
+    registry.inc("rate_limited_total", api="twitter", endpoint="/2/tweets")
+    registry.observe("stage_seconds", 0.2, stage="metadata_fetch")
+    text = prometheus_text([({"run": "app"}, registry.snapshot())])
+
+    assert "# TYPE feed_rate_limited_total counter" in text
+    assert 'feed_rate_limited_total{run="app",api="twitter",endpoint="/2/tweets"} 1' in text
+    assert 'feed_stage_seconds_bucket{run="app",stage="metadata_fetch",le="0.1"} 0' in text
+    assert 'feed_stage_seconds_bucket{run="app",stage="metadata_fetch",le="0.5"} 1' in text
+    assert 'feed_stage_seconds_bucket{run="app",stage="metadata_fetch",le="+Inf"} 1' in text
+    assert 'feed_stage_seconds_count{run="app",stage="metadata_fetch"} 1' in text
+
+
+def test_pull_is_instrumented(standin, tmp_path, monkeypatch):
+    monkeypatch.setattr(caches, "CACHE_DIR", tmp_path)
+    monkeypatch.setattr(credentials, "_default_pool", CredentialPool([Credential("standin", "standin")]))
+    monkeypatch.setattr(metrics, "REGISTRY", Registry())
+
+    influencers = [dict(i) for i in standin.fixtures.clusters["Ethereum"]["influencers"][:20]]
+    run_sync(fetch_influencers_tweets(influencers, start_time=default_start_time(48)))
+
+    summary = report()
+    assert summary["stages"]["tweet_fetch"]["count"] == 1
+    assert summary["counters"]["cache_misses_total"] == {"cache=user_ids": 20}
+    calls = summary["counters"]["api_calls_total"]
+    assert calls["api=twitter,endpoint=/2/users/by,status=200"] == 1
+    assert calls["api=twitter,endpoint=/2/users/:id/tweets,status=200"] > 0
+    assert summary["latency"]["127.0.0.1"]["count"] == sum(calls.values())
+
+    fpath = metrics.write_report("test_pull", fpath=tmp_path / "report.json", influencers=20)
+    with open(fpath) as f:
+        written = json.load(f)
+    assert written["name"] == "test_pull" and written["influencers"] == 20
+    assert written["stages"] == summary["stages"]
+
+
+def test_metrics_endpoint(app, client, tmp_path, monkeypatch):
+    registry = Registry()
+    registry.inc("sleeps_total", reason="rate_limit")
+    monkeypatch.setattr(metrics, "REGISTRY", registry)
+    build = Registry()
+    build.inc("api_calls_total", api="borg", endpoint="/influence/clusters/", status=200)
+    with open(tmp_path / "build_all.json", "w") as f:
+        json.dump(report(build.snapshot()), f)
+    monkeypatch.setitem(app.config, "METRICS_REPORT_DIR", str(tmp_path))
+
+    res = client.get("/metrics")
+    assert res.status_code == 200
+    assert res.mimetype == "text/plain"
+    text = res.get_data(as_text=True)
+    assert 'feed_sleeps_total{run="app",reason="rate_limit"} 1' in text
+    assert 'feed_api_calls_total{run="build_all",api="borg",endpoint="/influence/clusters/",status="200"} 1' in text
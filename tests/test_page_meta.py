@@ -0,0 +1,140 @@
+import time
+
+from flask_app.caches import JsonCache
+from flask_app.page_meta import (
+    FAILED_PAGE_TTL,
+    HeadParser,
+    PageMetadataFetcher,
+    empty_metadata,
+    parse_head,
+    read_head,
+)
+
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+    <title>
+        CityDAO Podcast
+    </title>
+    <meta property="og:description" content="og description">
+    <meta name="Description" content="the real description">
+    <meta property="og:image" content="https://podcast.citydao.io/cover.png">
+</head>
+<body>
+    <title>not the title</title>
+</body>
+</html>
+"""
+
+
+def test_head_parser_extracts_metadata():
+    parser = HeadParser()
+    parser.feed(PAGE)
+    metadata = parser.metadata()
+    assert metadata["title"] == "CityDAO Podcast"
+    assert (
+        metadata["description"] == "the real description"
+    ), "name=description should win over og:description"
+    assert metadata["og"]["image"] == "https://podcast.citydao.io/cover.png"
+
+
+def test_head_parser_stops_at_head():
+    parser = HeadParser()
+    head, rest = PAGE.split("</head>")
+    for i in range(0, len(head), 7):
+        parser.feed(head[i : i + 7])
+        assert not parser.done
+    parser.feed("</head>")
+    assert parser.done, "parser should be done once </head> is fed"
+
+
+class FakeResponse:
+    def __init__(self, url, body, chunk_size):
+        self.url = url
+        self.status_code = 200
+        self.encoding = "utf-8"
+        self.body = body.encode()
+        self.chunk_size = chunk_size
+        self.chunks_read = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), self.chunk_size):
+            self.chunks_read += 1
+            yield self.body[i : i + self.chunk_size]
+
+
+class FakeSession:
+    """
+    Serves PAGE (with a relative canonical link) for every url, 16 bytes at a time
+    """
+
+    def __init__(self):
+        self.responses = []
+
+    def get(self, url, **kwargs):
+        page = PAGE.replace("</head>", '<link rel="canonical" href="/podcast/"></head>')
+        self.responses.append(FakeResponse(url + "?redirected", page + "x" * 100000, 16))
+        return self.responses[-1]
+
+
+def test_read_head_stops_at_head_and_parses_compact_record():
+    session = FakeSession()
+    raw, encoding, final_url = read_head(session, "https://citydao.io/a")
+    assert b"</head>" in raw
+    assert len(raw) < 1000, "the body must not be downloaded"
+
+    metadata = parse_head(raw, encoding, final_url)
+    assert metadata["title"] == "CityDAO Podcast"
+    assert metadata["og"] == {"image": "https://podcast.citydao.io/cover.png"}
+    assert metadata["canonical"] == "https://citydao.io/podcast/"
+
+
+def test_fetch_all_parses_in_processes(tmp_path):
+    fetcher = PageMetadataFetcher(
+        cache=JsonCache(tmp_path / "pages.json"), parse_workers=2, max_pending=2
+    )
+    fetcher.session = FakeSession()
+    urls = [f"https://citydao.io/{i}" for i in range(6)] + ["https://citydao.io/0?utm_source=twitter"]
+    pages = fetcher.fetch_all(urls)
+    assert len(fetcher.session.responses) == 6, "links to the same article are fetched once"
+    assert {i["title"] for i in pages.values()} == {"CityDAO Podcast"}
+
+
+def test_unknown_charset_falls_back_to_utf8(tmp_path):
+    assert parse_head(PAGE.encode(), "utf8mb4")["title"] == "CityDAO Podcast"
+
+    session = FakeSession()
+    get = session.get
+
+    def get_with_bogus_charset(url, **kwargs):
+        res = get(url, **kwargs)
+        res.encoding = "utf8mb4"
+        return res
+
+    session.get = get_with_bogus_charset
+    fetcher = PageMetadataFetcher(cache=JsonCache(tmp_path / "pages.json"), parse_workers=0)
+    fetcher.session = session
+    pages = fetcher.fetch_all(["https://citydao.io/a", "https://citydao.io/b"])
+    assert {i["title"] for i in pages.values()} == {"CityDAO Podcast"}
+    assert fetcher.fetch("https://citydao.io/c")["title"] == "CityDAO Podcast"
+
+
+def test_error_pages_are_not_cached_as_metadata(standin, tmp_path):
+    cache = JsonCache(tmp_path / "pages.json")
+    fetcher = PageMetadataFetcher(cache=cache, parse_workers=0)
+    url = f"{standin.base_url}/articles/gone"  # the stand-in answers unknown paths with a 404
+
+    assert fetcher.fetch(url) is None
+    assert fetcher.fetch_all([url]) == {url: empty_metadata()}
+    (_, expires_at), = cache._entries.values()
+    assert expires_at <= time.time() + FAILED_PAGE_TTL, "a failed page is tried again soon"
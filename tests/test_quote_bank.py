@@ -0,0 +1,91 @@
+from flask_app.quote_bank import (
+    empty_state,
+    new_user_tweets,
+    state_from_bank,
+    update_quote_bank,
+)
+
+
+def vote(id, ref_tweet_id, created_at):
+    return {
+        "id": id,
+        "created_at": created_at,
+        "referenced_tweets": [{"type": "quoted", "id": ref_tweet_id}],
+    }
+
+
+class FakeHydrate:
+    """
+    Quoted tweets "r1" and "r2" link to an article, "r3" doesn't. Remembers what it was asked for
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, ref_tweet_ids):
+        self.calls.append(sorted(ref_tweet_ids))
+        urls = {"r1": ["https://example.com/1"], "r2": ["https://example.com/2"], "r3": []}
+        return {i: ({"id": i}, urls[i]) for i in ref_tweet_ids}
+
+
+def test_incremental_updates_only_process_new_tweets():
+    hydrate = FakeHydrate()
+    bank, state = {}, empty_state()
+    first = [
+        vote("1", "r1", "2022-03-01T01:00:00.000Z"),
+        vote("2", "r3", "2022-03-01T02:00:00.000Z"),
+        {"id": "3", "created_at": "2022-03-01T03:00:00.000Z"},  # not a quote tweet
+    ]
+    update_quote_bank(bank, state, first, hydrate=hydrate)
+    assert list(bank) == ["r1"]
+    assert hydrate.calls == [["r1", "r3"]]
+
+    second = first + [
+        vote("4", "r1", "2022-03-02T01:00:00.000Z"),
+        vote("5", "r3", "2022-03-02T02:00:00.000Z"),
+        vote("6", "r2", "2022-03-02T03:00:00.000Z"),
+    ]
+    update_quote_bank(bank, state, second, hydrate=hydrate)
+    assert hydrate.calls[1] == ["r2"], "r1 and r3 were already looked up"
+    assert [i["id"] for i in bank["r1"]["vote_tweets"]] == ["1", "4"]
+    assert [i["id"] for i in bank["r2"]["vote_tweets"]] == ["6"]
+
+    # a day later the first votes age out of the window
+    update_quote_bank(bank, state, [], start_time="2022-03-02T02:30:00.000Z", hydrate=hydrate)
+    assert list(bank) == ["r2"]
+    assert set(state["processed"]) == {"6"}
+    assert set(state["ref_urls"]) == {"r2"}
+
+
+def test_new_user_tweets_walks_only_the_new_prefix():
+    users = {"a": {"tweets": [{"id": "30"}, {"id": "20"}, {"id": "10"}]}, "b": {"tweets": []}}
+    cursors = {"a": "20"}
+    assert [i["id"] for i in new_user_tweets(users, cursors)] == ["30"]
+    assert cursors == {"a": "30"}
+    assert new_user_tweets(users, cursors) == []
+
+
+def test_state_from_bank():
+    bank = {"r1": {"external_urls": ["https://example.com/1"], "vote_tweets": [vote("1", "r1", "2022-03-01T01:00:00.000Z")]}}
+    state = state_from_bank(bank)
+    hydrate = FakeHydrate()
+    update_quote_bank(bank, state, [vote("1", "r1", "2022-03-01T01:00:00.000Z")], hydrate=hydrate)
+    assert hydrate.calls == []
+    assert len(bank["r1"]["vote_tweets"]) == 1
+
+
+def test_votes_for_a_failed_lookup_are_retried():
+    bank, state = {}, empty_state()
+    tweets = [vote("1", "r1", "2022-03-01T01:00:00.000Z"), vote("2", "r2", "2022-03-01T02:00:00.000Z")]
+
+    # the batch holding r2 failed, hydrate leaves it out
+    update_quote_bank(bank, state, tweets, hydrate=lambda ids: {i: FakeHydrate()([i])[i] for i in ids if i != "r2"})
+    assert list(bank) == ["r1"]
+    assert [i["id"] for i in state["retry"]] == ["2"] and "2" not in state["processed"]
+
+    # the next update has no new tweets (ie. TweetDB's cursors moved on), r2 is looked up again from the retry list
+    hydrate = FakeHydrate()
+    update_quote_bank(bank, state, [], hydrate=hydrate)
+    assert hydrate.calls == [["r2"]]
+    assert [i["id"] for i in bank["r2"]["vote_tweets"]] == ["2"]
+    assert state["retry"] == []
@@ -0,0 +1,61 @@
+from flask_app.feed_snapshot import FeedSnapshot, build_feed_snapshot
+from flask_app.time_index import as_epoch
+from flask_app.ranking import RANKERS, rank, register_ranker
+
+
+def vote(author_id, created_at, likes=0):
+    return {
+        "id": f"{author_id}-{created_at}",
+        "author_id": author_id,
+        "created_at": created_at,
+        "public_metrics": {"like_count": likes, "retweet_count": 0, "reply_count": 0, "quote_count": 0},
+    }
+
+
+def feed_entry(ref_tweet_id, votes):
+    return {
+        "title": ref_tweet_id,
+        "ref_tweet": {"id": ref_tweet_id, "created_at": "2022-03-01T00:00:00.000Z"},
+        "external_urls": [f"https://example.com/{ref_tweet_id}"],
+        "tweets": votes,
+    }
+
+
+FEED = [
+    # three early votes from nobodies
+    feed_entry("old", [vote(str(i), "2022-03-01T01:00:00.000Z") for i in range(3)]),
+    # two recent votes, one from a big account, one of them popular
+    feed_entry("new", [vote("whale", "2022-03-02T11:00:00.000Z", likes=500), vote("0", "2022-03-02T11:30:00.000Z")]),
+]
+ATTENTION = {"whale": 10.0, "0": 1.0, "1": 1.0, "2": 1.0}
+NOW = as_epoch("2022-03-02T12:00:00.000Z")
+
+
+def test_algorithms_rank_differently():
+    snapshot = FeedSnapshot(build_feed_snapshot(FEED, attention=ATTENTION))
+    assert set(RANKERS) >= {"shares", "attention", "engagement", "decay", "velocity", "hot"}
+
+    titles = lambda algorithm: [i["title"] for i in snapshot.page(now=NOW, algorithm=algorithm)]
+    assert titles("shares") == ["old", "new"]
+    assert titles("attention") == ["new", "old"]
+    assert titles("engagement") == ["new", "old"]
+    assert titles("decay") == ["new", "old"]
+    assert titles("velocity") == ["new", "old"]
+
+
+def test_register_ranker_and_ties_keep_feed_order():
+    @register_ranker("test_constant")
+    def constant(votes, now):
+        return votes.shared_at * 0
+
+    snapshot = FeedSnapshot(build_feed_snapshot(FEED))
+    assert list(rank(snapshot.votes, "test_constant", NOW)) == [0, 1]
+    del RANKERS["test_constant"]
+
+
+def test_snapshot_without_votes_still_ranks():
+    snapshot = build_feed_snapshot(FEED)
+    for i in snapshot:
+        del i["votes"]
+    snapshot = FeedSnapshot(snapshot)
+    assert [i["title"] for i in snapshot.page(now=NOW, algorithm="decay")] == ["old", "new"]
@@ -0,0 +1,112 @@
+import json
+
+from flask_app.aggregate import vote_view
+from flask_app.schema import SCHEMA_VERSION, denormalize, normalize
+from flask_app.storage import JsonStore, SplitJsonStore
+
+from tests.test_storage import tweet_db_section
+
+
+def feed_db_section():
+    """
+    test_db.json's cluster with a quote bank and a feed built with the FeedDB vote view
+    """
+    with open("db/test_db.json") as f:
+        section = json.load(f)["Ethereum"]
+    # as Feed.fetch_tweets leaves it, the same dicts as the influencers' tweets
+    section["all_feed_tweets"] = [t for i in section["influencers"] for t in i.get("tweets") or []]
+    votes = section["all_feed_tweets"][:3]
+    for i in votes:
+        i.update(tweet_link=f"https://twitter.com/u/status/{i['id']}", author_username="u")
+    ref_tweet = {"id": "1", "text": "https://podcast.citydao.io/bryan-petes/"}
+    section["external_url_quote_tweet_bank"] = {
+        "1": {
+            "external_urls": ["https://podcast.citydao.io/bryan-petes/"],
+            "ref_tweet_data": ref_tweet,
+            "vote_tweets": votes,
+        }
+    }
+    section["external_url_feed"] = [
+        {
+            "title": None,
+            "ref_tweet": ref_tweet,
+            "ref_tweet_ids": ["1"],
+            "external_urls": ["https://podcast.citydao.io/bryan-petes/"],
+            "tweets": [vote_view(i) for i in votes],
+        }
+    ]
+    return section
+
+
+def test_tweets_are_written_once(tmp_path):
+    section = feed_db_section()
+    store = JsonStore(str(tmp_path / "db.json"))
+    store["Ethereum"] = section
+    store.save()
+
+    with open(tmp_path / "db.json") as f:
+        data = json.load(f)
+    assert data["schema"] == SCHEMA_VERSION
+    n_tweets = len({i["id"] for i in section["all_feed_tweets"]})
+    assert len(data["tweets"]) == n_tweets + 1, "every tweet once, plus the quoted tweet"
+    cluster = data["clusters"]["Ethereum"]
+    assert "all_feed_tweets" not in cluster
+    assert cluster["external_url_feed"][0]["vote_view"] == "vote"
+    assert cluster["external_url_feed"][0]["ref_tweet_id"] == "1"
+
+    reloaded = JsonStore(str(tmp_path / "db.json"))["Ethereum"]
+    assert reloaded == section
+    assert list(reloaded) == list(section), "keys keep their order"
+
+
+def test_copies_are_one_dict_after_load(tmp_path):
+    store = JsonStore(str(tmp_path / "db.json"))
+    store["Ethereum"] = feed_db_section()
+    store.save()
+
+    section = JsonStore(str(tmp_path / "db.json"))["Ethereum"]
+    by_id = {i["id"]: i for i in section["all_feed_tweets"]}
+    for i in section["influencers"]:
+        for i_tweet in i.get("tweets") or []:
+            assert i_tweet is by_id[i_tweet["id"]]
+    entry = section["external_url_quote_tweet_bank"]["1"]
+    assert all(i is by_id[i["id"]] for i in entry["vote_tweets"])
+    assert section["external_url_feed"][0]["ref_tweet"] is entry["ref_tweet_data"]
+
+
+def test_drifted_copies_are_merged():
+    section = feed_db_section()
+    influencer_tweet = next(t for i in section["influencers"] for t in i.get("tweets") or [])
+    feed_copy = dict(influencer_tweet, author_username="u")
+    section["all_feed_tweets"] = [feed_copy]
+
+    data = normalize({"Ethereum": section})
+    merged = data["tweets"][influencer_tweet["id"]]
+    assert merged["author_username"] == "u", "keys only one copy has are kept"
+    assert denormalize(json.loads(json.dumps(data)))["Ethereum"]["all_feed_tweets"] == [merged]
+
+
+def test_old_feed_entries_stay_inline():
+    with open("db/test_db2.json") as f:
+        old = json.load(f)
+    data = normalize(old)
+    assert data["clusters"]["Ethereum"]["external_url_feed"] == old["Ethereum"]["external_url_feed"]
+    assert denormalize(json.loads(json.dumps(data))) == old
+    assert denormalize(old) is old, "files from before the schema are read as they are"
+
+
+def test_split_store_tweet_db_round_trip(tmp_path):
+    store = SplitJsonStore(str(tmp_path / "tweet_db.d"))
+    store["Ethereum"] = tweet_db_section()
+    store.save()
+
+    with open(tmp_path / "tweet_db.d" / "Ethereum.json") as f:
+        data = json.load(f)
+    assert len(data["tweets"]) == 3
+    assert "tweet_ids" in data["section"]["alice"]
+    assert data["section"]["external_url_feed"][0]["vote_view"] == "tweet"
+
+    section = SplitJsonStore(str(tmp_path / "tweet_db.d"))["Ethereum"]
+    assert section == tweet_db_section()
+    vote = section["alice"]["tweets"][0]
+    assert section["external_url_feed"][0]["tweets"][0] is vote
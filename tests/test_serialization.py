@@ -0,0 +1,104 @@
+import os
+import json
+
+import pytest
+
+from flask_app.serialization import (
+    CODECS,
+    ENTRIES_HEADER,
+    benchmark_codecs,
+    detect_format,
+    read_snapshot,
+    write_snapshot,
+    zstandard,
+)
+from flask_app.storage import JsonStore
+
+
+def snapshot():
+    return {
+        "schema": 2,
+        "tweets": {
+            "1498622966694883333": {"id": "1498622966694883333", "text": "héllo", "public_metrics": {"like_count": 3}},
+            "1498577850688884736": {"id": "1498577850688884736", "text": "ref", "referenced_tweets": None},
+        },
+        "clusters": {"Ethereum": {"all_feed_tweet_ids": ["1498622966694883333"]}, "Empty": {}},
+        "empty": {},
+    }
+
+
+CASES = [
+    (codec, compression)
+    for codec in CODECS
+    for compression in [None, "gzip", "zstd"]
+    if CODECS[codec].available and (compression != "zstd" or zstandard is not None)
+]
+
+
+@pytest.mark.parametrize("codec,compression", CASES)
+@pytest.mark.parametrize("entries", [False, True])
+def test_round_trip(tmp_path, codec, compression, entries):
+    fpath = tmp_path / "db.snapshot"
+    write_snapshot(fpath, snapshot(), codec=codec, compression=compression, entries=entries)
+    assert detect_format(fpath)[1] == compression
+    assert read_snapshot(fpath) == snapshot()
+
+
+def test_extension_picks_format(tmp_path):
+    for fname, codec, compression in [
+        ("db.json", "json", None),
+        ("db.json.gz", "json", "gzip"),
+        ("db.msgpack", "msgpack", None),
+    ]:
+        fpath = tmp_path / fname
+        write_snapshot(fpath, snapshot())
+        detected_codec, detected_compression = detect_format(fpath)
+        assert (detected_codec == "msgpack") == (codec == "msgpack")
+        assert detected_compression == compression
+        assert read_snapshot(fpath) == snapshot()
+
+    # a plain .json file is still a single json document, and .jsonl is streamed one entry per line
+    with open(tmp_path / "db.json") as f:
+        assert json.load(f) == snapshot()
+    write_snapshot(tmp_path / "db.jsonl", snapshot())
+    with open(tmp_path / "db.jsonl") as f:
+        lines = [json.loads(i) for i in f]
+    assert lines[0] == ENTRIES_HEADER
+    assert ["tweets", "1498577850688884736", snapshot()["tweets"]["1498577850688884736"]] in lines
+
+
+def test_reads_pretty_printed_json(tmp_path):
+    fpath = tmp_path / "db.json"
+    with open(fpath, "w") as f:
+        json.dump(snapshot(), f, indent=4)
+    assert read_snapshot(fpath) == snapshot()
+
+
+def test_write_is_atomic(tmp_path):
+    fpath = tmp_path / "db.json"
+    write_snapshot(fpath, snapshot())
+
+    with pytest.raises(TypeError):
+        write_snapshot(fpath, {"not serializable": object()}, codec="json")
+    # the failed write left the previous snapshot in place and no temp file behind
+    assert read_snapshot(fpath) == snapshot()
+    assert os.listdir(tmp_path) == ["db.json"]
+
+
+def test_json_store_snapshot_formats(tmp_path):
+    source = JsonStore("db/test_db.json")
+    for fname in ["db.msgpack.zst" if zstandard else "db.msgpack.gz", "db.jsonl.gz"]:
+        if fname.startswith("db.msgpack") and not CODECS["msgpack"].available:
+            continue
+        store = JsonStore(str(tmp_path / fname))
+        for cluster_name in source:
+            store[cluster_name] = source[cluster_name]
+        store.save()
+        assert dict(JsonStore(str(tmp_path / fname))) == dict(source)
+
+
+def test_benchmark_codecs(tmp_path):
+    rows = benchmark_codecs(snapshot(), tmp_path, combinations=[("json", None, False), ("json", "gzip", True)], repeat=1)
+    assert [(i["codec"], i["compression"], i["entries"]) for i in rows] == [("json", None, False), ("json", "gzip", True)]
+    assert all(i["bytes"] > 0 and i["save_seconds"] >= 0 and i["load_seconds"] >= 0 for i in rows)
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,63 @@
+import aiohttp
+import pytest
+
+from flask_app import caches, credentials
+from flask_app.credentials import Credential, CredentialPool
+from flask_app.ingest import AsyncTwitterClient, default_start_time, fetch_influencers_tweets, run_sync
+from flask_app.standin import StandInServer
+
+
+@pytest.fixture()
+def pool(standin, tmp_path, monkeypatch):
+    monkeypatch.setattr(caches, "CACHE_DIR", tmp_path)
+    pool = CredentialPool([Credential("standin", "standin")])
+    monkeypatch.setattr(credentials, "_default_pool", pool)
+    return pool
+
+
+def test_pull_influencers_from_standin(standin, pool):
+    influencers = [dict(i) for i in standin.fixtures.clusters["Ethereum"]["influencers"][:50]]
+    results = run_sync(fetch_influencers_tweets(influencers, start_time=default_start_time(48)))
+    assert sum(len(i) for i in results) > 0, "the fixture tweets should be inside the window"
+    for i_influencer, tweets in zip(influencers, results):
+        assert "last_tweet_pull" in i_influencer
+        assert len(tweets) <= 10, "a single page of the default max_results"
+        created = [i["created_at"] for i in tweets]
+        assert created == sorted(created, reverse=True), "tweets come newest first"
+
+
+def test_standin_paginates_user_tweets(standin, pool):
+    user_id = max(standin.fixtures.timelines, key=lambda i: len(standin.fixtures.timelines[i]))
+
+    async def pull():
+        async with AsyncTwitterClient() as client:
+            return await client.get_users_tweets(user_id, max_results=5, paginate=True)
+
+    tweets = run_sync(pull())
+    assert [i["id"] for i in tweets] == standin.fixtures.timelines[user_id]
+
+
+def test_standin_rate_limits_per_token():
+    with StandInServer(limits={"/2/tweets": 2}, window=60) as server:
+        statuses = run_sync(_get_statuses(server.base_url, "/2/tweets?ids=1", ["a", "a", "a", "b"]))
+    assert [s for s, _ in statuses] == [200, 200, 429, 200]
+    assert statuses[1][1]["x-rate-limit-remaining"] == "0"
+    assert statuses[2][1]["x-rate-limit-remaining"] == "0"
+    assert server.stats["rate_limited_429"] == 1
+
+
+def test_standin_injects_429s():
+    with StandInServer(error_rate=0.5, seed=1) as server:
+        statuses = run_sync(_get_statuses(server.base_url, "/2/users?ids=1", ["a"] * 40))
+    n_429 = sum(s == 429 for s, _ in statuses)
+    assert 0 < n_429 < 40
+    assert n_429 == server.stats["injected_429"]
+
+
+async def _get_statuses(base_url, path, tokens):
+    statuses = []
+    async with aiohttp.ClientSession() as session:
+        for token in tokens:
+            async with session.get(base_url + path, headers={"Authorization": f"Bearer {token}"}) as res:
+                statuses.append((res.status, dict(res.headers)))
+    return statuses
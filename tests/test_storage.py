@@ -0,0 +1,168 @@
+import json
+
+from flask_app.storage import (
+    JsonStore,
+    SQLiteStore,
+    SplitJsonStore,
+    migrate_json_to_sqlite,
+    open_store,
+    split_json_db,
+)
+
+
+def tweet(id, created_at, **kwargs):
+    return {"id": id, "created_at": created_at, "text": f"tweet {id}", **kwargs}
+
+
+def tweet_db_section():
+    """
+    A small cluster in the TweetDB layout: users next to the quote bank and feed
+    """
+    vote = tweet(
+        "1498622966694883333",
+        "2022-03-01T11:35:32.000Z",
+        referenced_tweets=[{"type": "quoted", "id": "1498577850688884736"}],
+    )
+    ref_tweet = tweet("1498577850688884736", "2022-03-01T08:36:16.000Z")
+    return {
+        "alice": {
+            "tweets": [vote, tweet("1498301189909213185", "2022-02-28T14:16:55.000Z")],
+            "ids": {},
+            "last_pull": "2022-03-01 12:00:00",
+        },
+        "external_url_quote_tweet_bank": {
+            ref_tweet["id"]: {
+                "external_urls": ["https://podcast.citydao.io/bryan-petes/"],
+                "ref_tweet_data": ref_tweet,
+                "vote_tweets": [vote],
+            }
+        },
+        "external_url_feed": [
+            {
+                "title": "CityDAO",
+                "ref_tweet": ref_tweet,
+                "external_urls": ["https://podcast.citydao.io/bryan-petes/"],
+                "tweets": [vote],
+            }
+        ],
+    }
+
+
+def test_sqlite_migration_round_trip(tmp_path):
+    sqlite_fpath = tmp_path / "test_db2.sqlite"
+    migrate_json_to_sqlite("db/test_db2.json", str(sqlite_fpath))
+
+    with open("db/test_db2.json") as f:
+        expected = json.load(f)
+    store = SQLiteStore(str(sqlite_fpath))
+    assert list(store) == list(expected)
+    assert (
+        store.get_external_url_feed("Ethereum") == expected["Ethereum"]["external_url_feed"]
+    ), "feed should be readable without loading the cluster"
+    assert not store.is_loaded("Ethereum")
+    assert store["Ethereum"] == expected["Ethereum"]
+
+
+def test_sqlite_user_tweets_since(tmp_path):
+    store = SQLiteStore(str(tmp_path / "tweet_db.sqlite"))
+    store["Ethereum"] = tweet_db_section()
+    store.save()
+
+    reopened = SQLiteStore(str(tmp_path / "tweet_db.sqlite"))
+    tweets = reopened.get_user_tweets_since("Ethereum", "2022-03-01T00:00:00.000Z")
+    assert [i["id"] for i in tweets] == ["1498622966694883333"]
+    assert reopened["Ethereum"] == tweet_db_section()
+
+    json_store = JsonStore(str(tmp_path / "missing.json"))
+    json_store["Ethereum"] = tweet_db_section()
+    assert json_store.get_user_tweets_since("Ethereum", "2022-03-01T00:00:00.000Z") == tweets
+
+
+def test_split_store_loads_on_demand_and_evicts(tmp_path):
+    dirpath = tmp_path / "tweet_db.d"
+    store = SplitJsonStore(str(dirpath))
+    for cluster_name in ["Ethereum", "Python", "Bitcoin"]:
+        store[cluster_name] = tweet_db_section()
+    store.save()
+
+    cluster_bytes = (dirpath / "Ethereum.json").stat().st_size
+    lazy = open_store(str(dirpath), max_bytes=cluster_bytes * 2, read_only=True)
+    assert isinstance(lazy, SplitJsonStore)
+    assert list(lazy) == ["Ethereum", "Python", "Bitcoin"]
+    assert not any(lazy.is_loaded(i) for i in lazy), "nothing should load until asked for"
+
+    assert lazy["Ethereum"] == tweet_db_section()
+    lazy["Python"]
+    lazy["Bitcoin"]
+    assert not lazy.is_loaded("Ethereum"), "least recently used cluster should be evicted"
+    assert lazy.loaded_bytes() <= cluster_bytes * 2
+    assert lazy["Ethereum"] == tweet_db_section(), "evicted clusters reload from disk"
+
+
+def test_split_json_db(tmp_path):
+    store = split_json_db("db/test_db2.json", str(tmp_path / "test_db2.d"))
+    with open("db/test_db2.json") as f:
+        assert SplitJsonStore(store.fpath)["Ethereum"] == json.load(f)["Ethereum"]
+
+
+def test_sqlite_keeps_duplicate_influencers_once_and_saves_only_changes(tmp_path, monkeypatch):
+    fpath = str(tmp_path / "feed_db.sqlite")
+    influencer = lambda name, tweets: {
+        "social_account": {"social_account": {"screen_name": name}},
+        "tweets": tweets,
+    }
+    store = SQLiteStore(fpath)
+    store["Ethereum"] = {
+        "influencers": [
+            influencer("alice", [tweet("1", "2022-03-01T00:00:00.000Z")]),
+            influencer("bob", []),
+            influencer("alice", [tweet("1", "2022-03-01T00:00:00.000Z")]),  # ranked on two pages
+        ],
+    }
+    store["Bitcoin"] = tweet_db_section()
+    store.save()
+
+    reopened = SQLiteStore(fpath)
+    assert [i["social_account"]["social_account"]["screen_name"] for i in reopened["Ethereum"]["influencers"]] == [
+        "alice",
+        "bob",
+    ]
+
+    written = []
+    write_section = reopened._write_section
+
+    def record_write(cluster_name, section, keys=None):
+        written.append((cluster_name, keys))
+        write_section(cluster_name, section, keys)
+
+    monkeypatch.setattr(reopened, "_write_section", record_write)
+    reopened["Bitcoin"]["alice"] = {**reopened["Bitcoin"]["alice"], "last_pull": "2022-03-02 12:00:00"}
+    reopened.save()
+    reopened.save()
+    assert written == [("Bitcoin", {"alice"})], "Ethereum was only read, and nothing changed since the first save"
+    assert SQLiteStore(fpath)["Bitcoin"]["alice"]["last_pull"] == "2022-03-02 12:00:00"
+
+    reopened.save(str(tmp_path / "copy.sqlite"))
+    assert SQLiteStore(str(tmp_path / "copy.sqlite"))["Bitcoin"] == reopened["Bitcoin"]
+
+
+def test_sqlite_save_upserts_and_deletes_only_what_changed(tmp_path):
+    fpath = str(tmp_path / "tweet_db.sqlite")
+    store = SQLiteStore(fpath)
+    store["Bitcoin"] = {**tweet_db_section(), "bob": {"tweets": [tweet("2", "2022-03-01T00:00:00.000Z")], "ids": {}}}
+    store.save()
+    count = lambda table: store.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    rowids = lambda table: store.conn.execute(f"SELECT rowid FROM {table} ORDER BY rowid").fetchall()
+    feed_rows = rowids("feed_entries")
+    assert (count("user_tweets"), count("quote_bank"), count("quote_votes")) == (3, 1, 1)
+
+    section = store["Bitcoin"]
+    section["alice"] = {**section["alice"], "tweets": section["alice"]["tweets"][:1]}
+    section["external_url_quote_tweet_bank"] = {}
+    del section["bob"]
+    store.save()
+
+    assert rowids("feed_entries") == feed_rows, "the feed wasn't changed, its rows are left alone"
+    assert (count("user_tweets"), count("quote_bank"), count("quote_votes")) == (1, 0, 0)
+    assert count("influencers") == 1
+    assert SQLiteStore(fpath)["Bitcoin"] == section
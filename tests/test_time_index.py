@@ -0,0 +1,54 @@
+import random
+import datetime
+
+from flask_app.time_index import ClusterTimeIndex, as_epoch
+
+
+def tweet(id, created_at):
+    return {"id": id, "created_at": created_at, "text": f"tweet {id}"}
+
+
+def random_users(n_users=20, n_tweets=30, seed=0):
+    rng = random.Random(seed)
+    start = datetime.datetime(2022, 2, 20)
+    users = {}
+    for u in range(n_users):
+        times = sorted(
+            (start + datetime.timedelta(minutes=rng.randint(0, 14 * 24 * 60)) for _ in range(n_tweets)),
+            reverse=True,
+        )
+        users[f"user{u}"] = {
+            "tweets": [tweet(f"{u}-{i}", t.strftime("%Y-%m-%dT%H:%M:%S.000Z")) for i, t in enumerate(times)]
+        }
+    return users
+
+
+def test_iter_newest_matches_full_scan():
+    users = random_users()
+    index = ClusterTimeIndex.from_users(users)
+    start_time = "2022-03-01T00:00:00.000Z"
+
+    expected = sorted(
+        (t for u in users.values() for t in u["tweets"] if t["created_at"] > start_time),
+        key=lambda t: t["created_at"],
+        reverse=True,
+    )
+    merged = list(index.iter_newest(start_time))
+    assert [t["created_at"] for t in merged] == [t["created_at"] for t in expected]
+    assert index.count_since(start_time) == len(expected)
+    assert list(index.iter_newest(start_time, limit=10)) == merged[:10]
+    assert len(list(index.iter_newest())) == len(index) == 20 * 30
+
+
+def test_update_user():
+    index = ClusterTimeIndex.from_users({"a": {"tweets": [tweet("1", "2022-03-01T00:00:00.000Z")]}})
+    index.update_user("b", {"tweets": [tweet("2", "2022-03-02T00:00:00.000Z")]})
+    assert [t["id"] for t in index.iter_newest()] == ["2", "1"]
+
+
+def test_as_epoch():
+    epoch = as_epoch("2022-03-01T00:00:00.000Z")
+    assert as_epoch("2022-03-01 00:00:00") == epoch
+    assert as_epoch(datetime.datetime(2022, 3, 1)) == epoch
+    assert as_epoch("2022-02-28T19:00:00-05:00") == epoch
+    assert as_epoch(epoch) == epoch
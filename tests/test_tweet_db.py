@@ -0,0 +1,106 @@
+from flask_app.storage import JsonStore, SQLiteStore
+from flask_app.tweet_db import TweetDB, merge_user_tweets, newest_tweet_id
+
+
+def tweet(id, created_at):
+    return {"id": id, "created_at": created_at, "text": f"tweet {id}"}
+
+
+def test_merge_user_tweets_dedups_and_orders():
+    user_data = {
+        "tweets": [
+            tweet("1498301189909213185", "2022-02-28T14:16:55.000Z"),
+            tweet("1498001189909213185", "2022-02-27T18:24:01.000Z"),
+        ],
+        "ids": {},
+        "last_pull": "2022-02-28 15:00:00",
+    }
+    new_tweets = [
+        tweet("1498622966694883333", "2022-03-01T11:35:32.000Z"),
+        tweet("1498301189909213185", "2022-02-28T14:16:55.000Z"),  # already held
+    ]
+    merged = merge_user_tweets(user_data, new_tweets, "273931982", "2022-03-01 12:00:00")
+
+    assert [i["id"] for i in merged["tweets"]] == [
+        "1498622966694883333",
+        "1498301189909213185",
+        "1498001189909213185",
+    ], "tweets should be deduped and newest first"
+    assert merged["newest_id"] == "1498622966694883333"
+    assert newest_tweet_id(merged) == "1498622966694883333"
+    assert merged["last_pull"] == "2022-03-01 12:00:00"
+    assert len(merged["ids"]) == 3
+    assert user_data["last_pull"] == "2022-02-28 15:00:00", "merge must not mutate the old record"
+
+
+def test_newest_tweet_id_without_tweets():
+    assert newest_tweet_id({"tweets": [], "ids": {}}) is None
+
+
+def vote(author_id, created_at):
+    return {"id": f"{author_id}-{created_at}", "author_id": author_id, "created_at": created_at, "text": "vote"}
+
+
+def influencer(user_id, attention_score, change_week):
+    return {
+        "social_account": {"social_account": {"id": user_id, "screen_name": f"user_{user_id}"}},
+        "attention_score": attention_score,
+        "attention_score_change_week": change_week,
+    }
+
+
+def test_served_feed_is_weighted_by_stored_attention(tmp_path):
+    feed = [
+        {
+            "ref_tweet": {"id": ref_tweet_id, "created_at": "2022-03-01T00:00:00.000Z"},
+            "external_urls": [f"https://example.com/{ref_tweet_id}"],
+            "title": ref_tweet_id,
+            "tweets": [vote(i, "2022-03-01T01:00:00.000Z") for i in voters],
+        }
+        for ref_tweet_id, voters in [("crowd", ["1", "2", "3"]), ("whale", ["4", "5"])]
+    ]
+    fpath = str(tmp_path / "tweet_db.json")
+    store = JsonStore(fpath)
+    store["Ethereum"] = {
+        "alice": {"tweets": [tweet("1", "2022-03-01T00:00:00.000Z")], "ids": {}},
+        "external_url_feed": feed,
+    }
+    store.save()
+
+    db = TweetDB(fpath)
+    db.set_influencer_attention(
+        "Ethereum",
+        [
+            influencer("1", 1.0, -0.5),
+            influencer("2", 1.0, -0.5),
+            influencer("3", 1.0, -0.5),
+            influencer("4", 5.0, 0.0),
+            influencer("5", 0.5, 4.0),
+        ],
+    )
+    db.save()
+
+    snapshot = TweetDB(fpath, read_only=True).get_feed_snapshot("Ethereum")
+    titles = lambda algorithm: [i["title"] for i in snapshot.page(algorithm=algorithm)]
+    assert titles("shares") == ["crowd", "whale"]
+    assert titles("attention") == ["whale", "crowd"]
+    assert titles("rising") == ["whale", "crowd"]
+
+
+def test_sqlite_feed_query_does_not_load_the_cluster(tmp_path):
+    fpath = str(tmp_path / "tweet_db.sqlite")
+    store = SQLiteStore(fpath)
+    store["Ethereum"] = {
+        "alice": {"tweets": [tweet("3", "2022-03-01T12:00:00.000Z"), tweet("1", "2022-02-28T12:00:00.000Z")]},
+        "bob": {"tweets": [tweet("2", "2022-03-01T06:00:00.000Z")]},
+    }
+    store.save()
+
+    db = TweetDB(fpath)
+    feed = db.get_feed("Ethereum", "2022-03-01T00:00:00.000Z")
+    assert [i["id"] for i in feed] == ["3", "2"]
+    assert not db._db.is_loaded("Ethereum")
+    assert [i["id"] for i in db.get_feed("Ethereum", None, limit=2)] == ["3", "2"]
+
+    db.get_time_index("Ethereum")  # loads it, the time index answers from here on
+    assert db.get_feed("Ethereum", "2022-03-01T00:00:00.000Z") == feed
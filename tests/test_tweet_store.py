@@ -0,0 +1,97 @@
+import gc
+import json
+import tracemalloc
+
+from flask_app.storage import JsonStore
+from flask_app.time_index import ClusterTimeIndex
+from flask_app.tweet_db import TweetDB
+from flask_app.tweet_store import (
+    ClusterTweets,
+    TweetList,
+    TweetRecord,
+    compact_section,
+    is_compact,
+    thaw_section,
+)
+
+from tests.test_storage import tweet_db_section
+from tests.test_time_index import random_users
+
+
+def test_record_round_trip():
+    with open("db/test_db.json") as f:
+        tweets = json.load(f)["Ethereum"]["all_feed_tweets"]
+    odd = [
+        {"id": "10", "text": None, "created_at": "2022-03-01T11:35:32Z"},  # not twitter's format
+        {"id": "11", "author_username": None, "tweet_link": "https://twitter.com/i/web/status/11"},
+        {"id": "12", "tweet_link": "https://example.com", "author_username": "bob"},
+        {
+            "id": "13",
+            "referenced_tweets": [{"type": "quoted", "id": "1"}, {"type": "replied_to", "id": "2"}],
+            "public_metrics": {"like_count": 1},
+            "entities": {"urls": [{"expanded_url": "https://example.com"}]},
+        },
+    ]
+    for i_tweet in tweets + odd:
+        assert TweetRecord.from_dict(i_tweet).to_dict() == i_tweet
+
+    store = ClusterTweets({i["id"]: i for i in tweets + odd}.values())
+    for i_tweet in tweets + odd:
+        assert store.get(i_tweet["id"]) == i_tweet
+    assert store.record(0).metrics == tuple(tweets[0]["public_metrics"].values())
+
+
+def test_compact_section_round_trip():
+    with open("db/test_db.json") as f:
+        section = json.load(f)["Ethereum"]
+    compact = compact_section(section)
+    assert is_compact(compact) and not is_compact(section)
+    assert isinstance(compact["all_feed_tweets"], TweetList)
+    assert compact == section
+    assert thaw_section(compact) == section
+
+    thawed = thaw_section(compact_section(tweet_db_section()))
+    assert thawed == tweet_db_section()
+    assert thawed["external_url_quote_tweet_bank"]["1498577850688884736"]["vote_tweets"][0] is (
+        thawed["alice"]["tweets"][0]
+    ), "thawed tweets are one dict per id"
+
+
+def test_compact_section_is_a_fraction_of_the_dicts():
+    with open("db/test_db.json") as f:
+        raw = f.read()
+    gc.collect()
+    tracemalloc.start()
+    section = json.loads(raw)["Ethereum"]
+    as_dicts = tracemalloc.get_traced_memory()[0]
+    section = compact_section(section)
+    gc.collect()
+    compact = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert compact < as_dicts / 2, f"{compact} bytes compact vs {as_dicts} as dicts"
+
+
+def test_time_index_over_compact_tweets():
+    users = random_users()
+    for i, user in enumerate(users.values()):
+        for j, i_tweet in enumerate(user["tweets"]):
+            i_tweet["id"] = str(i * 1000 + j)
+    compact = compact_section(users)
+    start_time = "2022-03-01T00:00:00.000Z"
+    expected = list(ClusterTimeIndex.from_users(users).iter_newest(start_time))
+    assert list(ClusterTimeIndex.from_users(compact).iter_newest(start_time)) == expected
+
+
+def test_read_only_tweet_db_is_compact(tmp_path):
+    store = JsonStore(str(tmp_path / "tweet_db.json"))
+    store["Ethereum"] = tweet_db_section()
+    store.save()
+
+    db = TweetDB(str(tmp_path / "tweet_db.json"), read_only=True)
+    assert is_compact(db._db["Ethereum"])
+    assert db.get_feed("Ethereum", "2022-03-01T00:00:00.000Z") == [tweet_db_section()["alice"]["tweets"][0]]
+    assert db.get_quote_tweet_bank("Ethereum") == tweet_db_section()["external_url_quote_tweet_bank"]
+
+    db._thaw("Ethereum")
+    assert not is_compact(db._db["Ethereum"])
+    assert db._db["Ethereum"] == tweet_db_section()
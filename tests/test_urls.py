@@ -0,0 +1,76 @@
+from flask_app.urls import canonicalize_url, extract_external_urls, is_twitter_url
+
+
+class FakeResolver:
+    """
+    Resolves from a dict and remembers what it was asked, so tests never touch the network
+    """
+
+    def __init__(self, redirects):
+        self.redirects = redirects
+        self.resolved = []
+
+    def resolve(self, url):
+        self.resolved.append(url)
+        return self.redirects.get(url)
+
+
+def test_entities_skip_resolution():
+    tweet = {
+        "text": "worth a read https://t.co/abc https://t.co/def https://t.co/ghi",
+        "entities": {
+            "urls": [
+                {
+                    "url": "https://t.co/abc",
+                    "expanded_url": "https://podcast.citydao.io/bryan-petes/?utm_source=twitter",
+                },
+                {
+                    "url": "https://t.co/def",
+                    "expanded_url": "https://twitter.com/CityDAO/status/1498577850688884736",
+                },
+                {"url": "https://t.co/ghi", "expanded_url": "https://bit.ly/3ssL1nK"},
+            ]
+        },
+    }
+    resolver = FakeResolver({"https://bit.ly/3ssL1nK": "https://ethereum.org/en/"})
+    assert extract_external_urls(tweet, resolver=resolver) == [
+        "https://podcast.citydao.io/bryan-petes/?utm_source=twitter",
+        "https://ethereum.org/en/",
+    ]
+    assert resolver.resolved == [
+        "https://bit.ly/3ssL1nK"
+    ], "only links behind a shortener should be resolved"
+
+
+def test_text_fallback_resolves_every_link():
+    tweet = {"text": "old tweet without entities https://t.co/abc"}
+    resolver = FakeResolver({"https://t.co/abc": "https://ethereum.org/en/"})
+    assert extract_external_urls(tweet, resolver=resolver) == ["https://ethereum.org/en/"]
+
+
+def test_is_twitter_url():
+    assert is_twitter_url("https://mobile.twitter.com/i/spaces/1")
+    assert is_twitter_url("https://www.twitter.com/vitalikbuterin")
+    assert not is_twitter_url("https://blog.example.com/?ref=twitter")
+
+
+def test_canonicalize_url():
+    assert (
+        canonicalize_url("https://www.Example.com/post/?utm_source=twitter&b=2&a=1#comments")
+        == "https://example.com/post?a=1&b=2"
+    )
+    assert canonicalize_url("http://example.com:80//a//b/") == "https://example.com/a/b"
+    assert canonicalize_url("https://example.com") == "https://example.com/"
+    assert canonicalize_url("https://example.com:8080/x?fbclid=1") == "https://example.com:8080/x"
+    assert (
+        canonicalize_url("https://github.com/org/repo/compare?ref=v2&ref_src=twsrc")
+        == "https://github.com/org/repo/compare?ref=v2"
+    ), "ref is content, ref_src is tracking"
+
+
+def test_canonicalize_url_keeps_app_routes_and_bad_urls():
+    assert canonicalize_url("https://ex.com/#/route/x") == "https://ex.com/#/route/x"
+    assert canonicalize_url("https://ex.com/#!/route/y") == "https://ex.com/#!/route/y"
+    assert canonicalize_url("https://ex.com/#/route/x") != canonicalize_url("https://ex.com/#/route/y")
+    assert canonicalize_url("http://example.com:99999/a") == "http://example.com:99999/a"
+    assert canonicalize_url("http://[::1/a") == "http://[::1/a"
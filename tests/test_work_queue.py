@@ -0,0 +1,46 @@
+import concurrent.futures
+
+from flask_app import build_all
+from flask_app.work_queue import DONE, FAILED, WorkQueue
+
+
+def test_items_are_deduped_claimed_once_and_retried(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.sqlite", max_attempts=2)
+    assert queue.put_many("influencer", [("alice", {"n": 1}), ("bob", {"n": 2})]) == 2
+    assert queue.put_many("influencer", [("alice", {"n": 3})]) == 0, "alice is in two clusters, pull her once"
+
+    first = queue.claim("influencer", 1)
+    assert [(key, payload) for _, key, payload in first] == [("alice", {"n": 1})]
+    other = WorkQueue(tmp_path / "queue.sqlite")
+    assert [key for _, key, _ in other.claim("influencer", 5)] == ["bob"]
+    assert other.claim("influencer", 5) == []
+
+    queue.done(first[0][0], {"tweets": []})
+    assert queue.results("influencer") == {"alice": {"tweets": []}}
+
+    # bob's worker died, a restart puts him back, and his second attempt fails too
+    assert queue.requeue_running() == 1
+    (item_id, _, _), = queue.claim("influencer")
+    queue.fail(item_id, "pull failed")
+    assert queue.counts("influencer") == {DONE: 1, FAILED: 1}
+    assert queue.remaining("influencer") == 0
+
+
+def test_drain_follows_new_items(tmp_path, monkeypatch):
+    """
+    Each "count" item queues the next number until 10, drain keeps going until the stage is empty
+    """
+
+    def run_count(queue, items, start_time):
+        for item_id, key, payload in items:
+            if payload < 10:
+                queue.put("count", payload + 1, payload + 1)
+            queue.done(item_id, payload)
+
+    monkeypatch.setitem(build_all.RUNNERS, "count", run_count)
+    queue = WorkQueue(tmp_path / "queue.sqlite")
+    queue.put("count", 0, 0)
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        stats = build_all.drain(executor, queue, "count", 1, 2, None)
+    assert stats["items"] == 11
+    assert sorted(queue.results("count").values()) == list(range(11))